@@ -0,0 +1,41 @@
+import os
+
+from engine import GROUPS
+
+# Gewichte je Gruppe aus engine.GROUPS, z. B. "control:1,treatment:1" (abwechselnd) oder "control:2,treatment:1"
+DEFAULT_GROUP_RATIOS = "control:1,treatment:1"
+
+
+def parse_ratios(spec):
+    ratios = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        arm, _, weight = part.partition(":")
+        arm = arm.strip()
+        if arm not in GROUPS:
+            raise ValueError(f"Unknown group {arm!r}, expected one of {sorted(GROUPS)}")
+        weight = weight.strip() or "1"
+        if not weight.isdigit() or int(weight) < 1:
+            raise ValueError(f"Weight for group {arm!r} must be a positive integer")
+        ratios.append((arm, int(weight)))
+    if not ratios:
+        raise ValueError("At least one group is required")
+    return ratios
+
+
+GROUP_RATIOS = parse_ratios(os.getenv("GROUP_RATIOS", DEFAULT_GROUP_RATIOS))
+
+
+# Slot n (ab 1) wird deterministisch auf einen Block der Laenge sum(weights) abgebildet
+def arm_for_slot(slot, ratios=GROUP_RATIOS):
+    position = (slot - 1) % sum(weight for _, weight in ratios)
+    for arm, weight in ratios:
+        if position < weight:
+            return arm
+        position -= weight
+
+
+def assign_group(ratios=GROUP_RATIOS):
+    from db_utils import next_assignment_slot
+    return arm_for_slot(next_assignment_slot(), ratios)
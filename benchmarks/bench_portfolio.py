@@ -0,0 +1,93 @@
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import Player, Stock  # noqa: E402
+from views import portfolio_table  # noqa: E402
+
+# Vergleicht die Array-Bewertung mit der frueheren dict-basierten Variante aus game_page
+
+
+def legacy_table(portfolio, capital, stocks):
+    portfolio_data = []
+    for stock_name, data in portfolio.items():
+        stock_obj = next(s for s in stocks if s.name == stock_name)
+        value = data["amount"] * stock_obj.price
+        change = ((stock_obj.price - data["buy_price"]) / data["buy_price"]) * 100 if data["buy_price"] != 0 else 0
+        gain_loss = round((stock_obj.price - data["buy_price"]) * data["amount"], 2)
+        portfolio_data.append([
+            stock_name, data["amount"], f"{round(data['buy_price'], 2):.2f}€", f"{round(stock_obj.price, 2):.2f}€",
+            f"{round(value, 2):.2f}€", f"{round(change, 2)}%", f"{round(gain_loss, 2):.2f}€"
+        ])
+    df = pd.DataFrame(portfolio_data, columns=["Stock", "Amount", "Buy Price", "Current Price", "Value (€)", "Change", "Gain/Loss (€)"])
+    total_invested = sum(d["amount"] * d["buy_price"] for d in portfolio.values())
+    total_market_value = sum(d["amount"] * next(s for s in stocks if s.name == n).price for n, d in portfolio.items())
+    total_with_capital = total_market_value + capital
+    total_change = round(((total_with_capital / 1000 - 1) * 100), 2) if total_invested else 0.0
+    df.loc[len(df.index)] = ["Cash", "", "", "", f"{round(capital, 2):.2f}€", "", ""]
+    df.loc[len(df.index)] = ["Total", "", "", "", f"{round(total_with_capital, 2):.2f}€", f"{total_change}%", f"{round(total_with_capital - 1000, 2):.2f}€"]
+    return df
+
+
+def legacy_total_value(portfolio, capital, stocks):
+    value = capital
+    for name, data in portfolio.items():
+        stock = next((s for s in stocks if s.name == name), None)
+        if stock:
+            value += data["amount"] * stock.price
+    return round(value, 2)
+
+
+def make_game(n_stocks, n_trades, seed=0):
+    rng = np.random.default_rng(seed)
+    prices = rng.uniform(20, 80, size=(n_stocks, 15))
+    stocks = [Stock(f"Stock {i}", prices[i]) for i in range(n_stocks)]
+    for stock in stocks:
+        stock.update_price(10)
+    player = Player(capital=1_000_000, stock_names=[s.name for s in stocks])
+    legacy = {}
+    for _ in range(n_trades):
+        stock = stocks[rng.integers(n_stocks)]
+        amount = int(rng.integers(1, 5))
+        player.buy(stock, amount, 10)
+        if stock.name in legacy:
+            legacy[stock.name]["amount"] += amount
+            legacy[stock.name]["buy_price"] = (legacy[stock.name]["buy_price"] + stock.price) / 2
+        else:
+            legacy[stock.name] = {"amount": amount, "buy_price": stock.price}
+    return player, legacy, stocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-rerun cost of portfolio valuation and table construction.")
+    parser.add_argument("--stocks", type=int, nargs="+", default=[5, 50, 500])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'stocks':>6} {'legacy table':>14} {'array table':>14} {'legacy total':>14} {'array total':>14}")
+    for n_stocks in args.stocks:
+        player, legacy, stocks = make_game(n_stocks, n_trades=3 * n_stocks)
+
+        assert legacy_total_value(legacy, player.capital, stocks) == player.total_value(stocks)
+        assert legacy_table(legacy, player.capital, stocks).equals(portfolio_table(player, stocks))
+
+        timings = [
+            min(timeit.repeat(fn, number=1, repeat=args.repeat)) * 1000
+            for fn in (
+                lambda: legacy_table(legacy, player.capital, stocks),
+                lambda: portfolio_table(player, stocks),
+                lambda: legacy_total_value(legacy, player.capital, stocks),
+                lambda: player.total_value(stocks),
+            )
+        ]
+        print(f"{n_stocks:>6} " + " ".join(f"{t:>11.3f} ms" for t in timings))
+
+
+if __name__ == "__main__":
+    main()
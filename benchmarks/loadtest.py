@@ -0,0 +1,240 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Simuliert N Spieler ueber streamlit.testing (AppTest) gegen eine lokale SQLite-Datenbank.
+# AppTest haelt globalen Runtime-Zustand, daher laeuft jede gleichzeitige Session in einem
+# eigenen Prozess. Die Umgebung muss vor dem Import von db_utils gesetzt sein.
+
+STOCK_NAMES = ["Aurora Tech", "Borealis Energy", "Cobalt Health", "Driftwood Retail", "Lunaris Ventures"]
+UP_PROBABILITIES = [0.40, 0.45, 0.50, 0.55, 0.60]
+
+
+def configure_environment(workdir, worker=None):
+    os.environ["DB_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = os.path.join(workdir, "loadtest.sqlite3")
+    # Jeder Prozess bekommt sein eigenes Journal
+    os.environ["DB_SPOOL_DIR"] = os.path.join(workdir, "spool" if worker is None else f"spool-{worker}")
+    os.environ["IP_LOOKUP_URL"] = ""
+
+
+def seed_prices(seed, periods=15):
+    from db_utils import get_db
+    from migrations import migrate
+    from storage import get_storage
+
+    migrate()
+    rng = random.Random(seed)
+    rows = []
+    for name, p_up in zip(STOCK_NAMES, UP_PROBABILITIES):
+        price = float(rng.randint(20, 60))
+        for period in range(1, periods + 1):
+            rows.append((name, period, price))
+            price += rng.choice([1, 2, 3]) if rng.random() < p_up else -rng.choice([1, 2])
+    with get_db() as conn, conn.cursor() as cursor:
+        cursor.execute("DELETE FROM stock_prices")
+        get_storage().insert_many(cursor, "INSERT INTO stock_prices (stock_name, period, price) VALUES %s", rows)
+
+
+class Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.db_calls = 0
+        self.peak_connections = 0
+        self.latencies = []
+        self.errors = []
+        # user_id -> erwarteter Endwert
+        self.finals = {}
+
+
+def instrument_storage(counters):
+    from storage import get_storage
+
+    storage = get_storage()
+    connection = storage.connection
+
+    def counted():
+        with counters.lock:
+            counters.db_calls += 1
+            counters.peak_connections = max(counters.peak_connections, storage.stats().get("connections", 0))
+        return connection()
+
+    storage.connection = counted
+
+
+def timed_run(at, counters, element=None):
+    start = time.perf_counter()
+    (element or at).run()
+    elapsed = time.perf_counter() - start
+    with counters.lock:
+        counters.latencies.append(elapsed)
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+
+
+def play(player_id, seed, counters, max_trades):
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed * 100_003 + player_id)
+    at = AppTest.from_file(os.path.join(ROOT, "boersenspiel_app.py"), default_timeout=60)
+    try:
+        timed_run(at, counters)
+        at.slider[0].set_value(rng.randint(18, 70))
+        at.slider[1].set_value(rng.randint(1, 10))
+        at.text_input[0].input(f"player{player_id}@example.org")
+        at.button(key="start_button_landing").click()
+        timed_run(at, counters)
+
+        while at.session_state.page == "Simulation":
+            for _ in range(rng.randint(0, max_trades)):
+                at.selectbox[0].select(rng.choice(["Buy", "Sell"]))
+                at.selectbox[1].select(rng.choice(STOCK_NAMES))
+                at.number_input[0].set_value(rng.randint(1, 5))
+                execute = next(b for b in at.button if b.label == "Execute")
+                execute.click()
+                timed_run(at, counters)
+            next_period = [b for b in at.button if "Next Period" in b.label]
+            if not next_period:
+                timed_run(at, counters)
+                continue
+            next_period[0].click()
+            timed_run(at, counters)
+        # Final page
+        timed_run(at, counters)
+        check_final_value(at, counters)
+    except Exception as exc:
+        with counters.lock:
+            counters.errors.append(f"player {player_id}: {exc}")
+
+
+def expected_final_value(snapshot):
+    # Unabhaengig von der App: Cash + Bestaende zum Kurs der letzten Periode
+    from engine import END_PERIOD
+    from gamestate import load
+    from prices import get_price_matrix
+
+    game = load(snapshot, get_price_matrix)
+    prices = {stock.name: float(stock.price_history[END_PERIOD - 1]) for stock in game.stocks}
+    return game.player.capital + sum(h["amount"] * prices[name] for name, h in game.player.portfolio.items())
+
+
+def check_final_value(at, counters):
+    expected = expected_final_value(at.session_state.game)
+    total = at.session_state.total_value
+    if abs(total - expected) > 1e-6:
+        raise AssertionError(f"final value {total} != {expected} (prices of the last period)")
+    with counters.lock:
+        counters.finals[at.session_state.user_id] = expected
+
+
+def check_saved_results(counters):
+    # Gespeicherter Endwert (Grundlage der Auszahlung) nach dem Leeren der Warteschlangen
+    from db_utils import get_db
+
+    with get_db() as conn, conn.cursor() as cursor:
+        for user_id, expected in counters.finals.items():
+            cursor.execute("SELECT total_value FROM results WHERE user_id = %s", (user_id,))
+            row = cursor.fetchone()
+            if row is None or abs(row[0] - expected) > 1e-6:
+                counters.errors.append(f"saved result for {user_id}: {row and row[0]} != {expected}")
+
+
+def run_worker(worker, workdir, player_ids, seed, max_trades):
+    configure_environment(workdir, worker)
+    import db_utils
+
+    counters = Counters()
+    instrument_storage(counters)
+    for player_id in player_ids:
+        play(player_id, seed, counters, max_trades)
+    db_utils.flush_actions(timeout=30)
+    check_saved_results(counters)
+    return {
+        "latencies": counters.latencies,
+        "db_calls": counters.db_calls,
+        "peak_connections": counters.peak_connections,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "write_status": db_utils.get_write_status(),
+        "errors": counters.errors,
+    }
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    index = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent virtual players against one app process.")
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4, help="parallel sessions (worker processes)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--max-trades", type=int, default=3, help="random trades per period (0..n)")
+    parser.add_argument("--max-p95", type=float, default=None, help="fail if p95 rerun latency (s) exceeds this")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="boersenspiel-load-")
+    configure_environment(workdir)
+    seed_prices(args.seed)
+
+    workers = max(1, min(args.concurrency, args.players))
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [
+            pool.submit(run_worker, worker, workdir, list(range(worker, args.players, workers)),
+                        args.seed, args.max_trades)
+            for worker in range(workers)
+        ]
+        results = [future.result() for future in futures]
+    wall = time.perf_counter() - start
+
+    latencies = [latency for result in results for latency in result["latencies"]]
+    db_calls = sum(result["db_calls"] for result in results)
+    errors = [error for result in results for error in result["errors"]]
+    report = {
+        "players": args.players,
+        "concurrency": workers,
+        "seed": args.seed,
+        "reruns": len(latencies),
+        "wall_seconds": round(wall, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "db_calls": db_calls,
+        "db_calls_per_rerun": round(db_calls / len(latencies), 3) if latencies else 0.0,
+        "peak_connections_per_process": max(result["peak_connections"] for result in results),
+        "peak_rss_mb_per_process": round(max(result["peak_rss_mb"] for result in results), 1),
+        "pending_writes": sum(result["write_status"]["pending"] for result in results),
+        # Trades, die die Datenbank gegen Konto/Bestand abgelehnt hat; sollte 0 sein
+        "rejected_trades": sum(result["write_status"]["rejected_trades"] for result in results),
+        "errors": errors,
+    }
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if errors:
+        sys.exit(1)
+    if args.max_p95 is not None and report["p95_ms"] > args.max_p95 * 1000:
+        print(f"p95 {report['p95_ms']} ms exceeds budget {args.max_p95 * 1000} ms", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
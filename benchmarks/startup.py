@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Kaltstart der App: jede Messung in einem frischen Interpreter.
+# "import" misst die Module, die boersenspiel_app.py auf oberster Ebene laedt,
+# "render" die erste Ausfuehrung der Landing Page ueber AppTest (ohne den AppTest-Import).
+# Zusaetzlich wird geprueft, dass dabei keine schweren Module geladen werden und die
+# Datenbank unberuehrt bleibt.
+
+HEAVY_MODULES = ("pandas", "numpy", "matplotlib", "requests", "pyarrow", "psycopg2", "dotenv")
+
+IMPORT_PROBE = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import streamlit, db_utils, metrics
+print(json.dumps({{"ms": (time.perf_counter() - start) * 1000}}))
+"""
+
+RENDER_PROBE = """
+import json, os, sys, time
+from streamlit.testing.v1 import AppTest
+before = set(sys.modules)
+start = time.perf_counter()
+at = AppTest.from_file(os.path.join({root!r}, "boersenspiel_app.py"), default_timeout=60)
+at.run()
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{
+    "ms": elapsed,
+    "heavy": [m for m in {heavy!r} if m in sys.modules and m not in before],
+    "db_touched": os.path.exists(os.environ["SQLITE_PATH"]),
+    "exception": [str(e.value) for e in at.exception],
+}}))
+"""
+
+
+def probe(code, env):
+    output = subprocess.run([sys.executable, "-c", code], env=env, cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(repeat):
+    workdir = tempfile.mkdtemp(prefix="boersenspiel-startup-")
+    env = dict(os.environ, DB_BACKEND="sqlite", SQLITE_PATH=os.path.join(workdir, "startup.sqlite3"),
+               DB_SPOOL_DIR=os.path.join(workdir, "spool"), METRICS_LOG_INTERVAL="0")
+    imports = [probe(IMPORT_PROBE.format(root=ROOT), env)["ms"] for _ in range(repeat)]
+    renders = [probe(RENDER_PROBE.format(root=ROOT, heavy=HEAVY_MODULES), env) for _ in range(repeat)]
+    return {
+        "import_ms": round(statistics.median(imports), 1),
+        "first_render_ms": round(statistics.median(r["ms"] for r in renders), 1),
+        "heavy_modules": sorted({m for r in renders for m in r["heavy"]}),
+        "db_touched": any(r["db_touched"] for r in renders),
+        "exceptions": sorted({e for r in renders for e in r["exception"]}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark for the landing page.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=float(os.getenv("STARTUP_MAX_IMPORT_MS", 1000)))
+    parser.add_argument("--max-render-ms", type=float, default=float(os.getenv("STARTUP_MAX_RENDER_MS", 1500)))
+    args = parser.parse_args()
+
+    report = measure(args.repeat)
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if report["import_ms"] > args.max_import_ms:
+        failures.append(f"import {report['import_ms']} ms > {args.max_import_ms} ms")
+    if report["first_render_ms"] > args.max_render_ms:
+        failures.append(f"first render {report['first_render_ms']} ms > {args.max_render_ms} ms")
+    if report["heavy_modules"]:
+        failures.append(f"landing page imports {', '.join(report['heavy_modules'])}")
+    if report["db_touched"]:
+        failures.append("landing page touches the database")
+    if report["exceptions"]:
+        failures.append(f"landing page raised: {'; '.join(report['exceptions'])}")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
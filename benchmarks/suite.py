@@ -0,0 +1,298 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Journal der Schreibpfade nicht im Repo anlegen
+os.environ.setdefault("DB_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "boersenspiel-bench-spool"))
+os.environ.setdefault("METRICS_LOG_INTERVAL", "0")
+
+from engine import Player, Stock  # noqa: E402
+from gamestate import GameState, dump, load  # noqa: E402
+from prices import PriceMatrix  # noqa: E402
+from views import portfolio_table  # noqa: E402
+
+# Benchmarks fuer Spielmodell und Datenzugriff.
+#
+#   python benchmarks/suite.py run --out benchmarks/baselines/local.json
+#   python benchmarks/suite.py compare benchmarks/baselines/local.json current.json
+#
+# "run" misst jede Funktion je Groesse (Aktien x Perioden bzw. Zeilen) und schreibt JSON,
+# "compare" meldet alles, was um mehr als --threshold langsamer wurde (Exit-Code 1).
+
+MODEL_SIZES = [(5, 15), (50, 150), (200, 1_000), (1_000, 10_000)]
+DB_SIZES = [100, 1_000, 10_000]
+QUICK_MODEL_SIZES = MODEL_SIZES[:2]
+QUICK_DB_SIZES = DB_SIZES[:2]
+
+
+def price_frame(n_stocks, n_periods, seed=0):
+    rng = np.random.default_rng(seed)
+    steps = np.where(rng.random((n_stocks, n_periods)) < 0.5,
+                     rng.integers(1, 4, (n_stocks, n_periods)), -rng.integers(1, 3, (n_stocks, n_periods)))
+    prices = 50 + np.cumsum(steps, axis=1).astype(np.float64)
+    names = [f"Stock {i}" for i in range(n_stocks)]
+    return pd.DataFrame({
+        "stock_name": np.repeat(names, n_periods),
+        "period": np.tile(np.arange(1, n_periods + 1), n_stocks),
+        "price": prices.ravel(),
+    })
+
+
+def initialize_stocks(df):
+    # wie initialize_stocks() in der App, aber ohne den prozessweiten Cache
+    matrix = PriceMatrix.from_frame(df)
+    return matrix, [Stock(name, matrix.history(name)) for name in matrix.names]
+
+
+def game(n_stocks, n_periods, seed=0):
+    matrix, stocks = initialize_stocks(price_frame(n_stocks, n_periods, seed))
+    period = n_periods // 2
+    for stock in stocks:
+        stock.update_price(period)
+    player = Player(capital=1e9, stock_names=[s.name for s in stocks])
+    rng = np.random.default_rng(seed)
+    for i in rng.integers(0, n_stocks, size=3 * n_stocks):
+        player.buy(stocks[i], int(rng.integers(1, 5)), period)
+    return matrix, stocks, player, period
+
+
+def model_benchmarks(n_stocks, n_periods):
+    df = price_frame(n_stocks, n_periods)
+    matrix, stocks, player, period = game(n_stocks, n_periods)
+    state = GameState("BENCH", "control", period, player, stocks)
+    snapshot = dump(state)
+    periods = np.random.default_rng(1).integers(1, n_periods + 1, size=len(stocks)).tolist()
+
+    def update_price():
+        for stock, p in zip(stocks, periods):
+            stock.update_price(p)
+
+    def price_change():
+        for stock, p in zip(stocks, periods):
+            stock.price_change(p)
+
+    def buy_sell():
+        trader = Player(capital=1e9, stock_names=player.portfolio.names)
+        for stock in stocks:
+            trader.buy(stock, 2, period)
+        for stock in stocks:
+            trader.sell(stock, 1, period)
+
+    return {
+        "stock.update_price": update_price,
+        "stock.price_change": price_change,
+        "player.buy_sell": buy_sell,
+        "player.total_value": lambda: player.total_value(stocks),
+        "initialize_stocks": lambda: initialize_stocks(df),
+        "portfolio_table": lambda: portfolio_table(player, stocks),
+        "gamestate.dump": lambda: dump(state),
+        "gamestate.load": lambda: load(snapshot, lambda scenario_id: matrix),
+    }
+
+
+# Eigene Datenbank je Benchmark-Gruppe: Schreib-Benchmarks fuegen je Wiederholung Zeilen hinzu,
+# die Lese-Benchmarks sollen aber unabhaengig von --repeat und Reihenfolge genau `rows` Zeilen sehen
+def bench_db(path, rows):
+    import db_utils
+    from migrations import migrate
+    from storage import SQLiteStorage, set_storage
+
+    set_storage(SQLiteStorage(path))
+    migrate()
+    user_ids = [uuid.uuid4().hex.upper() for _ in range(max(1, rows // 10))]
+    now = datetime.now().isoformat()
+    surveys = [[u, 30, 5, "Other", "Other", "", None, "control", now, 0, db_utils.DEFAULT_EXPERIMENT] for u in user_ids]
+    db_utils.save_surveys_bulk(surveys)
+    # Ledger: genug Cash und Bestand, damit jeder Trade angenommen wird
+    db_utils.save_accounts_bulk([[u, 1e12, {"Stock 0": 1_000_000}, db_utils.DEFAULT_EXPERIMENT, now]
+                                for u in user_ids])
+
+    df = price_frame(max(1, rows // 15), 15)
+    with db_utils.get_db() as conn, conn.cursor() as cursor:
+        db_utils.get_storage().insert_many(cursor, "INSERT INTO stock_prices (stock_name, period, price) VALUES %s",
+                                           list(df.itertuples(index=False, name=None)))
+    return user_ids, surveys, now
+
+
+def action_rows(rows, user_ids, now, rng):
+    import db_utils
+
+    return [[uuid.uuid4().hex, user_ids[i % len(user_ids)], 6 + i % 10, "Buy", "Stock 0",
+             int(rng.integers(1, 5)), 50.0, db_utils.DEFAULT_EXPERIMENT, now, now] for i in range(rows)]
+
+
+def db_write_benchmarks(rows, workdir):
+    import db_utils
+
+    user_ids, surveys, now = bench_db(os.path.join(workdir, f"bench-write-{rows}.sqlite3"), rows)
+    rng = np.random.default_rng(rows)
+
+    def trades():
+        return [[uuid.uuid4().hex, user_ids[i % len(user_ids)], 6 + i % 10, ("Buy", "Sell")[i % 2], "Stock 0",
+                 int(rng.integers(1, 5)), 50.0, now] for i in range(rows)]
+
+    def submit_each(rows):
+        for row in rows:
+            db_utils.save_trades_bulk([row])
+
+    return {
+        "db.save_actions_bulk": (lambda: action_rows(rows, user_ids, now, rng), db_utils.save_actions_bulk),
+        # ein Roundtrip je Trade bzw. einer fuer alle Trades
+        "db.apply_trade": (trades, submit_each),
+        "db.save_trades_bulk": (trades, db_utils.save_trades_bulk),
+        "db.save_surveys_bulk": (lambda: surveys, db_utils.save_surveys_bulk),
+    }
+
+
+# Lesen auf einer frischen Datenbank mit genau `rows` Aktionen
+def db_read_benchmarks(rows, workdir):
+    import db_utils
+
+    user_ids, _, now = bench_db(os.path.join(workdir, f"bench-read-{rows}.sqlite3"), rows)
+    db_utils.save_actions_bulk(action_rows(rows, user_ids, now, np.random.default_rng(rows)))
+
+    return {
+        "db.get_stock_prices": (None, db_utils.get_stock_prices),
+        "db.get_table_page": (None, lambda: db_utils.get_table_page("actions", limit=100)),
+        "db.get_all_actions": (None, db_utils.get_all_actions),
+    }
+
+
+def measure(func, repeat, setup=None, min_time=0.05):
+    # Pro Messung mindestens min_time Sekunden; Ergebnis je Aufruf.
+    # Mit setup zusaetzlich je Datensatz (Durchsatz beim Schreiben, z. B. Latenz je Trade)
+    if setup is None:
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        number = max(1, int(number * min_time / 0.2))
+        runs = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    else:
+        runs = []
+        for _ in range(repeat):
+            args = setup()
+            start = time.perf_counter()
+            func(args)
+            runs.append(time.perf_counter() - start)
+        if args:
+            return {"min_s": min(runs), "median_s": statistics.median(runs), "repeat": repeat,
+                    "per_item_us": min(runs) / len(args) * 1e6}
+    return {"min_s": min(runs), "median_s": statistics.median(runs), "repeat": repeat}
+
+
+def run_db_group(group, rows, workdir, args, selected, results):
+    for name, (setup, func) in group(rows, workdir).items():
+        key = f"{name}[{rows}]"
+        if selected(key):
+            results[key] = measure(func, args.repeat, setup=setup)
+            per_item = f"{results[key]['per_item_us']:>10.2f} us/row" if "per_item_us" in results[key] else ""
+            print(f"{key:<45} {results[key]['min_s'] * 1000:>12.4f} ms {per_item}", flush=True)
+
+
+def run(args):
+    results = {}
+    model_sizes = QUICK_MODEL_SIZES if args.quick else MODEL_SIZES
+    db_sizes = QUICK_DB_SIZES if args.quick else DB_SIZES
+    selected = lambda name: not args.filter or any(f in name for f in args.filter)  # noqa: E731
+
+    for n_stocks, n_periods in model_sizes:
+        for name, func in model_benchmarks(n_stocks, n_periods).items():
+            key = f"{name}[{n_stocks}x{n_periods}]"
+            if selected(key):
+                results[key] = measure(func, args.repeat)
+                print(f"{key:<45} {results[key]['min_s'] * 1000:>12.4f} ms", flush=True)
+
+    if not args.skip_db:
+        workdir = tempfile.mkdtemp(prefix="boersenspiel-bench-")
+        for rows in db_sizes:
+            # Die Lese-Datenbank wird erst nach den Schreib-Benchmarks angelegt und aktiviert
+            for group in (db_write_benchmarks, db_read_benchmarks):
+                run_db_group(group, rows, workdir, args, selected, results)
+
+    report = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        },
+        "results": results,
+    }
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"wrote {args.out}")
+    if args.baseline:
+        return compare_reports(load_report(args.baseline), report, args.threshold)
+    return 0
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_reports(baseline, current, threshold):
+    # Vergleich ueber das Minimum: am wenigsten von Rauschen auf der Maschine beeinflusst
+    regressions = 0
+    print(f"{'benchmark':<45} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    for key in sorted(set(baseline["results"]) & set(current["results"])):
+        before = baseline["results"][key]["min_s"]
+        after = current["results"][key]["min_s"]
+        ratio = after / before if before else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        print(f"{key:<45} {before * 1000:>10.4f}ms {after * 1000:>10.4f}ms {ratio:>7.2f}{flag}")
+    missing = sorted(set(baseline["results"]) - set(current["results"]))
+    if missing:
+        print(f"not measured: {', '.join(missing)}")
+    print(f"{regressions} regression(s) above {threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the game model and db_utils.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and optionally write a JSON report")
+    run_parser.add_argument("--out", help="write results to this JSON file")
+    run_parser.add_argument("--baseline", help="compare against this JSON report after running")
+    run_parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown (0.2 = 20%%)")
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--quick", action="store_true", help="only the two smallest sizes")
+    run_parser.add_argument("--skip-db", action="store_true")
+    run_parser.add_argument("--filter", nargs="+", help="only benchmarks whose key contains one of these")
+
+    compare_parser = commands.add_parser("compare", help="compare two JSON reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.2)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        sys.exit(run(args))
+    sys.exit(compare_reports(load_report(args.baseline), load_report(args.current), args.threshold))
+
+
+if __name__ == "__main__":
+    main()
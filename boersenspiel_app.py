@@ -1,123 +1,130 @@
 import random
+import secrets
 import streamlit as st
-import pandas as pd
-import matplotlib.pyplot as plt
-import string
-import requests
 import uuid
-from dotenv import load_dotenv
+import threading
+from functools import partial
 import os 
-from db_utils import init_db, save_action, save_result, save_survey
-from db_utils import get_all_surveys, get_all_actions, get_all_results, get_stock_prices
-
-init_db()
+from datetime import datetime, timedelta
+from db_utils import queue_action, save_result, save_survey, update_survey_ip, save_snapshot, queue_snapshot, load_snapshot
+from db_utils import open_account, load_result, EXPERIMENT_ID
+from db_utils import ADMIN_TABLES, get_table_page, get_group_metrics, get_trade_volume
+from db_utils import get_result_rank, get_result_stats, get_experiments
+from metrics import span, snapshot, reset as reset_metrics, profiler
+
+# Schwere Module (pandas, numpy, matplotlib, requests, pyarrow) werden erst in der Seite
+# importiert, die sie braucht; das Schema legt db_utils beim ersten DB-Zugriff an.
+
+IP_LOOKUP_TIMEOUT = float(os.getenv("IP_LOOKUP_TIMEOUT", 2))
+# Leer: kein externer Fallback (z. B. in Lasttests)
+IP_LOOKUP_URL = os.getenv("IP_LOOKUP_URL", "https://api.ipify.org")
+
+# IP des Spielers aus den Request-Headern (Proxy/Load Balancer), ohne externen Aufruf
+def get_client_ip():
+    headers = st.context.headers
+    forwarded = headers.get("X-Forwarded-For")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    real_ip = headers.get("X-Real-Ip")
+    if real_ip:
+        return real_ip.strip()
+    ip = getattr(st.context, "ip_address", None)
+    return ip if isinstance(ip, str) else None
 
 def get_ip():
+    import requests
     try:
-        return requests.get('https://api.ipify.org').text
+        return requests.get(IP_LOOKUP_URL, timeout=IP_LOOKUP_TIMEOUT).text
     except:
         return "unavailable"
 
-def generate_user_id(length=8):
-    return uuid.uuid4().hex[:length].upper()
-
-
-# Data Classes
-class Stock:
-    def __init__(self, name, price_history):
-        self.name = name
-        self.price_history = price_history
-        self.price = price_history[-1] if price_history else 0
-
-    def update_price(self, period):
-        if period <= len(self.price_history):
-            self.price = self.price_history[period - 1]
-            return self.price
-        return self.price
-
-    def price_change(self, current_period=None):
-        if current_period is None or current_period <= 1:
-            return 0.0
-        if current_period > len(self.price_history):
-            current_period = len(self.price_history)
-        
-        try:
-            current_price = self.price_history[current_period - 1]
-            previous_price = self.price_history[current_period - 2]
-            if previous_price == 0:
-                return 0.0
-            return round(((current_price - previous_price) / previous_price) * 100, 2)
-        except IndexError:
-            return 0.0
-
-
-class Player:
-    def __init__(self, capital):
-        self.capital = capital
-        self.portfolio = {}
-        self.actions = []
-        self.performance = []
-
-    def track_performance(self, stocks):
-        total = self.total_value(stocks)
-        self.performance.append(total)
-
-    def buy(self, stock: Stock, amount: int, period: int):
-        cost = stock.price * amount
-        if self.capital >= cost:
-            self.capital -= cost
-            if stock.name in self.portfolio:
-                self.portfolio[stock.name]["amount"] += amount
-                self.portfolio[stock.name]["buy_price"] = (
-                    (self.portfolio[stock.name]["buy_price"] + stock.price) / 2
-                )
-            else:
-                self.portfolio[stock.name] = {"amount": amount, "buy_price": stock.price}
-            self.actions.append(
-                {"Period": period, "Action": "Buy", "Stock": stock.name, "Amount": amount, "Price": stock.price}
-            )
-            save_action(self.actions[-1], st.session_state.user_id)
-            return f"Bought {amount} of {stock.name} at {stock.price:.2f}€"
-        else:
-            return "Not enough cash."
-
-    def sell(self, stock: Stock, amount: int, period: int):
-        if stock.name in self.portfolio and self.portfolio[stock.name]["amount"] >= amount:
-            self.capital += stock.price * amount
-            self.portfolio[stock.name]["amount"] -= amount
-            if self.portfolio[stock.name]["amount"] == 0:
-                del self.portfolio[stock.name]
-            self.actions.append(
-                {"Period": period, "Action": "Sell", "Stock": stock.name, "Amount": amount, "Price": stock.price}
-            )
-            save_action(self.actions[-1], st.session_state.user_id)
-            return f"Sold {amount} of {stock.name} at {stock.price:.2f}€"
-        else:
-            return "Not enough stock to sell."
+# Fallback im Hintergrund: survey.ip_address wird nachgetragen, der Start wartet nicht darauf
+def resolve_ip_later(user_id):
+    thread = threading.Thread(target=lambda: update_survey_ip(user_id, get_ip()), name="ip-lookup", daemon=True)
+    thread.start()
+    return thread
 
-    def total_value(self, stocks: list):
-        value = self.capital
-        for name, data in self.portfolio.items():
-            stock = next((s for s in stocks if s.name == name), None)
-            if stock:
-                value += data["amount"] * stock.price
-        return round(value, 2)
+# Volle UUID: global eindeutig ueber alle Laeufe, denn accounts, positions und game_snapshots
+# sind nur nach user_id geschluesselt (8 Zeichen konnten zwischen Laeufen kollidieren)
+def generate_user_id():
+    return uuid.uuid4().hex.upper()
 
 
 # Initialization
-def initialize_stocks():
-    df = get_stock_prices()
-    stocks = []
-    for stock_name in df["stock_name"].unique():
-        stock_prices = df[df["stock_name"] == stock_name].sort_values("period")["price"].tolist()
-        stocks.append(Stock(stock_name, stock_prices))
-    return stocks
+def initialize_stocks(scenario_id=0):
+    from engine import Stock
+    from prices import get_price_matrix
+
+    matrix = get_price_matrix(scenario_id)
+    return [Stock(name, matrix.history(name)) for name in matrix.names]
+
+# Spielstand: die Session haelt den Binaer-Snapshot (gamestate.py); Player und Stocks werden daraus
+# und aus der geteilten PriceMatrix aufgebaut. Dekodiert wird nur, wenn sich der Snapshot geaendert hat,
+# Seite und Fragmente eines Laufs teilen sich das Spiel (Aenderungen daran immer per save_game ablegen).
+def current_game():
+    from gamestate import load
+    from prices import get_price_matrix
+
+    data = st.session_state.game
+    cached = st.session_state.get("game_cache")
+    if cached is not None and cached[0] == data:
+        return cached[1]
+    game = load(data, get_price_matrix, on_action=partial(queue_action, user_id=st.session_state.user_id))
+    st.session_state.game_cache = (data, game)
+    return game
+
+
+# background=True nach Trades: der Snapshot wird im Hintergrund geschrieben (die Trades selbst
+# laufen ohnehin ueber queue_action); beim Start und Periodenwechsel synchron
+def save_game(game, background=False):
+    from gamestate import dump
+
+    data = dump(game)
+    st.session_state.game = data
+    st.session_state.game_cache = (data, game)
+    st.session_state.period = game.period
+    token = st.session_state.get("resume_token")
+    if background:
+        queue_snapshot(game.user_id, game.period, data, token)
+    else:
+        save_snapshot(game.user_id, game.period, data, token)
+
+
+# Neue Session mit ?uid=...&token=... in der URL (Reconnect, Neustart des Servers): Spiel fortsetzen
+def resume_game():
+    user_id = st.query_params.get("uid")
+    token = st.query_params.get("token")
+    if not user_id or not token:
+        return False
+    from gamestate import SnapshotError, load
+    from prices import get_price_matrix
+
+    data = load_snapshot(user_id, token)
+    if data is None:
+        return False
+    try:
+        game = load(data, get_price_matrix)
+    except SnapshotError:
+        return False
+    st.session_state.user_id = user_id
+    st.session_state.resume_token = token
+    st.session_state.game = data
+    st.session_state.period = game.period
+    st.session_state.survey_completed = True
+    st.session_state.page = "Simulation"
+    # Spiel schon beendet: gespeichertes Ergebnis anzeigen (steht es noch im Journal, neu berechnen)
+    if game.period >= 15:
+        total = load_result(user_id)
+        if total is None:
+            total = final_value(game)
+            save_result(total, user_id)
+        st.session_state.total_value = total
+        st.session_state.page = "Final"
+    return True
+
 
 # Pages
 def landing_page():
-    from db_utils import get_user_count  # Neue Hilfsfunktion (s. unten)
-    user_count = get_user_count()
-
     st.title("Stock Market Simulation Game")
 
     st.markdown("**Welcome!**")
@@ -155,8 +162,13 @@ def landing_page():
     mail = st.text_input("Please insert your email address", "Your email")
 
     if st.button("Start Simulation", key="start_button_landing"):
+        from assignment import assign_group
+        from engine import start_game
+        from gamestate import GameState
+        from prices import pick_scenario
+
         user_id = generate_user_id()
-        is_alt_group = (user_count + 1) % 2 == 0  # Jeder zweite Spieler ist in der alternativen Gruppe
+        group = assign_group()
 
         # Save user info to session state
         st.session_state.user_id = user_id
@@ -170,55 +182,145 @@ def landing_page():
         st.session_state.logs = []
         st.session_state.survey_completed = True
         st.session_state.page = "Simulation"  
+        st.session_state.resume_token = secrets.token_urlsafe(16)
 
-        stocks = initialize_stocks()
-        st.session_state.stocks = stocks
-
+        scenario_id = pick_scenario()
+        stocks = initialize_stocks(scenario_id)
         random.shuffle(stocks)
-        st.session_state.stocks = stocks
 
-        player = Player(capital=1000 if not is_alt_group else 500)
-        st.session_state.player = player
+        player = start_game(stocks, group, on_action=partial(queue_action, user_id=user_id))
+
+        ip = get_client_ip()
+        # Lauf und Spielstart bestimmen die Partition aller Zeilen dieser Session
+        started = datetime.now()
+        save_survey(user_id, age, experience, study, gender, mail, ip_address=ip, user_group=group,
+                    scenario_id=scenario_id, experiment_id=EXPERIMENT_ID, start_time=started)
+        if ip is None and IP_LOOKUP_URL:
+            resolve_ip_later(user_id)
+        # Konto fuer die Pruefung der Trades in der Datenbank (vor dem ersten Trade)
+        open_account(user_id, player.capital, {name: h["amount"] for name, h in player.portfolio.items()},
+                     experiment_id=EXPERIMENT_ID, start_time=started)
 
-        # Treatment-Group
-        if is_alt_group:
-            lunaris = next((s for s in stocks if s.name == "Lunaris Ventures"), None)
-            assert lunaris is not None, "Lunaris Ventures wurde nicht in stocks gefunden!"
-            amount = 10
-            buy_price = round(lunaris.price_history[0], 2) 
-            player.portfolio["Lunaris Ventures"] = {"amount": amount, "buy_price": buy_price}
+        save_game(GameState(user_id, group, st.session_state.period, player, stocks, scenario_id))
+        st.query_params["uid"] = user_id
+        st.query_params["token"] = st.session_state.resume_token
+
+        st.rerun()
 
 
-        ip = get_ip()
-        save_survey(user_id, age, experience, study, gender, mail, ip_address=ip, user_group="treatment" if is_alt_group else "control")
+# Fragmente: Widget-Aenderungen darin rerunnen nur das jeweilige Fragment, nicht die ganze Seite
+@st.fragment
+def trade_form():
+    game = current_game()
+    player = game.player
+    stocks_by_name = {s.name: s for s in game.stocks}
 
-        for period in range(1, 6):
-            for stock in stocks:
-                stock.update_price(period)
-            player.track_performance(stocks)
+    st.markdown("### Trade Stocks")
+    action = st.selectbox("Choose Action", ["Buy", "Sell"])
+    selected_stock = st.selectbox("Choose Stock", list(stocks_by_name))
+    amount = st.number_input("Amount", min_value=1, value=1)
 
+    if st.button("Execute"):
+        stock_obj = stocks_by_name[selected_stock]
+        with span("game.trade"):
+            if action == "Buy":
+                result = player.buy(stock_obj, amount, st.session_state.period)
+            else:
+                result = player.sell(stock_obj, amount, st.session_state.period)
+        # Cash, Portfolio und Historie haengen vom Trade ab: ganze Seite neu aufbauen
+        save_game(game, background=True)
+        st.session_state.trade_result = result
         st.rerun()
 
+    result = st.session_state.pop("trade_result", None)
+    if result:
+        st.success(result)
+
+
+@st.fragment
+def portfolio_overview():
+    from views import portfolio_table, highlight_changes
+
+    game = current_game()
+    player = game.player
+    st.markdown("### 📊 Portfolio Overview")
+    # Tabelle nur neu bauen, wenn sich Periode oder Trades geaendert haben
+    key = (st.session_state.period, len(player.actions))
+    cached = st.session_state.get("portfolio_styled")
+    if cached is None or cached[0] != key:
+        with span("game.portfolio_table"):
+            portfolio_df = portfolio_table(player, game.stocks)
+            styled_df = None
+            if not portfolio_df.empty:
+                # Styler.applymap heisst seit pandas 2.1 Styler.map
+                style = portfolio_df.style
+                style_map = getattr(style, "map", None) or style.applymap
+                styled_df = style_map(highlight_changes, subset=["Change", "Gain/Loss (€)"])
+        cached = st.session_state.portfolio_styled = (key, styled_df)
+    if cached[1] is not None:
+        st.dataframe(cached[1], use_container_width=True)
+
+
+@st.fragment
+def price_chart():
+    from charts import show_price_chart
+
+    game = current_game()
+    st.markdown("### 📉 Stock Price Trends")
+
+    # Liste aller verfügbaren Aktien
+    available_stocks = [stock.name for stock in game.stocks]
+
+    # Session-State initialisieren, um Auswahl zu speichern
+    if "selected_stocks_chart" not in st.session_state or not set(st.session_state.selected_stocks_chart).issubset(set(available_stocks)):
+        # Auswahl zurücksetzen, wenn z. B. Aktien entfernt wurden
+        st.session_state.selected_stocks_chart = available_stocks[:1] if available_stocks else []
+
+    # Multi-Select: Auswahl bleibt über Perioden erhalten
+    selected_stocks = st.multiselect(
+        "Select one or more stocks to compare their price trends",
+        available_stocks,
+        default=st.session_state.selected_stocks_chart,
+        key="selected_stocks_chart"
+    )
+
+    # Plot zeichnen, falls Auswahl vorhanden ist
+    if selected_stocks:
+        show_price_chart(game.stocks, selected_stocks, game.period)
+
+
+@st.fragment
+def performance_chart():
+    from charts import show_performance_chart
+
+    st.markdown("### 📈 Portfolio Performance Over Time")
+
+    performance = current_game().player.performance
+    if performance:
+        show_performance_chart(performance)
+
+
+# Endwert (und Auszahlung) zum Kurs der letzten Periode, nicht zum Schlusskurs der Vorperiode.
+# Bewertet auf Kopien der Aktien, das Spiel aus current_game bleibt unveraendert.
+def final_value(game):
+    from engine import END_PERIOD, Stock
+
+    stocks = [Stock(stock.name, stock.price_history[:END_PERIOD]) for stock in game.stocks]
+    return game.player.total_value(stocks)
+
 
 def game_page():
 
     if not st.session_state.get('survey_completed', False):
         st.warning("Please complete the survey first.")
         return
-    
-    # Robust initialisieren: sicherstellen, dass Preise zu aktuellem Periodenstand passen
-    current_period = st.session_state.period
-    for stock in st.session_state.stocks:
-        stock.update_price(current_period - 1)
-    
-    # Reload
-    if 'stocks' in st.session_state and 'period' in st.session_state:
-        for stock in st.session_state.stocks:
-            stock.update_price(st.session_state.period)
 
+    # Aktueller Kurs jeder Aktie ist der Schlusskurs der Vorperiode (setzt current_game)
+    game = current_game()
+    player = game.player
+    stocks = game.stocks
 
     st.title("📈 Stock Market Simulation Game")
-    player = st.session_state.player
 
     col1, col2 = st.columns([2, 2])
     with col1:
@@ -227,14 +329,14 @@ def game_page():
         if st.session_state.period < 15:
             if st.button("➡️ Next Period"):
                 random.seed(st.session_state.period)
-                for stock in st.session_state.stocks:
+                for stock in stocks:
                     stock.update_price(st.session_state.period)
-                st.session_state.player.track_performance(st.session_state.stocks)
-                st.session_state.period += 1
+                player.track_performance(stocks)
+                game.period += 1
+                save_game(game)
                 st.rerun()
         elif st.session_state.get("total_value") is None:
-            player = st.session_state.player
-            total = player.total_value(st.session_state.stocks)
+            total = final_value(game)
             st.session_state.total_value = total
             save_result(total, st.session_state.user_id)
             st.session_state.page = "Final"
@@ -245,163 +347,41 @@ def game_page():
     # Vorperiode bestimmen
     previous_period = max(1, st.session_state.period - 1)
 
-    for stock in st.session_state.stocks:
-        try:
-            prev_price = stock.price_history[previous_period - 1]
-            change = stock.price_change(previous_period)
-        except IndexError:
-            prev_price = 0.0
-            change = 0.0
-        color = "green" if change >= 0 else "red"
-        st.markdown(
-            f"- **{stock.name}**: {prev_price:.2f}€ "
-            f"(<span style='color:{color}'>{change:+.2f}%</span>)",
-            unsafe_allow_html=True
-        )
-
-
-    # Ensure all stock prices are updated to the current period
-    for stock in st.session_state.stocks:
-        stock.update_price(st.session_state.period - 1)
-
-    st.markdown(f"**💰 Cash:** {player.capital:.2f}€")
-
-    st.markdown("### Trade Stocks")
-    action = st.selectbox("Choose Action", ["Buy", "Sell"])
-    selected_stock = st.selectbox("Choose Stock", [s.name for s in st.session_state.stocks])
-    amount = st.number_input("Amount", min_value=1, value=1)
-
-    if st.button("Execute"):
-        stock_obj = next(s for s in st.session_state.stocks if s.name == selected_stock)
-        if action == "Buy":
-            result = player.buy(stock_obj, amount, st.session_state.period)
-        else:
-            result = player.sell(stock_obj, amount, st.session_state.period)
-        st.success(result)
-
-    st.markdown("### 📊 Portfolio Overview")
-    portfolio_data = []
-    for stock_name, data in player.portfolio.items():
-        stock_obj = next(s for s in st.session_state.stocks if s.name == stock_name)
-        value = data["amount"] * stock_obj.price
-        change = ((stock_obj.price - data["buy_price"]) / data["buy_price"]) * 100 if data["buy_price"] != 0 else 0
-        gain_loss = round((stock_obj.price - data["buy_price"]) * data["amount"], 2)
-        portfolio_data.append([
-            stock_name,
-            data["amount"],
-            f"{round(data['buy_price'], 2):.2f}€",
-            f"{round(stock_obj.price, 2):.2f}€",
-            f"{round(value, 2):.2f}€",  # Value darf ruhig Zahl bleiben für Summe
-            f"{round(change, 2)}%",
-            f"{round(gain_loss, 2):.2f}€"
-        ])
-
-    portfolio_df = pd.DataFrame(
-        portfolio_data,
-        columns=["Stock", "Amount", "Buy Price", "Current Price", "Value (€)", "Change", "Gain/Loss (€)"]
-    )
-
-    total_value = player.total_value(st.session_state.stocks)
-    if not portfolio_df.empty:
-        # Gesamtberechnung für Total-Zeile
-        total_invested = sum(data["amount"] * data["buy_price"] for data in player.portfolio.values())
-        total_market_value = sum(
-            data["amount"] * next((s for s in st.session_state.stocks if s.name == name), None).price
-            for name, data in player.portfolio.items()
-        )
-
-        total_with_capital = total_market_value + player.capital
-        total_gain = round(total_market_value - total_invested, 2)
-        total_change = round(((total_with_capital / 1000 - 1) * 100), 2) if total_invested else 0.0
-
-        # Capital
-        portfolio_df.loc[len(portfolio_df.index)] = ["Cash", "", "", "", f"{round(player.capital, 2):.2f}€", "", ""]
-
-
-        # Total
-        portfolio_df.loc[len(portfolio_df.index)] = [
-            "Total", "", "", "", f"{round(total_with_capital, 2):.2f}€", f"{total_change}%", f"{round(total_with_capital - 1000, 2):.2f}€"
-        ]
-
-        def highlight_changes(val):
+    with span("game.price_updates"):
+        for stock in stocks:
             try:
-                if isinstance(val, str) and "%" in val:
-                    val = float(val.strip('%'))
-                elif isinstance(val, (int, float)):
-                    val = float(val)
-                color = 'green' if val > 0 else 'red' if val < 0 else 'black'
-                return f'color: {color}'
-            except:
-                return ""
-        
-        styled_df = portfolio_df.style.applymap(highlight_changes, subset=["Change", "Gain/Loss (€)"])
-        st.dataframe(styled_df, use_container_width=True)
-
-    # Stock charts
-    st.markdown("### 📉 Stock Price Trends")
-
-    # Liste aller verfügbaren Aktien
-    available_stocks = [stock.name for stock in st.session_state.stocks]
-
-    # Session-State initialisieren, um Auswahl zu speichern
-    if "selected_stocks_chart" not in st.session_state or not set(st.session_state.selected_stocks_chart).issubset(set(available_stocks)):
-        # Auswahl zurücksetzen, wenn z. B. Aktien entfernt wurden
-        st.session_state.selected_stocks_chart = available_stocks[:1] if available_stocks else []
-
-    # Multi-Select: Auswahl bleibt über Perioden erhalten
-    selected_stocks = st.multiselect(
-        "Select one or more stocks to compare their price trends",
-        available_stocks,
-        default=st.session_state.selected_stocks_chart,
-        key="selected_stocks_chart"
-    )
-
-    # Plot zeichnen, falls Auswahl vorhanden ist
-    if selected_stocks:
-        fig, ax = plt.subplots(figsize=(8, 4))
-        current_period = st.session_state.period
-        past_periods = list(range(1, current_period))
-
-        for stock_name in selected_stocks:
-            stock_obj = next((s for s in st.session_state.stocks if s.name == stock_name), None)
-            if stock_obj:
-                prices = stock_obj.price_history[:current_period - 1]
-                ax.plot(past_periods, prices, marker="o", label=stock_name)
-
-        ax.set_title("Stock Price Trends Over Time")
-        ax.set_xlabel("Period")
-        ax.set_ylabel("Price (€)")
-        ax.set_xticks(past_periods)
-        ax.grid(True)
-        ax.legend()
-        st.pyplot(fig)
+                prev_price = float(stock.price_history[previous_period - 1])
+                change = stock.price_change(previous_period)
+            except IndexError:
+                prev_price = 0.0
+                change = 0.0
+            color = "green" if change >= 0 else "red"
+            st.markdown(
+                f"- **{stock.name}**: {prev_price:.2f}€ "
+                f"(<span style='color:{color}'>{change:+.2f}%</span>)",
+                unsafe_allow_html=True
+            )
 
+    st.markdown(f"**💰 Cash:** {player.capital:.2f}€")
 
+    trade_form()
+    portfolio_overview()
+    price_chart()
 
     if st.session_state.period == 15:
         st.success("🎉 Game Over!")
-        total = player.total_value(st.session_state.stocks)
+        total = final_value(game)
         save_result(total, st.session_state.user_id)
         st.session_state.total_value = total
         st.markdown(f"**📈 Total Value:** {total:.2f}€")
 
-
-    st.markdown("### 📈 Portfolio Performance Over Time")
-
-    if st.session_state.player.performance:
-        periods = list(range(1, len(st.session_state.player.performance) + 1))  # Start bei 1
-        fig, ax = plt.subplots(figsize=(6, 3))
-        ax.plot(periods, st.session_state.player.performance, marker="o", color="green")
-        ax.set_title("Portfolio Value Over Time")
-        ax.set_xlabel("Period")
-        ax.set_ylabel("Total Value (€)")
-        ax.set_xticks(periods)  # Beschriftung der X-Achse mit 1, 2, 3, ...
-        ax.grid(True)
-        st.pyplot(fig)
+    performance_chart()
 
     st.markdown("### 📝 Actions History")
     if player.actions:
-        st.dataframe(pd.DataFrame(player.actions))
+        import pandas as pd
+        with span("game.actions_history"):
+            st.dataframe(pd.DataFrame(player.actions))
 
 def final_page():
     st.title("Game over!")
@@ -411,6 +391,15 @@ def final_page():
     
     if "total_value" in st.session_state:
         st.metric(label="Total Value", value=f"{st.session_state.total_value:,.2f}€")
+        try:
+            rank = get_result_rank(st.session_state.user_id)
+        except Exception:
+            # Rang ist nur Zusatzinfo, z. B. wenn das Ergebnis noch im Journal steht
+            rank = None
+        # percentile fehlt, solange die Aggregate den Spieler noch nicht enthalten (players == 0)
+        if rank and rank["percentile"] is not None:
+            st.write(f"Rank **#{rank['rank']}** of {rank['players']} players "
+                     f"(as good as or better than {rank['percentile']:.0f}% of them)")
     else:
         st.warning("Total value not found. Please make sure you completed the simulation.")
 
@@ -426,18 +415,138 @@ def final_page():
     "eligible for multiple payouts.")
 
 
+ADMIN_CACHE_TTL = 30
+ADMIN_PAGE_SIZES = [25, 50, 100, 500]
+
+cached_table_page = st.cache_data(ttl=ADMIN_CACHE_TTL, show_spinner=False)(get_table_page)
+cached_group_metrics = st.cache_data(ttl=ADMIN_CACHE_TTL, show_spinner=False)(get_group_metrics)
+cached_trade_volume = st.cache_data(ttl=ADMIN_CACHE_TTL, show_spinner=False)(get_trade_volume)
+cached_result_stats = st.cache_data(ttl=ADMIN_CACHE_TTL, show_spinner=False)(get_result_stats)
+cached_experiments = st.cache_data(ttl=ADMIN_CACHE_TTL, show_spinner=False)(get_experiments)
+
+
+def paginated_table(table, filters, page_size):
+    # Keyset-Pagination: pro Tabelle ein Stapel der "after"-Cursor, Reset bei neuen Filtern
+    state = st.session_state.setdefault("admin_cursors", {})
+    key = (tuple(sorted(filters.items())), page_size)
+    if table not in state or state[table]["key"] != key:
+        state[table] = {"key": key, "after": [None]}
+    cursors = state[table]["after"]
+
+    df = cached_table_page(table, after=cursors[-1], limit=page_size, **filters)
+    st.dataframe(df, use_container_width=True)
+
+    col_prev, col_info, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if st.button("◀ Previous", key=f"admin_prev_{table}", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+    with col_info:
+        st.caption(f"Page {len(cursors)}")
+    with col_next:
+        if st.button("Next ▶", key=f"admin_next_{table}", disabled=len(df) < page_size):
+            last = df[ADMIN_TABLES[table]["cursor"]].iloc[-1]
+            cursors.append(last.item() if hasattr(last, "item") else last)
+            st.rerun()
+
+
 def admin_page():
     st.title("🔐 Admin Dashboard")
     with st.expander("🔑 Show admin panel"):
         admin_access = st.text_input("Enter admin password:", type="password")
 
     if admin_access == "letmein":
+        import pandas as pd
+        from engine import GROUPS, START_PERIOD, END_PERIOD
+        from export import EXPORT_TABLES, EXPORT_FORMATS, export_to_tempfile
+        from prices import invalidate_price_matrix
+
         st.success("Access granted!")
-        from db_utils import get_all_surveys, get_all_actions, get_all_results
 
-        st.dataframe(get_all_surveys())
-        st.dataframe(get_all_actions())
-        st.dataframe(get_all_results())
+        st.markdown("### Filters")
+        col0, col1, col2, col3, col4 = st.columns(5)
+        with col0:
+            experiments = cached_experiments()
+            experiment = st.selectbox("Experiment", ["All"] + experiments,
+                                      index=1 + experiments.index(EXPERIMENT_ID) if EXPERIMENT_ID in experiments else 0)
+        with col1:
+            group = st.selectbox("Group", ["All"] + sorted(GROUPS))
+        with col2:
+            period = st.selectbox("Period (actions)", ["All"] + list(range(START_PERIOD, END_PERIOD + 1)))
+        with col3:
+            dates = st.date_input("Start date range", value=())
+        with col4:
+            page_size = st.selectbox("Rows per page", ADMIN_PAGE_SIZES, index=1)
+
+        since = until = None
+        if len(dates) == 2:
+            since = datetime.combine(dates[0], datetime.min.time())
+            until = datetime.combine(dates[1] + timedelta(days=1), datetime.min.time())
+        experiment = None if experiment == "All" else experiment
+        group = None if group == "All" else group
+        period = None if period == "All" else period
+
+        st.markdown("### Metrics")
+        st.dataframe(cached_group_metrics(since=since, until=until, experiment_id=experiment), use_container_width=True)
+        volume = cached_trade_volume(group=group, since=since, until=until, experiment_id=experiment)
+        if not volume.empty:
+            st.bar_chart(volume.set_index("period")["shares"], x_label="Period", y_label="Shares traded")
+        st.dataframe(volume, use_container_width=True)
+        st.markdown("**Final values** (all time)")
+        st.dataframe(cached_result_stats(experiment_id=experiment), use_container_width=True)
+
+        filters = {"group": group, "since": since, "until": until, "experiment_id": experiment}
+        tab_survey, tab_actions, tab_results = st.tabs(["Survey", "Actions", "Results"])
+        with tab_survey:
+            paginated_table("survey", filters, page_size)
+        with tab_actions:
+            paginated_table("actions", dict(filters, period=period), page_size)
+        with tab_results:
+            paginated_table("results", filters, page_size)
+
+        st.markdown("### Export")
+        col1, col2 = st.columns(2)
+        with col1:
+            export_name = st.selectbox("Table", sorted(EXPORT_TABLES))
+        with col2:
+            export_format = st.selectbox("Format", EXPORT_FORMATS)
+        # Export laeuft erst beim Klick, gestreamt in eine temporaere Datei
+        st.download_button(
+            "⬇️ Download export",
+            data=partial(export_to_tempfile, export_name, export_format),
+            file_name=f"{export_name}.{export_format}",
+            mime="text/csv" if export_format == "csv" else "application/octet-stream",
+        )
+
+        if st.button("Reload stock prices"):
+            invalidate_price_matrix()
+            st.success("Stock prices will be reloaded for the next session.")
+
+        st.markdown("### Performance")
+        timings = snapshot()
+        if timings:
+            st.dataframe(pd.DataFrame.from_dict(timings, orient="index"), use_container_width=True)
+        else:
+            st.caption("No timings recorded yet (METRICS_ENABLED=0?).")
+        if st.button("Reset timings"):
+            reset_metrics()
+            st.rerun()
+
+        # Profiler gilt fuer die Reruns der markierten Sessions (user_id), nicht fuer das Dashboard
+        profiler.all_sessions = st.checkbox("Profile all sessions", value=profiler.all_sessions)
+        targets = st.text_input("Profile user ids (comma separated)", ", ".join(sorted(profiler.targets)))
+        profiler.targets = {t.strip().upper() for t in targets.split(",") if t.strip()}
+        profiled = profiler.sessions()
+        if profiled:
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                session = st.selectbox("Profile", profiled)
+            with col2:
+                sort = st.selectbox("Sort by", ["cumulative", "tottime", "ncalls"])
+            st.code(profiler.report(session, sort=sort))
+            if st.button("Clear profiles"):
+                profiler.clear()
+                st.rerun()
 
     elif admin_access:
         st.error("❌ Incorrect password")
@@ -446,13 +555,18 @@ def admin_page():
 
 
 # Run App
+PAGES = {
+    "Landing Page": landing_page,
+    "Simulation": game_page,
+    "Final": final_page,
+    "Admin": admin_page,
+}
+
+if "page" not in st.session_state:
+    resume_game()
+
 page = st.session_state.get("page", "Landing Page")
 
-if page == "Landing Page":
-    landing_page()
-elif page == "Simulation":
-    game_page()
-elif page == "Final":
-    final_page()
-elif page == "Admin":
-    admin_page()
\ No newline at end of file
+if page in PAGES:
+    with span(f"page.{page}"):
+        profiler.run(st.session_state.get("user_id"), PAGES[page])
@@ -0,0 +1,144 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import streamlit as st
+
+from metrics import timed
+
+# "matplotlib" rendert PNGs (gecacht), "native" nutzt st.line_chart ohne Rendering auf dem Server
+CHART_BACKEND = os.getenv("CHART_BACKEND", "matplotlib")
+CHART_CACHE_MAX_ENTRIES = int(os.getenv("CHART_CACHE_MAX_ENTRIES", 512))
+CHART_CACHE_MAX_BYTES = int(os.getenv("CHART_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+CHART_DPI = 200
+
+
+class ImageCache:
+    # LRU-Cache fuer gerenderte Bilder, begrenzt nach Anzahl und Gesamtgroesse
+    def __init__(self, max_entries=CHART_CACHE_MAX_ENTRIES, max_bytes=CHART_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            image = self._images.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._images.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key, image):
+        if len(image) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._images.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._images[key] = image
+            self._size += len(image)
+            while len(self._images) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._images), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+
+chart_cache = ImageCache()
+
+
+def _render(draw, figsize):
+    # Figure ohne pyplot: landet nicht in der globalen Figure-Registry
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    try:
+        draw(fig.subplots())
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png", dpi=CHART_DPI, bbox_inches="tight")
+        return buffer.getvalue()
+    finally:
+        fig.clear()
+
+
+@timed("chart.render.price")
+def render_price_chart(series, period):
+    past_periods = list(range(1, period))
+
+    def draw(ax):
+        for stock_name, prices in series:
+            ax.plot(past_periods, prices, marker="o", label=stock_name)
+        ax.set_title("Stock Price Trends Over Time")
+        ax.set_xlabel("Period")
+        ax.set_ylabel("Price (€)")
+        ax.set_xticks(past_periods)
+        ax.grid(True)
+        ax.legend()
+
+    return _render(draw, (8, 4))
+
+
+@timed("chart.render.performance")
+def render_performance_chart(performance):
+    periods = list(range(1, len(performance) + 1))  # Start bei 1
+
+    def draw(ax):
+        ax.plot(periods, performance, marker="o", color="green")
+        ax.set_title("Portfolio Value Over Time")
+        ax.set_xlabel("Period")
+        ax.set_ylabel("Total Value (€)")
+        ax.set_xticks(periods)  # Beschriftung der X-Achse mit 1, 2, 3, ...
+        ax.grid(True)
+
+    return _render(draw, (6, 3))
+
+
+def _cached(key, render, *args):
+    image = chart_cache.get(key)
+    if image is None:
+        image = render(*args)
+        chart_cache.put(key, image)
+    return image
+
+
+@timed("chart.show.price")
+def show_price_chart(stocks, selected, period):
+    # Kurse sind Teil des Schluessels, damit verschiedene Preis-Szenarien nicht kollidieren
+    series = tuple(
+        (stock.name, tuple(float(p) for p in stock.price_history[:period - 1]))
+        for stock in stocks if stock.name in selected
+    )
+    series = tuple(sorted(series, key=lambda s: selected.index(s[0])))
+    if CHART_BACKEND == "native":
+        import pandas as pd
+        data = pd.DataFrame({name: prices for name, prices in series}, index=range(1, period))
+        st.line_chart(data, x_label="Period", y_label="Price (€)")
+        return
+    st.image(_cached(("prices", series, period), render_price_chart, series, period), width="stretch")
+
+
+@timed("chart.show.performance")
+def show_performance_chart(performance):
+    performance = tuple(float(v) for v in performance)
+    if CHART_BACKEND == "native":
+        import pandas as pd
+        data = pd.DataFrame({"Total Value (€)": performance}, index=range(1, len(performance) + 1))
+        st.line_chart(data, x_label="Period", y_label="Total Value (€)", color="#008000")
+        return
+    st.image(_cached(("performance", performance), render_performance_chart, performance), width="stretch")
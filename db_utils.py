@@ -1,147 +1,903 @@
-import psycopg2
-import pandas as pd
 import streamlit as st
+import atexit
+import base64
+import hmac
+import logging
+import math
 import os
-from datetime import datetime
-
-# Verbindung zur Datenbank
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT", 5432)
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-
-def get_connection():
-    return psycopg2.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        sslmode="require"
-    )
-
-def get_stock_prices():
-    conn = get_connection()
-    df = pd.read_sql_query("SELECT * FROM stock_prices ORDER BY stock_name, period", conn)
-    conn.close()
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+from metrics import timed
+from spool import RetryLater, Spool
+from storage import get_storage
+
+# Write-Behind fuer Trades: Batch wird bei Groesse oder nach Intervall geschrieben
+ACTION_BATCH_SIZE = int(os.getenv("ACTION_BATCH_SIZE", 100))
+ACTION_FLUSH_INTERVAL = float(os.getenv("ACTION_FLUSH_INTERVAL", 0.5))
+
+# Lauf (Studie), dem neue Sessions zugeordnet werden; Daten von vor Migration 10 liegen in 'default'
+DEFAULT_EXPERIMENT = "default"
+EXPERIMENT_ID = os.getenv("EXPERIMENT_ID", DEFAULT_EXPERIMENT)
+# Aufbewahrung in Tagen; geloescht wird monatsweise (ganze Partitionen), siehe purge_expired()
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", 90))
+
+# Laeufe stecken in Tabellennamen der Partitionen (<tabelle>_<lauf>_<YYYYMM>); ohne '_' im Lauf
+# sind die Namen eindeutig (sonst ist survey_a_202501 Lauf "a_202501" und zugleich Monat 202501 von "a")
+_EXPERIMENT_ID_PATTERN = re.compile(r"[a-z0-9]{1,32}")
+
+logger = logging.getLogger(__name__)
+
+
+# Verbindung aus dem gewaehlten Backend (DB_BACKEND): commit bei Erfolg, rollback bei Fehler
+def get_db():
+    _ensure_schema()
+    return get_storage().connection()
+
+
+def _ensure_schema():
+    # Schema beim ersten Zugriff statt beim Import anlegen (danach nur ein Vergleich)
+    from migrations import migrate
+    migrate()
+
+
+def check_experiment_id(experiment_id):
+    if not isinstance(experiment_id, str) or not _EXPERIMENT_ID_PATTERN.fullmatch(experiment_id):
+        raise ValueError(f"Invalid experiment id {experiment_id!r}: use 1-32 characters a-z or 0-9")
+    return experiment_id
+
+
+def _month(start_time):
+    if not isinstance(start_time, datetime):
+        start_time = datetime.fromisoformat(str(start_time))
+    return start_time.date().replace(day=1)
+
+
+# Lauf registrieren und Partitionen fuer (Lauf, Monat des Spielstarts) anlegen, einmal pro Prozess
+_partitions_ready = set()
+_partitions_lock = threading.Lock()
+
+def _ensure_partitions(keys):
+    missing = {(experiment_id, _month(start_time)) for experiment_id, start_time in keys} - _partitions_ready
+    for experiment_id, month in sorted(missing):
+        check_experiment_id(experiment_id)
+        with get_db() as conn, conn.cursor() as cursor:
+            cursor.execute("INSERT INTO experiments (experiment_id) VALUES (%s) ON CONFLICT (experiment_id) DO NOTHING",
+                           (experiment_id,))
+        get_storage().ensure_partitions(experiment_id, month)
+        with _partitions_lock:
+            _partitions_ready.add((experiment_id, month))
+
+
+def get_pool_stats():
+    return get_storage().stats()
+
+
+def close_pool():
+    get_storage().close()
+
+
+@timed("db.get_stock_prices")
+def get_stock_prices(scenario_id=0):
+    import pandas as pd
+
+    with get_db() as conn:
+        df = pd.read_sql_query("SELECT stock_name, period, price FROM stock_prices WHERE scenario_id = %s "
+                               "ORDER BY stock_name, period", conn, params=[scenario_id])
+    return df
+
+
+@timed("db.get_price_scenarios")
+def get_price_scenarios():
+    with get_db() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT scenario_id FROM price_scenarios ORDER BY scenario_id")
+        return [row[0] for row in cursor.fetchall()]
+
+
+# Erzeugte Kursverlaeufe (pricegen.PricePaths) als neue Szenarien laden, per COPY
+@timed("db.save_price_scenarios")
+def save_price_scenarios(paths):
+    import json
+    import numpy as np
+
+    n_scenarios, n_stocks, periods = paths.prices.shape
+    storage = get_storage()
+    with get_db() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(scenario_id), 0) FROM price_scenarios")
+        first = cursor.fetchone()[0] + 1
+        ids = np.arange(first, first + n_scenarios)
+        created = datetime.now().isoformat()
+        storage.copy_rows(cursor, "price_scenarios", ["scenario_id", "seed", "probabilities", "created_at"], [
+            (int(scenario_id), paths.seed, json.dumps(dict(zip(paths.names, probabilities))), created)
+            for scenario_id, probabilities in zip(ids.tolist(), paths.probabilities.tolist())
+        ])
+        storage.copy_rows(cursor, "stock_prices", ["scenario_id", "stock_name", "period", "price"], zip(
+            np.repeat(ids, n_stocks * periods).tolist(),
+            np.tile(np.repeat(np.array(paths.names, dtype=object), periods), n_scenarios).tolist(),
+            np.tile(np.arange(1, periods + 1), n_scenarios * n_stocks).tolist(),
+            paths.prices.ravel().tolist(),
+        ))
+    return ids.tolist()
+
+
+@timed("db.get_all_surveys")
+def get_all_surveys(experiment_id=None):
+    import pandas as pd
+
+    query, params = "SELECT * FROM survey", []
+    if experiment_id is not None:
+        query, params = query + " WHERE experiment_id = %s", [experiment_id]
+    with get_db() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
     return df
 
+@timed("db.get_all_actions")
+def get_all_actions(experiment_id=None):
+    import pandas as pd
 
-def get_all_surveys():
-    conn = get_connection()
-    df = pd.read_sql_query("SELECT * FROM survey", conn)
-    conn.close()
+    query, params = "SELECT * FROM actions", []
+    if experiment_id is not None:
+        query, params = query + " WHERE experiment_id = %s", [experiment_id]
+    with get_db() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
     return df
 
-def get_all_actions():
-    conn = get_connection()
-    df = pd.read_sql_query("SELECT * FROM actions", conn)
-    conn.close()
+@timed("db.get_experiments")
+def get_experiments():
+    with get_db() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT experiment_id FROM experiments ORDER BY created_at, experiment_id")
+        return [row[0] for row in cursor.fetchall()]
+
+@timed("db.get_all_results")
+def get_all_results(experiment_id=None):
+    import pandas as pd
+
+    query, params = "SELECT * FROM results", []
+    if experiment_id is not None:
+        query, params = query + " WHERE experiment_id = %s", [experiment_id]
+    with get_db() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    return df
+
+# Admin-Ansichten: Tabellen und Spalten stammen nur aus dieser Definition, nie aus Eingaben.
+# "alias" ist die Haupttabelle; Lauf und Zeitraum werden auf ihr gefiltert (Partition Pruning).
+ADMIN_TABLES = {
+    "survey": {
+        "select": "s.*",
+        "from": "survey s",
+        "alias": "s",
+        "key": "s.user_id",
+        "cursor": "user_id",
+        "period": None,
+    },
+    "actions": {
+        "select": "a.*, s.user_group",
+        "from": "actions a LEFT JOIN survey s ON s.user_id = a.user_id AND s.experiment_id = a.experiment_id",
+        "alias": "a",
+        "key": "a.id",
+        "cursor": "id",
+        "period": "a.period",
+    },
+    "results": {
+        "select": "r.*, s.user_group",
+        "from": "results r LEFT JOIN survey s ON s.user_id = r.user_id AND s.experiment_id = r.experiment_id",
+        "alias": "r",
+        "key": "r.user_id",
+        "cursor": "user_id",
+        "period": None,
+    },
+}
+
+
+# until ist exklusiv; Zeitraum bezieht sich auf den Spielstart (start_time, in allen drei Tabellen gleich)
+def _admin_filters(group=None, period=None, since=None, until=None, period_column=None, experiment_id=None, alias="s"):
+    clauses = []
+    params = []
+    if experiment_id is not None:
+        clauses.append(f"{alias}.experiment_id = %s")
+        params.append(experiment_id)
+    if group:
+        clauses.append("s.user_group = %s")
+        params.append(group)
+    if period is not None and period_column:
+        clauses.append(f"{period_column} = %s")
+        params.append(period)
+    if since is not None:
+        clauses.append(f"{alias}.start_time >= %s")
+        params.append(since)
+    if until is not None:
+        clauses.append(f"{alias}.start_time < %s")
+        params.append(until)
+    return clauses, params
+
+
+def _where(clauses):
+    return " WHERE " + " AND ".join(clauses) if clauses else ""
+
+
+@timed("db.get_table_page")
+def get_table_page(table, after=None, limit=50, group=None, period=None, since=None, until=None, experiment_id=None):
+    import pandas as pd
+
+    spec = ADMIN_TABLES[table]
+    clauses, params = _admin_filters(group, period, since, until, spec["period"], experiment_id, spec["alias"])
+    if after is not None:
+        clauses.append(f"{spec['key']} > %s")
+        params.append(after)
+    query = (f"SELECT {spec['select']} FROM {spec['from']}{_where(clauses)} "
+             f"ORDER BY {spec['key']} LIMIT %s")
+    with get_db() as conn:
+        df = pd.read_sql_query(query, conn, params=params + [limit])
+    return df
+
+
+@timed("db.get_group_metrics")
+def get_group_metrics(since=None, until=None, experiment_id=None):
+    import pandas as pd
+
+    clauses, params = _admin_filters(since=since, until=until, experiment_id=experiment_id)
+    query = f'''SELECT s.user_group,
+                       COUNT(*) AS players,
+                       COUNT(r.total_value) AS finished,
+                       AVG(r.total_value) AS mean_value,
+                       {get_storage().median("r.total_value")} AS median_value
+                FROM survey s LEFT JOIN results r
+                     ON r.experiment_id = s.experiment_id AND r.start_time = s.start_time AND r.user_id = s.user_id
+                {_where(clauses)}
+                GROUP BY s.user_group
+                ORDER BY s.user_group'''
+    with get_db() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
     return df
 
-def get_all_results():
-    conn = get_connection()
-    df = pd.read_sql_query("SELECT * FROM results", conn)
-    conn.close()
+
+@timed("db.get_trade_volume")
+def get_trade_volume(group=None, since=None, until=None, experiment_id=None):
+    import pandas as pd
+
+    clauses, params = _admin_filters(group, since=since, until=until, experiment_id=experiment_id, alias="a")
+    query = f'''SELECT a.period,
+                       COUNT(*) AS trades,
+                       SUM(a.amount) AS shares,
+                       SUM(a.amount * a.price) AS turnover
+                FROM actions a LEFT JOIN survey s ON s.user_id = a.user_id AND s.experiment_id = a.experiment_id
+                {_where(clauses)}
+                GROUP BY a.period
+                ORDER BY a.period'''
+    with get_db() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
     return df
 
+@timed("db.init_db")
 def init_db():
-    conn = get_connection()
-    cursor = conn.cursor()
-
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS survey (
-                        user_id TEXT PRIMARY KEY,
-                        age INTEGER,
-                        experience INTEGER,
-                        study TEXT,
-                        gender TEXT,
-                        ip_address TEXT,
-                        user_group TEXT)''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS actions (
-                        id SERIAL PRIMARY KEY,
-                        user_id TEXT,
-                        period INTEGER,
-                        action TEXT,
-                        stock_name TEXT,
-                        amount INTEGER,
-                        price REAL)''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS results (
-                        user_id TEXT PRIMARY KEY,
-                        total_value REAL)''')
-
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-def save_survey(user_id, age, experience, study, gender, mail, ip_address=None, user_group=None):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''INSERT INTO survey (user_id, age, experience, study, gender, mail, ip_address, user_group, start_time)
-                      VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                      ON CONFLICT (user_id) DO UPDATE
-                      SET age = EXCLUDED.age,
-                          experience = EXCLUDED.experience,
-                            study = EXCLUDED.study,
-                            gender = EXCLUDED.gender,
-                            mail = EXCLUDED.mail,
-                          ip_address = EXCLUDED.ip_address,
-                            user_group = EXCLUDED.user_group,
-                            start_time = EXCLUDED.start_time ''',
-
-                   (user_id, age, experience, study, gender, mail, ip_address, user_group, datetime.now()))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    # Laeuft nur einmal pro Prozess, siehe migrations.py
+    from migrations import migrate
+    migrate()
+
+# Mehrfaches Schreiben desselben Schluessels im Batch vermeiden (ON CONFLICT erlaubt das nicht)
+def _last_per_key(rows):
+    return list({row[0]: row for row in rows}.values())
+
+
+# Versionen der Journal-Datensaetze je Art: zuerst die urspruenglichen Felder, jede weitere Version
+# haengt Felder hinten an, mit dem Wert fuer Zeilen aelterer Versionen (Funktionen beim Nachholen
+# ausgewertet). Neue Felder nur als neue Version eintragen; die Bulk-Schreiber sehen immer die aktuelle.
+_JOURNAL_VERSIONS = {
+    "survey": [
+        ["user_id", "age", "experience", "study", "gender", "mail", "ip_address", "user_group", "start_time"],
+        {"scenario_id": 0},
+        {"experiment_id": DEFAULT_EXPERIMENT},
+    ],
+    "action": [
+        ["action_key", "user_id", "period", "action", "stock_name", "amount", "price"],
+        # Migration 12
+        {"traded_at": None},
+    ],
+    "account": [
+        ["user_id", "cash", "holdings"],
+        # Laeufe: Lauf 'default', Start beim Nachholen
+        {"experiment_id": DEFAULT_EXPERIMENT, "start_time": lambda: datetime.now().isoformat()},
+    ],
+    "snapshot": [
+        ["user_id", "period", "data", "updated_at"],
+        {"resume_token": None},
+    ],
+}
+
+
+# Vom Spool beim Replay aufgerufen: Datensatz einer aelteren Version auf die aktuelle bringen
+def upgrade_journal_record(kind, payload):
+    versions = _JOURNAL_VERSIONS.get(kind)
+    if versions is None:
+        return payload
+    fields, sizes = list(versions[0]), [len(versions[0])]
+    for added in versions[1:]:
+        fields += added
+        sizes.append(len(fields))
+    if len(payload) not in sizes:
+        raise ValueError(f"{kind} record with {len(payload)} fields, expected one of {sizes}")
+    record = dict(zip(fields, payload))
+    for added in versions[sizes.index(len(payload)) + 1:]:
+        record.update((name, default() if callable(default) else default) for name, default in added.items())
+    return [record[name] for name in fields]
+
+
+# Bulk-Schreiber: idempotent, damit das Journal gefahrlos mehrfach nachgespielt werden kann
+@timed("db.save_surveys_bulk")
+def save_surveys_bulk(rows):
+    rows = _last_per_key(rows)
+    _ensure_partitions((row[10], row[8]) for row in rows)
+    with get_db() as conn, conn.cursor() as cursor:
+        get_storage().insert_many(cursor, '''INSERT INTO survey (user_id, age, experience, study, gender, mail, ip_address, user_group, start_time, scenario_id, experiment_id)
+                          VALUES %s
+                          ON CONFLICT (experiment_id, start_time, user_id) DO UPDATE
+                          SET age = EXCLUDED.age,
+                              experience = EXCLUDED.experience,
+                              study = EXCLUDED.study,
+                              gender = EXCLUDED.gender,
+                              mail = EXCLUDED.mail,
+                              ip_address = COALESCE(EXCLUDED.ip_address, survey.ip_address),
+                              user_group = EXCLUDED.user_group,
+                              scenario_id = EXCLUDED.scenario_id ''',
+                       rows)
+
+@timed("db.update_survey_ips_bulk")
+def update_survey_ips_bulk(rows):
+    with get_db() as conn, conn.cursor() as cursor:
+        get_storage().execute_many(cursor, "UPDATE survey SET ip_address = %s WHERE user_id = %s",
+                                   [(ip_address, user_id) for user_id, ip_address in _last_per_key(rows)])
+
+# Bereits gepruefte Trades ohne Ledger uebernehmen (Import); Zeilen mit experiment_id, start_time
+# und traded_at (None, wenn unbekannt)
+@timed("db.save_actions_bulk")
+def save_actions_bulk(rows):
+    _ensure_partitions((row[7], row[8]) for row in rows)
+    with get_db() as conn, conn.cursor() as cursor:
+        get_storage().insert_many(cursor, '''INSERT INTO actions (action_key, user_id, period, action, stock_name, amount, price, experiment_id, start_time, traded_at)
+                          VALUES %s
+                          ON CONFLICT (experiment_id, start_time, action_key) DO NOTHING''',
+                       rows)
+
+# Startkapital und Geschenke; bestehende Konten bleiben unveraendert (Replay aus dem Journal)
+@timed("db.save_accounts_bulk")
+def save_accounts_bulk(rows):
+    rows = _last_per_key(rows)
+    _ensure_partitions((row[3], row[4]) for row in rows)
+    with get_db() as conn, conn.cursor() as cursor:
+        storage = get_storage()
+        storage.insert_many(cursor, '''INSERT INTO accounts (user_id, cash, experiment_id, start_time)
+                          VALUES %s
+                          ON CONFLICT (user_id) DO NOTHING''',
+                       [(user_id, cash, experiment_id, start_time) for user_id, cash, _, experiment_id, start_time in rows])
+        positions = [(row[0], name, amount) for row in rows for name, amount in row[2].items() if amount]
+        if positions:
+            storage.insert_many(cursor, '''INSERT INTO positions (user_id, stock_name, amount)
+                              VALUES %s
+                              ON CONFLICT (user_id, stock_name) DO NOTHING''',
+                           positions)
+
+TRADE_STATUSES = ("ok", "duplicate", "cash", "holdings", "no_account", "invalid")
+_rejected_trades = 0
+_rejected_lock = threading.Lock()
+
+# Trades gegen accounts/positions pruefen und an actions anhaengen, ein Roundtrip fuer den ganzen Batch.
+# Abgelehnte Trades werden nicht gebucht, sondern landen in rejected.log des Journals;
+# "duplicate" heisst, der action_key ist schon gebucht (Replay, doppelter Klick).
+# "no_account" ist keine Ablehnung: das Konto kann noch im Journal stehen, der Aufrufer entscheidet.
+def _book_trades(rows):
+    global _rejected_trades
+    rows = [tuple(row) for row in rows]
+    with get_db() as conn, conn.cursor() as cursor:
+        statuses = get_storage().apply_trades(cursor, rows)
+    rejected = [(row, status) for row, status in zip(rows, statuses) if status not in ("ok", "duplicate", "no_account")]
+    if rejected:
+        for row, status in rejected:
+            logger.warning("Trade rejected (%s): %s", status, row)
+        spool.reject("action", [list(row) for row, _ in rejected])
+        with _rejected_lock:
+            _rejected_trades += len(rejected)
+    return statuses
+
+# Handler fuer Journal und Write-Behind: Trades ohne Konto kommen hinter das Konto ins Journal
+@timed("db.save_trades_bulk")
+def save_trades_bulk(rows):
+    statuses = _book_trades(rows)
+    waiting = [row for row, status in zip(rows, statuses) if status == "no_account"]
+    if waiting:
+        raise RetryLater(f"No account yet for {len(waiting)} trades", waiting)
+    return statuses
+
+# Ergebnisse unterscheiden sich erst ab einem Cent (results.total_value ist REAL)
+RESULT_TOLERANCE = 0.005
+
+def _bucket(value):
+    return math.floor(value)
 
+# Deltas fuer result_stats/result_buckets je (Lauf, Gruppe); old ist None fuer neue Spieler
+def _count_result(stats, buckets, key, old, new):
+    players, total, total_sq = stats.get(key, (0, 0.0, 0.0))
+    if old is None:
+        players += 1
+    else:
+        total -= old
+        total_sq -= old * old
+        buckets[(*key, _bucket(old))] = buckets.get((*key, _bucket(old)), 0) - 1
+    stats[key] = (players, total + new, total_sq + new * new)
+    buckets[(*key, _bucket(new))] = buckets.get((*key, _bucket(new)), 0) + 1
+
+def _write_result_aggregates(cursor, stats, buckets):
+    storage = get_storage()
+    storage.insert_many(cursor, '''INSERT INTO result_stats (experiment_id, user_group, players, total, total_sq)
+                          VALUES %s
+                          ON CONFLICT (experiment_id, user_group) DO UPDATE
+                          SET players = result_stats.players + EXCLUDED.players,
+                              total = result_stats.total + EXCLUDED.total,
+                              total_sq = result_stats.total_sq + EXCLUDED.total_sq''',
+                       [(*key, *values) for key, values in stats.items()])
+    storage.insert_many(cursor, '''INSERT INTO result_buckets (experiment_id, user_group, bucket, players)
+                          VALUES %s
+                          ON CONFLICT (experiment_id, user_group, bucket) DO UPDATE
+                          SET players = result_buckets.players + EXCLUDED.players''',
+                       [(*key, count) for key, count in buckets.items() if count])
+
+# Schreibt nur geaenderte Ergebnisse und fuehrt result_stats/result_buckets in derselben Transaktion nach.
+# Lauf und Spielstart (Partition) kommen aus der Umfrage des Spielers; fehlt sie noch (z. B. im Journal),
+# wird das Ergebnis hinter ihr erneut eingereiht.
+@timed("db.save_results_bulk")
+def save_results_bulk(payloads):
+    rows = _last_per_key(payloads)
+    if not rows:
+        return
+    with get_db() as conn, conn.cursor() as cursor:
+        user_ids = [row[0] for row in rows]
+        placeholders = ", ".join(["%s"] * len(user_ids))
+        cursor.execute(f"SELECT user_id, COALESCE(user_group, ''), experiment_id, start_time FROM survey "
+                       f"WHERE user_id IN ({placeholders})", user_ids)
+        sessions = {user_id: (group, experiment_id, start_time) for user_id, group, experiment_id, start_time in cursor.fetchall()}
+        missing = [user_id for user_id in user_ids if user_id not in sessions]
+        cursor.execute(f"SELECT user_id, total_value FROM results WHERE user_id IN ({placeholders})", user_ids)
+        previous = dict(cursor.fetchall())
+
+        changed = []
+        stats = {}
+        buckets = {}
+        for user_id, total_value in rows:
+            old = previous.get(user_id)
+            if user_id not in sessions or (old is not None and abs(old - total_value) < RESULT_TOLERANCE):
+                continue
+            group, experiment_id, start_time = sessions[user_id]
+            changed.append((user_id, total_value, experiment_id, start_time))
+            _count_result(stats, buckets, (experiment_id, group), old, total_value)
+
+        if changed:
+            get_storage().insert_many(cursor, '''INSERT INTO results (user_id, total_value, experiment_id, start_time)
+                              VALUES %s
+                              ON CONFLICT (experiment_id, start_time, user_id) DO UPDATE
+                              SET total_value = EXCLUDED.total_value''',
+                           changed)
+            _write_result_aggregates(cursor, stats, buckets)
+    if missing:
+        raise RetryLater(f"No survey yet for results of {', '.join(missing)}",
+                         [payload for payload in payloads if payload[0] in missing])
+
+# Aggregate neu aufbauen, z. B. nachdem die Aufbewahrung Partitionen entfernt hat
+def _rebuild_result_aggregates(cursor, experiment_id=None):
+    where, params = ("", []) if experiment_id is None else (" WHERE experiment_id = %s", [experiment_id])
+    cursor.execute("DELETE FROM result_stats" + where, params)
+    cursor.execute("DELETE FROM result_buckets" + where, params)
+    query = '''SELECT r.experiment_id, COALESCE(s.user_group, ''), r.total_value
+               FROM results r LEFT JOIN survey s ON s.user_id = r.user_id AND s.experiment_id = r.experiment_id'''
+    if experiment_id is not None:
+        query += " WHERE r.experiment_id = %s"
+    cursor.execute(query, params)
+    stats = {}
+    buckets = {}
+    for experiment_id, group, total_value in cursor.fetchall():
+        _count_result(stats, buckets, (experiment_id, group), None, total_value)
+    if stats:
+        _write_result_aggregates(cursor, stats, buckets)
+
+def _group_stats(players, total, total_sq):
+    mean = total / players if players else None
+    # Stichprobenvarianz aus den laufenden Summen
+    variance = max(total_sq - players * mean * mean, 0.0) / (players - 1) if players > 1 else None
+    return {"players": players, "mean": mean, "variance": variance,
+            "std": math.sqrt(variance) if variance is not None else None}
+
+# Anzahl, Mittelwert und Varianz der Endwerte je Gruppe (Zeile "all": alle zusammen), ueber alle oder einen Lauf
+@timed("db.get_result_stats")
+def get_result_stats(experiment_id=None):
+    import pandas as pd
+
+    where, params = ("", []) if experiment_id is None else (" WHERE experiment_id = %s", [experiment_id])
+    with get_db() as conn, conn.cursor() as cursor:
+        cursor.execute(f"SELECT user_group, SUM(players), SUM(total), SUM(total_sq) FROM result_stats{where} "
+                       "GROUP BY user_group ORDER BY user_group", params)
+        rows = cursor.fetchall()
+    stats = {group or "unknown": _group_stats(players, total, total_sq) for group, players, total, total_sq in rows if players}
+    if rows:
+        stats["all"] = _group_stats(*(sum(row[i] for row in rows) for i in (1, 2, 3)))
+    return pd.DataFrame.from_dict(stats, orient="index")
+
+# Rang (1 = bester, gleiche Werte teilen sich den Rang) und Perzentil im eigenen Lauf, gesamt und in der
+# eigenen Gruppe. Liest nur die Bucket-Zaehler (Anzahl unabhaengig von der Spielerzahl) und die Spieler
+# im eigenen Bucket.
+@timed("db.get_result_rank")
+def get_result_rank(user_id):
+    with get_db() as conn, conn.cursor() as cursor:
+        cursor.execute('''SELECT r.total_value, COALESCE(s.user_group, ''), r.experiment_id
+                          FROM results r LEFT JOIN survey s ON s.user_id = r.user_id AND s.experiment_id = r.experiment_id
+                          WHERE r.user_id = %s''', (user_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        value, group, experiment_id = row
+        bucket = _bucket(value)
+        cursor.execute('''SELECT user_group, SUM(CASE WHEN bucket > %s THEN players ELSE 0 END), SUM(players)
+                          FROM result_buckets WHERE experiment_id = %s GROUP BY user_group''', (bucket, experiment_id))
+        counts = {g: (above, players) for g, above, players in cursor.fetchall()}
+        cursor.execute('''SELECT COALESCE(s.user_group, ''), COUNT(*)
+                          FROM results r LEFT JOIN survey s ON s.user_id = r.user_id AND s.experiment_id = r.experiment_id
+                          WHERE r.experiment_id = %s AND r.total_value > %s AND r.total_value < %s
+                          GROUP BY COALESCE(s.user_group, '')''', (experiment_id, value, bucket + 1))
+        for g, above in cursor.fetchall():
+            counts[g] = (counts.get(g, (0, 0))[0] + above, counts.get(g, (0, 0))[1])
+        cursor.execute("SELECT players, total, total_sq FROM result_stats WHERE experiment_id = %s AND user_group = %s",
+                       (experiment_id, group))
+        stats = cursor.fetchone()
+
+    above = sum(a for a, _ in counts.values())
+    players = sum(p for _, p in counts.values())
+    group_above, group_players = counts.get(group, (0, 0))
+    group_stats = _group_stats(*stats) if stats else _group_stats(0, 0.0, 0.0)
+    return {
+        "total_value": value,
+        "experiment_id": experiment_id,
+        "rank": above + 1,
+        "players": players,
+        "percentile": 100 * (players - above) / players if players else None,
+        "group": group or None,
+        "group_rank": group_above + 1,
+        "group_players": group_players,
+        "group_percentile": 100 * (group_players - group_above) / group_players if group_players else None,
+        "group_mean": group_stats["mean"],
+        "group_std": group_stats["std"],
+    }
+
+# Snapshots kommen base64-kodiert an, damit sie im JSON-Journal gespoolt werden koennen.
+# Ein aelterer Snapshot (Hintergrund-Schreiber, Journal) ueberschreibt nie einen neueren.
+@timed("db.save_snapshots_bulk")
+def save_snapshots_bulk(rows):
+    rows = [(user_id, period, base64.b64decode(data), updated_at, resume_token)
+            for user_id, period, data, updated_at, resume_token in _last_per_key(rows)]
+    with get_db() as conn, conn.cursor() as cursor:
+        get_storage().insert_many(cursor, '''INSERT INTO game_snapshots (user_id, period, data, updated_at, resume_token)
+                          VALUES %s
+                          ON CONFLICT (user_id) DO UPDATE
+                          SET period = EXCLUDED.period,
+                              data = EXCLUDED.data,
+                              updated_at = EXCLUDED.updated_at,
+                              resume_token = COALESCE(EXCLUDED.resume_token, game_snapshots.resume_token)
+                          WHERE game_snapshots.updated_at IS NULL OR game_snapshots.updated_at <= EXCLUDED.updated_at''',
+                       rows)
+
+
+spool = Spool(handlers={
+    "survey": save_surveys_bulk,
+    "survey_ip": update_survey_ips_bulk,
+    "action": save_trades_bulk,
+    "account": save_accounts_bulk,
+    "result": save_results_bulk,
+    "snapshot": save_snapshots_bulk,
+}, is_transient=lambda exc: get_storage().is_transient(exc), upgrade=upgrade_journal_record)
+
+
+@timed("db.save_survey")
+def save_survey(user_id, age, experience, study, gender, mail, ip_address=None, user_group=None, scenario_id=0,
+                experiment_id=None, start_time=None):
+    experiment_id = check_experiment_id(experiment_id or EXPERIMENT_ID)
+    start_time = (start_time or datetime.now()).isoformat()
+    row = [user_id, age, experience, study, gender, mail, ip_address, user_group, start_time, scenario_id, experiment_id]
+    spool.write("survey", [row], save_surveys_bulk)
+
+@timed("db.update_survey_ip")
+def update_survey_ip(user_id, ip_address):
+    spool.write("survey_ip", [[user_id, ip_address]], update_survey_ips_bulk)
+
+def _snapshot_row(user_id, period, data, resume_token=None):
+    return [user_id, period, base64.b64encode(data).decode("ascii"), datetime.now().isoformat(timespec="microseconds"),
+            resume_token]
+
+# Synchron, z. B. beim Periodenwechsel; ein noch wartender Snapshot des Spielers ist damit veraltet
+@timed("db.save_snapshot")
+def save_snapshot(user_id, period, data, resume_token=None):
+    _snapshot_writer.discard(user_id)
+    spool.write("snapshot", [_snapshot_row(user_id, period, data, resume_token)], save_snapshots_bulk)
+
+# Nur mit dem Token aus der URL des Spielers; die 8-stellige user_id allein reicht nicht
+@timed("db.load_snapshot")
+def load_snapshot(user_id, resume_token):
+    if not resume_token:
+        return None
+    with get_db() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT data, resume_token FROM game_snapshots WHERE user_id = %s", (user_id,))
+        row = cursor.fetchone()
+    if row is None or row[1] is None or not hmac.compare_digest(row[1], resume_token):
+        return None
+    return bytes(row[0])
+
+@timed("db.load_result")
+def load_result(user_id):
+    with get_db() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT total_value FROM results WHERE user_id = %s", (user_id,))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+# Zeitpunkt des Klicks, nicht des Schreibens: legt die Reihenfolge der Trades einer Periode fest
+def _action_row(action, user_id):
+    return [uuid.uuid4().hex, user_id, action['Period'], action['Action'], action['Stock'], action['Amount'], action['Price'],
+            datetime.now().isoformat()]
+
+@timed("db.save_action")
 def save_action(action, user_id):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''INSERT INTO actions (user_id, period, action, stock_name, amount, price)
-                      VALUES (%s, %s, %s, %s, %s, %s)''',
-                   (user_id, action['Period'], action['Action'], action['Stock'], action['Amount'], action['Price']))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    spool.write("action", [_action_row(action, user_id)], save_trades_bulk)
+
+@timed("db.open_account")
+# experiment_id und start_time wie in save_survey: Trades landen in derselben Partition
+def open_account(user_id, cash, holdings, experiment_id=None, start_time=None):
+    experiment_id = check_experiment_id(experiment_id or EXPERIMENT_ID)
+    start_time = (start_time or datetime.now()).isoformat()
+    spool.write("account", [[user_id, cash, dict(holdings), experiment_id, start_time]], save_accounts_bulk)
+
+# Synchron mit Status, ohne Journal: fuer Aufrufer, die die Antwort der Datenbank brauchen
+@timed("db.submit_trade")
+def submit_trade(action, user_id):
+    return _book_trades([_action_row(action, user_id)])[0]
+
+@timed("db.submit_trades")
+def submit_trades(actions, user_id):
+    return _book_trades([_action_row(action, user_id) for action in actions])
+
+@timed("db.get_account")
+def get_account(user_id):
+    with get_db() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT cash FROM accounts WHERE user_id = %s", (user_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        cursor.execute("SELECT stock_name, amount FROM positions WHERE user_id = %s AND amount > 0", (user_id,))
+        return row[0], dict(cursor.fetchall())
+
+class ActionWriter:
+    def __init__(self, batch_size=ACTION_BATCH_SIZE, flush_interval=ACTION_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="action-writer", daemon=True)
+                    self._thread.start()
+
+    def put(self, action, user_id):
+        self._ensure_started()
+        self._queue.put(_action_row(action, user_id))
+
+    def depth(self):
+        return self._queue.qsize() + self._pending
+
+    def flush(self, timeout=None):
+        if self._thread is None or not self._thread.is_alive():
+            return self.depth() == 0
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            wait = None if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=wait)
+            except queue.Empty:
+                item = None
 
+            if isinstance(item, threading.Event):
+                batch = self._write(batch)
+                item.set()
+            elif item is not None:
+                batch.append(item)
+                self._pending = len(batch)
+                if len(batch) == 1:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) >= self.batch_size:
+                    batch = self._write(batch)
+            else:
+                batch = self._write(batch)
+            self._pending = len(batch)
+
+    # Bei Fehlern oder offenem Breaker landet der Batch im Journal und gilt damit als gesichert
+    def _write(self, batch):
+        if batch:
+            spool.write("action", batch, save_trades_bulk)
+        return []
+
+
+_action_writer = ActionWriter()
+
+
+# Snapshots nach Trades: nur der neueste je Spieler wird im Hintergrund geschrieben,
+# damit der Klick auf "Execute" nicht auf die Datenbank wartet
+class SnapshotWriter:
+    def __init__(self, flush_interval=ACTION_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._latest = {}
+        self._thread = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="snapshot-writer", daemon=True)
+                    self._thread.start()
+
+    def put(self, row):
+        with self._lock:
+            self._latest[row[0]] = row
+        self._ensure_started()
+
+    def discard(self, user_id):
+        with self._lock:
+            self._latest.pop(user_id, None)
+
+    def depth(self):
+        with self._lock:
+            return len(self._latest)
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                rows, self._latest = list(self._latest.values()), {}
+            if rows:
+                spool.write("snapshot", rows, save_snapshots_bulk)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Snapshot writer failed")
+
+
+_snapshot_writer = SnapshotWriter()
+
+
+@timed("db.queue_snapshot")
+def queue_snapshot(user_id, period, data, resume_token=None):
+    _snapshot_writer.put(_snapshot_row(user_id, period, data, resume_token))
+
+
+@timed("db.queue_action")
+def queue_action(action, user_id):
+    _action_writer.put(action, user_id)
+
+
+@timed("db.flush_actions")
+def flush_actions(timeout=None):
+    return _action_writer.flush(timeout)
+
+
+def flush_snapshots():
+    _snapshot_writer.flush()
+
+
+def action_queue_depth():
+    return _action_writer.depth()
+
+
+def get_write_status():
+    return dict(spool.stats(), queued_actions=action_queue_depth(), queued_snapshots=_snapshot_writer.depth(),
+                rejected_trades=_rejected_trades)
+
+
+atexit.register(flush_actions, 10)
+atexit.register(flush_snapshots)
+
+# Zuletzt geschriebenes Ergebnis je Spieler: die Seite ruft save_result in Periode 15 bei jedem Rerun
+RESULT_CACHE_SIZE = 10_000
+_saved_results = OrderedDict()
+_saved_results_lock = threading.Lock()
+
+@timed("db.save_result")
 def save_result(total_value, user_id):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''INSERT INTO results (user_id, total_value)
-                      VALUES (%s, %s)
-                      ON CONFLICT (user_id) DO UPDATE
-                      SET total_value = EXCLUDED.total_value''',
-                   (user_id, total_value))
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-def get_user_count():
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute("SELECT COUNT(*) FROM survey")
+    with _saved_results_lock:
+        if _saved_results.get(user_id) == total_value:
+            _saved_results.move_to_end(user_id)
+            return
+    # Alle Trades muessen vor dem Ergebnis gesichert sein (DB oder Journal)
+    flush_actions(timeout=10)
+    spool.write("result", [[user_id, total_value]], save_results_bulk)
+    with _saved_results_lock:
+        _saved_results[user_id] = total_value
+        _saved_results.move_to_end(user_id)
+        while len(_saved_results) > RESULT_CACHE_SIZE:
+            _saved_results.popitem(last=False)
+
+@timed("db.get_user_count")
+def get_user_count(experiment_id=None):
+    query, params = "SELECT COUNT(*) FROM survey", []
+    if experiment_id is not None:
+        query, params = query + " WHERE experiment_id = %s", [experiment_id]
+    with get_db() as conn, conn.cursor() as cur:
+        cur.execute(query, params)
         count = cur.fetchone()[0]
-    conn.close()
     return count
 
+# Naechster Slot fuer die Gruppenzuteilung, atomar ueber eine Sequenz
+@timed("db.next_assignment_slot")
+def next_assignment_slot():
+    _ensure_schema()
+    return get_storage().next_assignment_slot()
+
+@timed("db.save_input")
 def save_input(user_id, text):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_input (
-            user_id TEXT,
-            input_text TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    cursor.execute('''
-        INSERT INTO user_input (user_id, input_text)
-        VALUES (%s, %s)
-    ''', (user_id, text))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with get_db() as conn, conn.cursor() as cursor:
+        cursor.execute('''
+            INSERT INTO user_input (user_id, input_text)
+            VALUES (%s, %s)
+        ''', (user_id, text))
+
+# Aufbewahrung: entfernt ganze Monate (Postgres: DROP der Partitionen), deren Spielstart vollstaendig
+# aelter als `days` Tage ist. Daten bleiben also mindestens `days` und hoechstens einen Monat laenger.
+# Konten, Bestaende, Snapshots und Freitexte aus dieser Zeit werden mit geloescht, die Ranglisten neu gezaehlt.
+@timed("db.purge_expired")
+def purge_expired(days=RETENTION_DAYS, experiment_id=None, today=None):
+    before = ((today or date.today()) - timedelta(days=days)).replace(day=1)
+    _ensure_schema()
+    dropped = get_storage().drop_partitions(before, experiment_id)
+    with get_db() as conn, conn.cursor() as cursor:
+        accounts = "SELECT user_id FROM accounts WHERE start_time < %s"
+        params = [before.isoformat()]
+        if experiment_id is not None:
+            accounts += " AND experiment_id = %s"
+            params.append(experiment_id)
+        cursor.execute(f"DELETE FROM positions WHERE user_id IN ({accounts})", params)
+        cursor.execute(f"DELETE FROM accounts WHERE user_id IN ({accounts})", params)
+        if experiment_id is None:
+            cursor.execute("DELETE FROM game_snapshots WHERE updated_at < %s", (before.isoformat(),))
+            cursor.execute("DELETE FROM user_input WHERE timestamp < %s", (before.isoformat(),))
+        _rebuild_result_aggregates(cursor, experiment_id)
+    with _partitions_lock:
+        _partitions_ready.clear()
+    return dropped
 
+# Einen Lauf komplett entfernen (Postgres: DROP seiner Partitionen)
+@timed("db.purge_experiment")
+def purge_experiment(experiment_id):
+    check_experiment_id(experiment_id)
+    _ensure_schema()
+    dropped = get_storage().drop_experiment(experiment_id)
+    with get_db() as conn, conn.cursor() as cursor:
+        cursor.execute("DELETE FROM positions WHERE user_id IN (SELECT user_id FROM accounts WHERE experiment_id = %s)",
+                       (experiment_id,))
+        cursor.execute("DELETE FROM accounts WHERE experiment_id = %s", (experiment_id,))
+        cursor.execute("DELETE FROM result_stats WHERE experiment_id = %s", (experiment_id,))
+        cursor.execute("DELETE FROM result_buckets WHERE experiment_id = %s", (experiment_id,))
+        cursor.execute("DELETE FROM experiments WHERE experiment_id = %s", (experiment_id,))
+    with _partitions_lock:
+        _partitions_ready.clear()
+    return dropped
@@ -0,0 +1,364 @@
+import argparse
+
+import numpy as np
+
+# Spielregeln ohne Streamlit- und Datenbankabhaengigkeit.
+# Die App und die Bot-Simulation nutzen dieselben Klassen und Startbedingungen.
+
+START_PERIOD = 6
+END_PERIOD = 15
+
+# Startbedingungen je Gruppe, Gesamtwert jeweils ca. 1000€
+GROUPS = {
+    "control": {"capital": 1000, "gifts": []},
+    "treatment": {"capital": 500, "gifts": [("Lunaris Ventures", 10)]},
+}
+
+STRATEGIES = ("random", "momentum", "buy_and_hold")
+
+
+class Stock:
+    __slots__ = ("name", "price_history", "price")
+
+    # price_history ist eine schreibgeschuetzte Sicht auf die geteilte PriceMatrix
+    def __init__(self, name, price_history):
+        self.name = name
+        self.price_history = price_history
+        self.price = float(price_history[-1]) if len(price_history) else 0
+
+    def update_price(self, period):
+        if period <= len(self.price_history):
+            self.price = float(self.price_history[period - 1])
+            return self.price
+        return self.price
+
+    def price_change(self, current_period=None):
+        if current_period is None or current_period <= 1:
+            return 0.0
+        if current_period > len(self.price_history):
+            current_period = len(self.price_history)
+        
+        try:
+            current_price = float(self.price_history[current_period - 1])
+            previous_price = float(self.price_history[current_period - 2])
+            if previous_price == 0:
+                return 0.0
+            return round(((current_price - previous_price) / previous_price) * 100, 2)
+        except IndexError:
+            return 0.0
+
+
+class Portfolio:
+    # Bestaende und Einstandspreise als Arrays mit festem Aktienindex
+    __slots__ = ("names", "index", "amounts", "buy_prices", "opened", "_seq")
+
+    def __init__(self, names=()):
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.amounts = np.zeros(len(self.names), dtype=np.int64)
+        self.buy_prices = np.zeros(len(self.names), dtype=np.float64)
+        # Reihenfolge der Eroeffnung, damit die Tabelle wie bisher sortiert ist
+        self.opened = np.zeros(len(self.names), dtype=np.int64)
+        self._seq = 0
+
+    def _slot(self, name):
+        i = self.index.get(name)
+        if i is None:
+            i = len(self.names)
+            self.names.append(name)
+            self.index[name] = i
+            self.amounts = np.append(self.amounts, 0)
+            self.buy_prices = np.append(self.buy_prices, 0.0)
+            self.opened = np.append(self.opened, 0)
+        return i
+
+    def __contains__(self, name):
+        i = self.index.get(name)
+        return i is not None and self.amounts[i] > 0
+
+    def __len__(self):
+        return int(np.count_nonzero(self.amounts))
+
+    def amount(self, name):
+        i = self.index.get(name)
+        return int(self.amounts[i]) if i is not None else 0
+
+    def buy_price(self, name):
+        i = self.index.get(name)
+        return float(self.buy_prices[i]) if i is not None else 0.0
+
+    def add(self, name, amount, price):
+        i = self._slot(name)
+        if self.amounts[i] > 0:
+            self.buy_prices[i] = (self.buy_prices[i] + price) / 2
+        else:
+            self.buy_prices[i] = price
+            self._seq += 1
+            self.opened[i] = self._seq
+        self.amounts[i] += amount
+
+    def remove(self, name, amount):
+        i = self.index[name]
+        self.amounts[i] -= amount
+        if self.amounts[i] == 0:
+            self.buy_prices[i] = 0.0
+
+    def held(self):
+        held = np.flatnonzero(self.amounts)
+        return held[np.argsort(self.opened[held], kind="stable")]
+
+    def items(self):
+        for i in self.held():
+            yield self.names[i], {"amount": int(self.amounts[i]), "buy_price": float(self.buy_prices[i])}
+
+    def price_vector(self, stocks):
+        prices = np.zeros(len(self.names), dtype=np.float64)
+        for stock in stocks:
+            i = self.index.get(stock.name)
+            if i is not None:
+                prices[i] = stock.price
+        return prices
+
+
+class Player:
+    __slots__ = ("capital", "portfolio", "actions", "performance", "on_action")
+
+    # on_action wird nach jedem ausgefuehrten Trade aufgerufen (z. B. Speichern in der DB)
+    def __init__(self, capital, on_action=None, stock_names=()):
+        self.capital = capital
+        self.portfolio = Portfolio(stock_names)
+        self.actions = []
+        self.performance = []
+        self.on_action = on_action
+
+    def track_performance(self, stocks):
+        total = self.total_value(stocks)
+        self.performance.append(total)
+
+    def _record(self, action):
+        self.actions.append(action)
+        if self.on_action is not None:
+            self.on_action(action)
+
+    def buy(self, stock: Stock, amount: int, period: int):
+        cost = stock.price * amount
+        if self.capital >= cost:
+            self.capital -= cost
+            self.portfolio.add(stock.name, amount, stock.price)
+            self._record(
+                {"Period": period, "Action": "Buy", "Stock": stock.name, "Amount": amount, "Price": stock.price}
+            )
+            return f"Bought {amount} of {stock.name} at {stock.price:.2f}€"
+        else:
+            return "Not enough cash."
+
+    def sell(self, stock: Stock, amount: int, period: int):
+        if stock.name in self.portfolio and self.portfolio.amount(stock.name) >= amount:
+            self.capital += stock.price * amount
+            self.portfolio.remove(stock.name, amount)
+            self._record(
+                {"Period": period, "Action": "Sell", "Stock": stock.name, "Amount": amount, "Price": stock.price}
+            )
+            return f"Sold {amount} of {stock.name} at {stock.price:.2f}€"
+        else:
+            return "Not enough stock to sell."
+
+    def total_value(self, stocks: list):
+        prices = self.portfolio.price_vector(stocks)
+        return round(float(self.capital + self.portfolio.amounts @ prices), 2)
+
+    # Bewertung, Gewinn/Verlust und Summen fuer die Portfolio-Tabelle in einem Durchlauf
+    def valuation(self, stocks: list):
+        portfolio = self.portfolio
+        held = portfolio.held()
+        prices = portfolio.price_vector(stocks)[held]
+        amounts = portfolio.amounts[held]
+        buy_prices = portfolio.buy_prices[held]
+
+        values = amounts * prices
+        with np.errstate(divide="ignore", invalid="ignore"):
+            change = np.where(buy_prices != 0, (prices - buy_prices) / buy_prices * 100, 0.0)
+        gain_loss = np.round((prices - buy_prices) * amounts, 2)
+
+        return {
+            "names": [portfolio.names[i] for i in held],
+            "amounts": amounts,
+            "buy_prices": buy_prices,
+            "prices": prices,
+            "values": values,
+            "change": change,
+            "gain_loss": gain_loss,
+            "invested": float(amounts @ buy_prices),
+            "market_value": float(values.sum()),
+        }
+
+
+def start_game(stocks, group, on_action=None):
+    conditions = GROUPS[group]
+    player = Player(capital=conditions["capital"], on_action=on_action, stock_names=[s.name for s in stocks])
+
+    # Treatment-Group: geschenkte Aktien zum Kurs der ersten Periode
+    for name, amount in conditions["gifts"]:
+        stock = next((s for s in stocks if s.name == name), None)
+        assert stock is not None, f"{name} wurde nicht in stocks gefunden!"
+        buy_price = round(float(stock.price_history[0]), 2)
+        player.portfolio.add(name, amount, buy_price)
+
+    for period in range(1, START_PERIOD):
+        for stock in stocks:
+            stock.update_price(period)
+        player.track_performance(stocks)
+    return player
+
+
+# Batch-Modus: viele Bots gleichzeitig als Arrays (Spieler x Aktien)
+#
+# In der App wird in Periode p zum Kurs der Vorperiode gehandelt (prices[:, p - 2]),
+# bewertet wird am Ende mit dem Kurs von END_PERIOD.
+
+def trade_prices(prices, period):
+    return prices[:, period - 2]
+
+
+def initial_state(names, prices, n, group):
+    conditions = GROUPS[group]
+    index = {name: i for i, name in enumerate(names)}
+    cash = np.full(n, float(conditions["capital"]))
+    holdings = np.zeros((n, len(names)), dtype=np.int64)
+    for name, amount in conditions["gifts"]:
+        assert name in index, f"{name} wurde nicht in stocks gefunden!"
+        holdings[:, index[name]] = amount
+    return cash, holdings
+
+
+class RandomStrategy:
+    def __init__(self, rng, n, n_stocks, max_amount=10):
+        self.rng = rng
+        self.n_stocks = n_stocks
+        self.max_amount = max_amount
+
+    def step(self, cash, holdings, prices, period):
+        n = len(cash)
+        rows = np.arange(n)
+        price = trade_prices(prices, period)
+        idx = self.rng.integers(self.n_stocks, size=n)
+        amount = self.rng.integers(1, self.max_amount + 1, size=n)
+        buy = self.rng.random(n) < 0.5
+        value = amount * price[idx]
+
+        can_buy = buy & (cash >= value)
+        can_sell = ~buy & (holdings[rows, idx] >= amount)
+        cash += value * can_sell - value * can_buy
+        holdings[rows, idx] += amount * can_buy - amount * can_sell
+
+
+class MomentumStrategy:
+    # Verkauft fallende Aktien, investiert einen Teil des Cashs in den staerksten Anstieg
+    def __init__(self, rng, n, n_stocks, max_lookback=3):
+        self.lookback = rng.integers(1, max_lookback + 1, size=n)
+        self.fraction = rng.uniform(0.25, 1.0, size=n)
+
+    def step(self, cash, holdings, prices, period):
+        rows = np.arange(len(cash))
+        price = trade_prices(prices, period)
+        past = prices[:, np.maximum(period - 2 - self.lookback, 0)].T
+        change = price - past
+
+        falling = change < 0
+        cash += (holdings * price * falling).sum(axis=1)
+        holdings[falling] = 0
+
+        best = change.argmax(axis=1)
+        rising = change[rows, best] > 0
+        amount = np.floor(cash * self.fraction / price[best]).astype(np.int64) * rising
+        cash -= amount * price[best]
+        holdings[rows, best] += amount
+
+
+class BuyAndHoldStrategy:
+    # Investiert in der ersten Periode nach zufaelligen Gewichten und haelt bis zum Ende
+    def __init__(self, rng, n, n_stocks):
+        self.weights = rng.dirichlet(np.ones(n_stocks), size=n)
+
+    def step(self, cash, holdings, prices, period):
+        if period != START_PERIOD:
+            return
+        price = trade_prices(prices, period)
+        amount = np.floor(cash[:, None] * self.weights / price).astype(np.int64)
+        cash -= (amount * price).sum(axis=1)
+        holdings += amount
+
+
+STRATEGY_CLASSES = {
+    "random": RandomStrategy,
+    "momentum": MomentumStrategy,
+    "buy_and_hold": BuyAndHoldStrategy,
+}
+
+
+def simulate_batch(names, prices, n_players, strategies=STRATEGIES, group_shares=None, seed=None):
+    prices = np.asarray(prices, dtype=np.float64)
+    if prices.shape[1] < END_PERIOD:
+        raise ValueError(f"Need at least {END_PERIOD} periods of prices, got {prices.shape[1]}")
+    group_shares = group_shares or {"control": 0.5, "treatment": 0.5}
+    total_share = sum(group_shares.values())
+    rng = np.random.default_rng(seed)
+
+    outcomes = {}
+    for strategy in strategies:
+        for group, share in group_shares.items():
+            n = int(round(n_players * share / total_share))
+            cash, holdings = initial_state(names, prices, n, group)
+            bot = STRATEGY_CLASSES[strategy](rng, n, len(names))
+            for period in range(START_PERIOD, END_PERIOD):
+                bot.step(cash, holdings, prices, period)
+            outcomes[(strategy, group)] = cash + holdings @ prices[:, END_PERIOD - 1]
+    return outcomes
+
+
+def summarize(outcomes):
+    import pandas as pd
+
+    rows = []
+    for (strategy, group), values in outcomes.items():
+        p5, p25, p50, p75, p95 = np.percentile(values, [5, 25, 50, 75, 95]) if len(values) else [np.nan] * 5
+        rows.append({
+            "strategy": strategy,
+            "group": group,
+            "players": len(values),
+            "mean": values.mean() if len(values) else np.nan,
+            "std": values.std() if len(values) else np.nan,
+            "p5": p5,
+            "p25": p25,
+            "median": p50,
+            "p75": p75,
+            "p95": p95,
+        })
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate bot players without Streamlit.")
+    parser.add_argument("--players", type=int, default=10000, help="bots per strategy")
+    parser.add_argument("--strategies", nargs="+", default=list(STRATEGIES), choices=STRATEGIES)
+    parser.add_argument("--treatment-share", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--prices", help="CSV with stock_name, period, price (default: stock_prices table)")
+    parser.add_argument("--scenario", type=int, default=0, help="price scenario from stock_prices")
+    args = parser.parse_args()
+
+    from prices import PriceMatrix, get_price_matrix
+
+    if args.prices:
+        import pandas as pd
+        matrix = PriceMatrix.from_frame(pd.read_csv(args.prices))
+    else:
+        matrix = get_price_matrix(args.scenario)
+
+    shares = {"control": 1 - args.treatment_share, "treatment": args.treatment_share}
+    outcomes = simulate_batch(matrix.names, matrix.prices, args.players, args.strategies, shares, args.seed)
+    print(summarize(outcomes).to_string(index=False, float_format="%.2f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from db_utils import get_db
+from storage import get_storage
+
+# Spalte fuer inkrementelle Exporte je Tabelle (None: nur Vollexport). Nur von der Datenbank
+# vergebene, steigende Werte: spaet aus dem Journal nachgeholte Zeilen bekommen eine neue id.
+EXPORT_TABLES = {
+    "actions": "id",
+    "survey": "id",
+    "results": None,
+    "user_input": "timestamp",
+    "stock_prices": None,
+}
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", 50_000))
+EXPORT_FORMATS = ("csv", "parquet")
+
+
+def _bounds(table, since):
+    column = EXPORT_TABLES[table]
+    if column is None:
+        if since is not None:
+            raise ValueError(f"Table {table} has no watermark column, only full exports are possible")
+        return "", [], None
+    # Obere Grenze vorab festlegen: der Export ist konsistent und liefert das neue Wasserzeichen
+    with get_db() as conn, conn.cursor() as cursor:
+        cursor.execute(f"SELECT MAX({column}) FROM {table}")
+        upper = cursor.fetchone()[0]
+    clauses, params = [f"{column} <= %s"], [upper]
+    if since is not None:
+        clauses.append(f"{column} > %s")
+        params.append(since)
+    return " WHERE " + " AND ".join(clauses), params, upper
+
+
+def _query(table, since):
+    column = EXPORT_TABLES[table]
+    where, params, upper = _bounds(table, since)
+    order = f" ORDER BY {column}" if column else ""
+    return f"SELECT * FROM {table}{where}{order}", params, upper
+
+
+# Postgres: COPY ... TO STDOUT, SQLite: csv.writer ueber einen Cursor
+def export_csv(table, out, since=None):
+    query, params, upper = _query(table, since)
+    get_storage().copy_to_csv(query, params, out)
+    return upper
+
+
+# Postgres-Typ-OIDs -> Arrow-Typen, damit alle Chunks dasselbe Schema haben.
+# SQLite liefert keine Typen in description; dort entscheidet der erste Chunk.
+def _arrow_schema(description, rows):
+    import pyarrow as pa
+
+    types = {
+        16: pa.bool_(),
+        20: pa.int64(),
+        21: pa.int16(),
+        23: pa.int32(),
+        700: pa.float32(),
+        701: pa.float64(),
+        1082: pa.date32(),
+        1114: pa.timestamp("us"),
+        1184: pa.timestamp("us", tz="UTC"),
+        1700: pa.float64(),
+    }
+    python_types = {bool: pa.bool_(), int: pa.int64(), float: pa.float64(), bytes: pa.binary()}
+
+    fields = []
+    for i, column in enumerate(description):
+        if column[1] is not None:
+            fields.append((column[0], types.get(column[1], pa.string())))
+            continue
+        sample = next((row[i] for row in rows if row[i] is not None), None)
+        fields.append((column[0], python_types.get(type(sample), pa.string())))
+    return pa.schema(fields)
+
+
+def export_parquet(table, out, since=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)") from None
+
+    query, params, upper = _query(table, since)
+    writer = None
+    try:
+        # Es liegen nie mehr als chunk_rows Zeilen im Speicher
+        for description, rows in get_storage().iter_chunks(query, params, chunk_rows):
+            if writer is None:
+                schema = _arrow_schema(description, rows)
+                writer = pq.ParquetWriter(out, schema)
+            if rows:
+                columns = list(zip(*rows))
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                    schema=schema,
+                ))
+    finally:
+        if writer is not None:
+            writer.close()
+    return upper
+
+
+def export_table(table, out, fmt="csv", since=None):
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown table {table!r}, expected one of {sorted(EXPORT_TABLES)}")
+    if fmt == "csv":
+        return export_csv(table, out, since)
+    if fmt == "parquet":
+        return export_parquet(table, out, since)
+    raise ValueError(f"Unknown format {fmt!r}, expected one of {EXPORT_FORMATS}")
+
+
+# Fuer st.download_button: Export in eine temporaere Datei, Rueckgabe als Datei-Objekt
+def export_to_tempfile(table, fmt="csv", since=None):
+    handle = tempfile.TemporaryFile()
+    export_table(table, handle, fmt, since)
+    handle.seek(0)
+    return handle
+
+
+def load_state(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(path, state):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2, default=str)
+    os.replace(tmp, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream experiment tables to CSV or Parquet.")
+    parser.add_argument("table", choices=sorted(EXPORT_TABLES))
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--out", help="output file (default: stdout for CSV)")
+    parser.add_argument("--since", help="only rows with a watermark value greater than this")
+    parser.add_argument("--state", help="JSON file that stores the last watermark per table for incremental exports")
+    args = parser.parse_args()
+
+    state = load_state(args.state)
+    since = args.since if args.since is not None else state.get(args.table)
+    # Alte Zustandsdateien: Wasserzeichen der Umfrage war start_time, dann einmal voll exportieren
+    if since is not None and EXPORT_TABLES[args.table] == "id" and not str(since).isdigit():
+        print(f"Ignoring watermark {since!r} for {args.table}, exporting all rows", file=sys.stderr)
+        since = None
+
+    if args.format == "parquet" and not args.out:
+        parser.error("--out is required for parquet")
+
+    if args.out:
+        mode = "wb" if args.format == "parquet" else "w"
+        with open(args.out, mode, **({} if args.format == "parquet" else {"newline": "", "encoding": "utf-8"})) as out:
+            upper = export_table(args.table, out, args.format, since)
+    else:
+        upper = export_table(args.table, sys.stdout, args.format, since)
+
+    if args.state and upper is not None:
+        state[args.table] = upper
+        save_state(args.state, state)
+    print(f"Exported {args.table} up to watermark {upper}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import struct
+import zlib
+
+import numpy as np
+
+from engine import Player, Stock
+
+# Kompakter Binaer-Snapshot eines Spiels (Periode, Cash, Bestaende, Aktienreihenfolge,
+# Trades, Performance). Kurse stehen nicht im Snapshot, sie kommen aus der geteilten
+# PriceMatrix des Kurs-Szenarios. Formataenderungen bekommen eine neue VERSION.
+#
+# Aufbau (little endian):
+#   Header   magic, version, period, cash, seq, n_names, n_order, n_performance, n_actions, len(text),
+#            scenario_id (ab Version 2)
+#   Text     user_id, group und Aktiennamen, mit \x1f getrennt (UTF-8)
+#   Arrays   order (Anzeige-Reihenfolge als Index in names), amounts, buy_prices, opened,
+#            performance, actions (strukturiert, siehe ACTION_DTYPE)
+#   CRC32    ueber alles davor
+
+MAGIC = b"BSGS"
+VERSION = 2
+
+_HEADERS = {
+    1: struct.Struct("<4sBHdIHHHII"),
+    2: struct.Struct("<4sBHdIHHHIII"),
+}
+_CRC = struct.Struct("<I")
+_SEP = "\x1f"
+
+ACTION_DTYPE = np.dtype([
+    ("period", "<u2"),
+    ("action", "u1"),
+    ("stock", "<u2"),
+    ("amount", "<i4"),
+    ("price", "<f8"),
+])
+ACTION_CODES = {"Buy": 0, "Sell": 1}
+ACTION_NAMES = {code: name for name, code in ACTION_CODES.items()}
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+class GameState:
+    __slots__ = ("user_id", "group", "period", "player", "stocks", "scenario_id")
+
+    def __init__(self, user_id, group, period, player, stocks, scenario_id=0):
+        self.user_id = user_id
+        self.group = group
+        self.period = period
+        self.player = player
+        self.stocks = stocks
+        self.scenario_id = scenario_id
+
+
+def dump(state):
+    player = state.player
+    portfolio = player.portfolio
+    names = list(portfolio.names)
+    index = {name: i for i, name in enumerate(names)}
+    for stock in state.stocks:
+        if stock.name not in index:
+            index[stock.name] = len(names)
+            names.append(stock.name)
+    n = len(names)
+
+    def padded(values, dtype):
+        out = np.zeros(n, dtype=dtype)
+        out[:len(values)] = values
+        return out
+
+    order = np.array([index[stock.name] for stock in state.stocks], dtype="<u2")
+    actions = np.empty(len(player.actions), dtype=ACTION_DTYPE)
+    for row, action in enumerate(player.actions):
+        actions[row] = (action["Period"], ACTION_CODES[action["Action"]], index[action["Stock"]],
+                        action["Amount"], action["Price"])
+    performance = np.asarray(player.performance, dtype="<f8")
+
+    text = _SEP.join([state.user_id or "", state.group or "", *names]).encode()
+    header = _HEADERS[VERSION].pack(MAGIC, VERSION, state.period, float(player.capital), portfolio._seq,
+                                    n, len(order), len(performance), len(actions), len(text), state.scenario_id)
+    body = b"".join([
+        header,
+        text,
+        order.tobytes(),
+        padded(portfolio.amounts, "<i8").tobytes(),
+        padded(portfolio.buy_prices, "<f8").tobytes(),
+        padded(portfolio.opened, "<i4").tobytes(),
+        performance.tobytes(),
+        actions.tobytes(),
+    ])
+    return body + _CRC.pack(zlib.crc32(body))
+
+
+# get_matrix(scenario_id) liefert die PriceMatrix, z. B. prices.get_price_matrix
+def load(data, get_matrix, on_action=None):
+    data = bytes(data)
+    if len(data) < 5 + _CRC.size:
+        raise SnapshotError("snapshot too short")
+    body, (crc,) = data[:-_CRC.size], _CRC.unpack(data[-_CRC.size:])
+    if zlib.crc32(body) != crc:
+        raise SnapshotError("snapshot checksum mismatch")
+    if body[:4] != MAGIC:
+        raise SnapshotError("not a game snapshot")
+    header = _HEADERS.get(body[4])
+    if header is None:
+        raise SnapshotError(f"unsupported snapshot version {body[4]}")
+    _, version, period, cash, seq, n, n_order, n_performance, n_actions, text_len, *rest = header.unpack_from(body)
+    scenario_id = rest[0] if rest else 0
+
+    offset = header.size
+    user_id, group, *names = body[offset:offset + text_len].decode().split(_SEP)
+    offset += text_len
+
+    def take(dtype, count):
+        nonlocal offset
+        array = np.frombuffer(body, dtype=dtype, count=count, offset=offset)
+        offset += array.nbytes
+        return array
+
+    order = take("<u2", n_order)
+    amounts = take("<i8", n)
+    buy_prices = take("<f8", n)
+    opened = take("<i4", n)
+    performance = take("<f8", n_performance)
+    actions = take(ACTION_DTYPE, n_actions)
+
+    try:
+        matrix = get_matrix(scenario_id)
+    except KeyError:
+        raise SnapshotError(f"price scenario {scenario_id} not available")
+    unknown = [name for name in names if name not in matrix.index]
+    if unknown:
+        raise SnapshotError(f"stocks missing from price data: {', '.join(unknown)}")
+
+    player = Player(capital=cash, on_action=on_action, stock_names=names)
+    portfolio = player.portfolio
+    portfolio.amounts[:] = amounts
+    portfolio.buy_prices[:] = buy_prices
+    portfolio.opened[:] = opened
+    portfolio._seq = seq
+    player.performance = performance.tolist()
+    player.actions = [
+        {"Period": int(a["period"]), "Action": ACTION_NAMES[int(a["action"])], "Stock": names[a["stock"]],
+         "Amount": int(a["amount"]), "Price": float(a["price"])}
+        for a in actions
+    ]
+
+    stocks = [Stock(names[i], matrix.history(names[i])) for i in order]
+    for stock in stocks:
+        stock.update_price(period - 1)
+    return GameState(user_id or None, group or None, period, player, stocks, scenario_id)
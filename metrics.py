@@ -0,0 +1,259 @@
+import bisect
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Zeitmessung fuer den Hot Path: Spans landen in Histogrammen pro Name.
+# METRICS_ENABLED=0 schaltet alles ab (span() liefert dann einen leeren Kontext).
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", 60))
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", 30))
+
+# Obergrenzen der Buckets in Sekunden (0.1 ms bis 10 s), danach +Inf
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        # Obergrenze des Buckets, in dem das Quantil liegt (fuer den letzten: Maximum)
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "p50_ms": self.quantile(0.5) * 1000,
+            "p95_ms": self.quantile(0.95) * 1000,
+            "p99_ms": self.quantile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+
+class Registry:
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: h.summary() for name, h in sorted(self._histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def prometheus(self):
+        lines = ["# TYPE boersenspiel_span_seconds histogram"]
+        with self._lock:
+            for name, h in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float("inf"),), h.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'boersenspiel_span_seconds_bucket{{span="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'boersenspiel_span_seconds_sum{{span="{name}"}} {h.total}')
+                lines.append(f'boersenspiel_span_seconds_count{{span="{name}"}} {h.count}')
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        registry.observe(self.name, time.perf_counter() - self.start)
+        _ensure_reporter()
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    return _Span(name) if METRICS_ENABLED else _NO_SPAN
+
+
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not METRICS_ENABLED:
+                return func(*args, **kwargs)
+            with _Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    return registry.snapshot()
+
+
+def reset():
+    registry.reset()
+
+
+# Periodische Logzeile und optionaler /metrics-Endpunkt, beide erst beim ersten Span gestartet
+_reporter = None
+_reporter_lock = threading.Lock()
+
+
+def format_summary(stats):
+    return "; ".join(
+        f"{name} n={s['count']} p50={s['p50_ms']:.1f}ms p95={s['p95_ms']:.1f}ms max={s['max_ms']:.1f}ms"
+        for name, s in stats.items()
+    )
+
+
+def _report_loop():
+    while True:
+        time.sleep(METRICS_LOG_INTERVAL)
+        stats = registry.snapshot()
+        if stats:
+            logger.info("timings: %s", format_summary(stats))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _ensure_reporter():
+    global _reporter
+    if _reporter is not None:
+        return
+    with _reporter_lock:
+        if _reporter is not None:
+            return
+        _reporter = threading.Thread(target=_report_loop, name="metrics-log", daemon=True)
+        if METRICS_LOG_INTERVAL > 0:
+            _reporter.start()
+        if METRICS_PORT:
+            try:
+                server = ThreadingHTTPServer(("0.0.0.0", METRICS_PORT), _MetricsHandler)
+            except OSError as exc:
+                # Mehrere Prozesse auf einem Host: nur der erste bekommt den Port
+                logger.warning("metrics endpoint on port %s unavailable: %s", METRICS_PORT, exc)
+            else:
+                threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+
+
+# Profiler pro Session: das Admin-Dashboard markiert user_ids, deren Reruns mit cProfile laufen.
+# Es kann nur ein Profiler gleichzeitig aktiv sein; parallele Reruns laufen dann ungemessen.
+class Profiler:
+    def __init__(self):
+        self.targets = set()
+        self.all_sessions = False
+        self._stats = {}
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+
+    def enabled_for(self, session):
+        return self.all_sessions or (session is not None and session in self.targets)
+
+    def run(self, session, func, *args, **kwargs):
+        if not self.enabled_for(session) or not self._active.acquire(blocking=False):
+            return func(*args, **kwargs)
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            self._active.release()
+            key = session or "all"
+            with self._lock:
+                if key in self._stats:
+                    self._stats[key].add(profile)
+                else:
+                    self._stats[key] = pstats.Stats(profile)
+
+    def sessions(self):
+        with self._lock:
+            return sorted(self._stats)
+
+    def report(self, session, sort="cumulative", limit=PROFILE_TOP_N):
+        with self._lock:
+            stats = self._stats.get(session)
+            if stats is None:
+                return ""
+            out = io.StringIO()
+            stats.stream = out
+            stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+
+profiler = Profiler()
@@ -0,0 +1,720 @@
+import threading
+
+from engine import GROUPS
+from storage import get_storage
+
+# Ledger-Funktionen fuer Postgres, nur hier definiert und von Migration 12 angelegt.
+# apply_trade: Konto sperren, pruefen, Bestand/Cash buchen und den Trade in der Partition des Spielstarts
+# (aus dem Konto) an actions anhaengen. Rueckgabe: ok, duplicate (action_key schon gebucht), cash,
+# holdings, no_account, invalid. apply_trades: mehrere Trades in der uebergebenen Reihenfolge.
+_TRADE_FUNCTIONS = [
+    # Signaturen ohne traded_at (Datenbanken zwischen Migration 9 und 11) blieben sonst als Ueberladung
+    "DROP FUNCTION IF EXISTS apply_trades(TEXT[], TEXT[], INTEGER[], TEXT[], TEXT[], INTEGER[], DOUBLE PRECISION[])",
+    "DROP FUNCTION IF EXISTS apply_trade(TEXT, TEXT, INTEGER, TEXT, TEXT, INTEGER, DOUBLE PRECISION)",
+    '''CREATE OR REPLACE FUNCTION apply_trade(p_key TEXT, p_user_id TEXT, p_period INTEGER, p_action TEXT,
+                                           p_stock TEXT, p_amount INTEGER, p_price DOUBLE PRECISION,
+                                           p_traded_at TIMESTAMP)
+       RETURNS TEXT AS $$
+       DECLARE
+           v_cash DOUBLE PRECISION;
+           v_experiment TEXT;
+           v_start TIMESTAMP;
+           v_held INTEGER;
+       BEGIN
+           IF p_amount IS NULL OR p_amount <= 0 OR p_price IS NULL OR p_price < 0
+              OR p_action IS NULL OR p_action NOT IN ('Buy', 'Sell') THEN
+               RETURN 'invalid';
+           END IF;
+           SELECT cash, experiment_id, start_time INTO v_cash, v_experiment, v_start
+           FROM accounts WHERE user_id = p_user_id FOR UPDATE;
+           IF NOT FOUND THEN
+               RETURN 'no_account';
+           END IF;
+           PERFORM 1 FROM actions WHERE experiment_id = v_experiment AND start_time = v_start AND action_key = p_key;
+           IF FOUND THEN
+               RETURN 'duplicate';
+           END IF;
+           IF p_action = 'Buy' THEN
+               IF v_cash < p_amount * p_price - 1e-6 THEN
+                   RETURN 'cash';
+               END IF;
+               UPDATE accounts SET cash = cash - p_amount * p_price WHERE user_id = p_user_id;
+               INSERT INTO positions (user_id, stock_name, amount) VALUES (p_user_id, p_stock, p_amount)
+               ON CONFLICT (user_id, stock_name) DO UPDATE SET amount = positions.amount + EXCLUDED.amount;
+           ELSE
+               SELECT amount INTO v_held FROM positions WHERE user_id = p_user_id AND stock_name = p_stock;
+               IF COALESCE(v_held, 0) < p_amount THEN
+                   RETURN 'holdings';
+               END IF;
+               UPDATE positions SET amount = amount - p_amount WHERE user_id = p_user_id AND stock_name = p_stock;
+               UPDATE accounts SET cash = cash + p_amount * p_price WHERE user_id = p_user_id;
+           END IF;
+           INSERT INTO actions (action_key, user_id, period, action, stock_name, amount, price, experiment_id, start_time,
+                                traded_at)
+           VALUES (p_key, p_user_id, p_period, p_action, p_stock, p_amount, p_price, v_experiment, v_start,
+                   p_traded_at);
+           RETURN 'ok';
+       END;
+       $$ LANGUAGE plpgsql''',
+    '''CREATE OR REPLACE FUNCTION apply_trades(p_keys TEXT[], p_user_ids TEXT[], p_periods INTEGER[],
+                                            p_actions TEXT[], p_stocks TEXT[], p_amounts INTEGER[],
+                                            p_prices DOUBLE PRECISION[], p_traded_at TIMESTAMP[])
+       RETURNS TEXT[] AS $$
+       DECLARE
+           statuses TEXT[] := '{}';
+       BEGIN
+           FOR i IN 1 .. COALESCE(array_length(p_keys, 1), 0) LOOP
+               statuses := statuses || apply_trade(p_keys[i], p_user_ids[i], p_periods[i], p_actions[i],
+                                                   p_stocks[i], p_amounts[i], p_prices[i], p_traded_at[i]);
+           END LOOP;
+           RETURN statuses;
+       END;
+       $$ LANGUAGE plpgsql''',
+]
+
+# Partitionen eines Laufs fuer einen Monat anlegen (Postgres, Migrationen 10 und 14). Partitionsnamen
+# sind <tabelle>_<lauf>_<YYYYMM> und nur ohne '_' im Lauf eindeutig, daher die Pruefung der Kennung.
+_ENSURE_PARTITIONS = '''CREATE OR REPLACE FUNCTION ensure_partitions(p_experiment TEXT, p_month DATE)
+   RETURNS VOID AS $$
+   DECLARE
+       v_month DATE := date_trunc('month', p_month)::date;
+       v_table TEXT;
+       v_parent TEXT;
+       v_child TEXT;
+   BEGIN
+       IF p_experiment IS NULL OR p_experiment !~ '^[a-z0-9]{1,32}$' THEN
+           RAISE EXCEPTION 'invalid experiment id %', p_experiment;
+       END IF;
+       IF (SELECT COUNT(*) FROM partitions WHERE experiment_id = p_experiment AND month = v_month) = 3 THEN
+           RETURN;
+       END IF;
+       -- Parallele Prozesse legen dieselbe Partition nur einmal an
+       PERFORM pg_advisory_xact_lock(724310002);
+       FOREACH v_table IN ARRAY ARRAY['survey', 'actions', 'results'] LOOP
+           v_parent := v_table || '_' || p_experiment;
+           v_child := v_parent || '_' || to_char(v_month, 'YYYYMM');
+           EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES IN (%L) '
+                          'PARTITION BY RANGE (start_time)', v_parent, v_table, p_experiment);
+           EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                          v_child, v_parent, v_month, (v_month + INTERVAL '1 month')::date);
+           INSERT INTO partitions (partition_name, table_name, experiment_id, month)
+           VALUES (v_child, v_table, p_experiment, v_month)
+           ON CONFLICT (partition_name) DO NOTHING;
+       END LOOP;
+   END;
+   $$ LANGUAGE plpgsql'''
+
+# Jetzt als ISO-String wie datetime.now().isoformat() in der App (lokale Zeit, 'T' als Trenner);
+# CURRENT_TIMESTAMP waere UTC mit Leerzeichen und faellt aus Bereichsfiltern auf start_time heraus
+_SQLITE_NOW = "strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime')"
+
+
+# Backfill des Ledgers (Migration 9): Startkapital und Geschenke je Gruppe als Parameter aus
+# engine.GROUPS. Spieler ohne bekannte Gruppe starten wie "control".
+# Rueckgabe: (sql, params) fuer accounts und positions.
+def _ledger_backfill(backend):
+    if backend == "postgres":
+        insert, accounts_conflict, positions_conflict = (
+            "INSERT INTO", " ON CONFLICT (user_id) DO NOTHING", " ON CONFLICT (user_id, stock_name) DO NOTHING")
+    else:
+        insert, accounts_conflict, positions_conflict = "INSERT OR IGNORE INTO", "", ""
+    capitals = [(group, config["capital"]) for group, config in GROUPS.items()]
+    gifts = [(group, stock, amount) for group, config in GROUPS.items() for stock, amount in config["gifts"]]
+    gift_rows = (f"VALUES {', '.join(['(%s, %s, %s)'] * len(gifts))}" if gifts
+                 else "SELECT CAST(NULL AS TEXT), CAST(NULL AS TEXT), 0 WHERE 1 = 0")
+    ctes = f'''WITH capitals (user_group, capital) AS (VALUES {', '.join(['(%s, %s)'] * len(capitals))}),
+                 gifts (user_group, stock_name, amount) AS ({gift_rows}),
+                 players (user_id, user_group) AS (
+                     SELECT user_id, CASE WHEN user_group IN (SELECT user_group FROM capitals)
+                                          THEN user_group ELSE %s END
+                     FROM survey)'''
+    params = [*(value for row in capitals for value in row), *(value for row in gifts for value in row), "control"]
+    accounts = f'''{ctes}
+           {insert} accounts (user_id, cash)
+           SELECT p.user_id, c.capital
+                  - COALESCE(SUM(CASE WHEN a.action = 'Buy' THEN 1 ELSE -1 END
+                                 * a.amount * CAST(a.price AS DOUBLE PRECISION)), 0)
+           FROM players p JOIN capitals c ON c.user_group = p.user_group
+           LEFT JOIN actions a ON a.user_id = p.user_id AND a.action IN ('Buy', 'Sell')
+           GROUP BY p.user_id, c.capital{accounts_conflict}'''
+    positions = f'''{ctes}
+           {insert} positions (user_id, stock_name, amount)
+           SELECT user_id, stock_name, SUM(amount)
+           FROM (SELECT user_id, stock_name, CASE WHEN action = 'Buy' THEN amount ELSE -amount END AS amount
+                 FROM actions WHERE action IN ('Buy', 'Sell')
+                 UNION ALL
+                 SELECT p.user_id, g.stock_name, g.amount
+                 FROM players p JOIN gifts g ON g.user_group = p.user_group) AS t
+           GROUP BY user_id, stock_name
+           HAVING SUM(amount) > 0{positions_conflict}'''
+    return [(accounts, params), (positions, params)]
+
+# Versionierte Schema-Migrationen. Neue Schritte nur anhaengen, nie bestehende aendern.
+# Statements sind entweder eine Liste (alle Backends) oder ein dict je Backend-Name;
+# ein Statement ist SQL oder (SQL, Parameter).
+MIGRATIONS = [
+    (1, "baseline schema", {
+        "postgres": [
+            '''CREATE TABLE IF NOT EXISTS survey (
+                   user_id TEXT PRIMARY KEY,
+                   age INTEGER,
+                   experience INTEGER,
+                   study TEXT,
+                   gender TEXT,
+                   mail TEXT,
+                   ip_address TEXT,
+                   user_group TEXT,
+                   start_time TIMESTAMP)''',
+            # Bestehende Datenbanken wurden mit dem alten init_db()-Schema angelegt
+            "ALTER TABLE survey ADD COLUMN IF NOT EXISTS mail TEXT",
+            "ALTER TABLE survey ADD COLUMN IF NOT EXISTS start_time TIMESTAMP",
+            '''CREATE TABLE IF NOT EXISTS actions (
+                   id SERIAL PRIMARY KEY,
+                   user_id TEXT,
+                   period INTEGER,
+                   action TEXT,
+                   stock_name TEXT,
+                   amount INTEGER,
+                   price REAL)''',
+            '''CREATE TABLE IF NOT EXISTS results (
+                   user_id TEXT PRIMARY KEY,
+                   total_value REAL)''',
+            '''CREATE TABLE IF NOT EXISTS user_input (
+                   user_id TEXT,
+                   input_text TEXT,
+                   timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+            '''CREATE TABLE IF NOT EXISTS stock_prices (
+                   stock_name TEXT,
+                   period INTEGER,
+                   price REAL)''',
+        ],
+        "sqlite": [
+            '''CREATE TABLE IF NOT EXISTS survey (
+                   user_id TEXT PRIMARY KEY,
+                   age INTEGER,
+                   experience INTEGER,
+                   study TEXT,
+                   gender TEXT,
+                   mail TEXT,
+                   ip_address TEXT,
+                   user_group TEXT,
+                   start_time TIMESTAMP)''',
+            '''CREATE TABLE IF NOT EXISTS actions (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   user_id TEXT,
+                   period INTEGER,
+                   action TEXT,
+                   stock_name TEXT,
+                   amount INTEGER,
+                   price REAL)''',
+            '''CREATE TABLE IF NOT EXISTS results (
+                   user_id TEXT PRIMARY KEY,
+                   total_value REAL)''',
+            '''CREATE TABLE IF NOT EXISTS user_input (
+                   user_id TEXT,
+                   input_text TEXT,
+                   timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+            '''CREATE TABLE IF NOT EXISTS stock_prices (
+                   stock_name TEXT,
+                   period INTEGER,
+                   price REAL)''',
+        ],
+    }),
+    (2, "indexes for hot queries", [
+        "CREATE INDEX IF NOT EXISTS idx_actions_user_period ON actions (user_id, period)",
+        "CREATE INDEX IF NOT EXISTS idx_stock_prices_name_period ON stock_prices (stock_name, period)",
+        "CREATE INDEX IF NOT EXISTS idx_user_input_user ON user_input (user_id)",
+    ]),
+    (3, "sequence for group assignment", {
+        "postgres": [
+            "CREATE SEQUENCE IF NOT EXISTS assignment_seq",
+            # Fortsetzen, wo die bisherige Zaehlung ueber COUNT(*) stand
+            "SELECT setval('assignment_seq', GREATEST((SELECT COUNT(*) FROM survey), 1), (SELECT COUNT(*) FROM survey) > 0)",
+        ],
+        "sqlite": [
+            '''CREATE TABLE IF NOT EXISTS assignment_counter (
+                   id INTEGER PRIMARY KEY CHECK (id = 1),
+                   value INTEGER NOT NULL)''',
+            "INSERT OR IGNORE INTO assignment_counter (id, value) VALUES (1, (SELECT COUNT(*) FROM survey))",
+        ],
+    }),
+    (4, "indexes for admin filters", [
+        "CREATE INDEX IF NOT EXISTS idx_survey_group_start ON survey (user_group, start_time)",
+        "CREATE INDEX IF NOT EXISTS idx_survey_start ON survey (start_time)",
+        "CREATE INDEX IF NOT EXISTS idx_actions_period ON actions (period)",
+    ]),
+    (5, "idempotency key for spooled actions", {
+        "postgres": [
+            "ALTER TABLE actions ADD COLUMN IF NOT EXISTS action_key TEXT",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_actions_action_key ON actions (action_key)",
+        ],
+        "sqlite": [
+            "ALTER TABLE actions ADD COLUMN action_key TEXT",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_actions_action_key ON actions (action_key)",
+        ],
+    }),
+    (6, "game snapshots for session resume", {
+        "postgres": [
+            '''CREATE TABLE IF NOT EXISTS game_snapshots (
+                   user_id TEXT PRIMARY KEY,
+                   period INTEGER,
+                   data BYTEA,
+                   updated_at TIMESTAMP)''',
+        ],
+        "sqlite": [
+            '''CREATE TABLE IF NOT EXISTS game_snapshots (
+                   user_id TEXT PRIMARY KEY,
+                   period INTEGER,
+                   data BLOB,
+                   updated_at TIMESTAMP)''',
+        ],
+    }),
+    # Szenario 0 sind die bisher von Hand eingetragenen Kurse
+    (7, "price scenarios", {
+        "postgres": [
+            "ALTER TABLE stock_prices ADD COLUMN IF NOT EXISTS scenario_id INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE survey ADD COLUMN IF NOT EXISTS scenario_id INTEGER",
+            '''CREATE TABLE IF NOT EXISTS price_scenarios (
+                   scenario_id INTEGER PRIMARY KEY,
+                   seed BIGINT,
+                   probabilities TEXT,
+                   created_at TIMESTAMP)''',
+            "CREATE INDEX IF NOT EXISTS idx_stock_prices_scenario ON stock_prices (scenario_id, stock_name, period)",
+        ],
+        "sqlite": [
+            "ALTER TABLE stock_prices ADD COLUMN scenario_id INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE survey ADD COLUMN scenario_id INTEGER",
+            '''CREATE TABLE IF NOT EXISTS price_scenarios (
+                   scenario_id INTEGER PRIMARY KEY,
+                   seed INTEGER,
+                   probabilities TEXT,
+                   created_at TIMESTAMP)''',
+            "CREATE INDEX IF NOT EXISTS idx_stock_prices_scenario ON stock_prices (scenario_id, stock_name, period)",
+        ],
+    }),
+    # Laufende Summen je Gruppe und Anzahl Spieler je 1€-Bucket, nachgefuehrt von save_results_bulk
+    (8, "leaderboard aggregates", {
+        "postgres": [
+            '''CREATE TABLE IF NOT EXISTS result_stats (
+                   user_group TEXT PRIMARY KEY,
+                   players INTEGER NOT NULL,
+                   total DOUBLE PRECISION NOT NULL,
+                   total_sq DOUBLE PRECISION NOT NULL)''',
+            '''CREATE TABLE IF NOT EXISTS result_buckets (
+                   user_group TEXT,
+                   bucket INTEGER,
+                   players INTEGER NOT NULL,
+                   PRIMARY KEY (user_group, bucket))''',
+            "CREATE INDEX IF NOT EXISTS idx_results_total_value ON results (total_value)",
+            '''INSERT INTO result_stats (user_group, players, total, total_sq)
+               SELECT COALESCE(s.user_group, ''), COUNT(*),
+                      SUM(CAST(r.total_value AS DOUBLE PRECISION)),
+                      SUM(CAST(r.total_value AS DOUBLE PRECISION) * CAST(r.total_value AS DOUBLE PRECISION))
+               FROM results r LEFT JOIN survey s ON s.user_id = r.user_id
+               GROUP BY COALESCE(s.user_group, '')
+               ON CONFLICT (user_group) DO NOTHING''',
+            '''INSERT INTO result_buckets (user_group, bucket, players)
+               SELECT COALESCE(s.user_group, ''), CAST(FLOOR(r.total_value) AS INTEGER), COUNT(*)
+               FROM results r LEFT JOIN survey s ON s.user_id = r.user_id
+               GROUP BY COALESCE(s.user_group, ''), CAST(FLOOR(r.total_value) AS INTEGER)
+               ON CONFLICT (user_group, bucket) DO NOTHING''',
+        ],
+        "sqlite": [
+            '''CREATE TABLE IF NOT EXISTS result_stats (
+                   user_group TEXT PRIMARY KEY,
+                   players INTEGER NOT NULL,
+                   total REAL NOT NULL,
+                   total_sq REAL NOT NULL)''',
+            '''CREATE TABLE IF NOT EXISTS result_buckets (
+                   user_group TEXT,
+                   bucket INTEGER,
+                   players INTEGER NOT NULL,
+                   PRIMARY KEY (user_group, bucket))''',
+            "CREATE INDEX IF NOT EXISTS idx_results_total_value ON results (total_value)",
+            # Werte sind nie negativ: CAST schneidet ab wie floor()
+            '''INSERT OR IGNORE INTO result_stats (user_group, players, total, total_sq)
+               SELECT COALESCE(s.user_group, ''), COUNT(*), SUM(r.total_value), SUM(r.total_value * r.total_value)
+               FROM results r LEFT JOIN survey s ON s.user_id = r.user_id
+               GROUP BY COALESCE(s.user_group, '')''',
+            '''INSERT OR IGNORE INTO result_buckets (user_group, bucket, players)
+               SELECT COALESCE(s.user_group, ''), CAST(r.total_value AS INTEGER), COUNT(*)
+               FROM results r LEFT JOIN survey s ON s.user_id = r.user_id
+               GROUP BY COALESCE(s.user_group, ''), CAST(r.total_value AS INTEGER)''',
+        ],
+    }),
+    # Kontostand und Bestaende je Spieler fuer die Pruefung von Trades in der Datenbank
+    # (die Funktionen apply_trade/apply_trades legt Migration 12 an).
+    # Bestehende Spieler: Startkapital und Geschenke der Gruppe (Stand engine.GROUPS) plus ihre Trades.
+    (9, "trade ledger", {
+        "postgres": [
+            '''CREATE TABLE IF NOT EXISTS accounts (
+                   user_id TEXT PRIMARY KEY,
+                   cash DOUBLE PRECISION NOT NULL)''',
+            '''CREATE TABLE IF NOT EXISTS positions (
+                   user_id TEXT,
+                   stock_name TEXT,
+                   amount INTEGER NOT NULL CHECK (amount >= 0),
+                   PRIMARY KEY (user_id, stock_name))''',
+            *_ledger_backfill("postgres"),
+        ],
+        "sqlite": [
+            '''CREATE TABLE IF NOT EXISTS accounts (
+                   user_id TEXT PRIMARY KEY,
+                   cash REAL NOT NULL)''',
+            '''CREATE TABLE IF NOT EXISTS positions (
+                   user_id TEXT,
+                   stock_name TEXT,
+                   amount INTEGER NOT NULL CHECK (amount >= 0),
+                   PRIMARY KEY (user_id, stock_name))''',
+            *_ledger_backfill("sqlite"),
+        ],
+    }),
+    # Studien-Laeufe (experiment_id) als eigene Partitionen. Postgres: survey, actions und results
+    # nach experiment_id (LIST) und darunter nach Monat des Spielstarts (RANGE auf start_time), damit
+    # alle Zeilen einer Session in derselben Partition liegen und Aufbewahrung per DROP TABLE geht.
+    # Bisherige Daten gehoeren zum Lauf 'default'. SQLite bekommt nur die Spalten und Indizes.
+    (10, "experiments and partitions", {
+        "postgres": [
+            '''CREATE TABLE IF NOT EXISTS experiments (
+                   experiment_id TEXT PRIMARY KEY,
+                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+            "INSERT INTO experiments (experiment_id) VALUES ('default') ON CONFLICT (experiment_id) DO NOTHING",
+            # Verzeichnis der Monats-Partitionen, gelesen von der Aufbewahrung
+            '''CREATE TABLE IF NOT EXISTS partitions (
+                   partition_name TEXT PRIMARY KEY,
+                   table_name TEXT NOT NULL,
+                   experiment_id TEXT NOT NULL,
+                   month DATE NOT NULL)''',
+            "CREATE INDEX IF NOT EXISTS idx_partitions_month ON partitions (month, experiment_id)",
+            _ENSURE_PARTITIONS,
+            "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS experiment_id TEXT NOT NULL DEFAULT 'default'",
+            "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS start_time TIMESTAMP",
+            '''UPDATE accounts a SET start_time = COALESCE((SELECT s.start_time FROM survey s WHERE s.user_id = a.user_id),
+                                                       LOCALTIMESTAMP(0))''',
+            "UPDATE survey SET start_time = LOCALTIMESTAMP(0) WHERE start_time IS NULL",
+
+            "ALTER TABLE survey RENAME TO survey_unpartitioned",
+            "ALTER TABLE actions RENAME TO actions_unpartitioned",
+            "ALTER TABLE results RENAME TO results_unpartitioned",
+            # Die alten Tabellen bleiben bis Migration 15 als Sicherung stehen; ihre Indizes weg, damit
+            # die gleichnamigen Indizes unten auf den neuen Tabellen angelegt werden
+            '''DROP INDEX IF EXISTS idx_survey_group_start, idx_survey_start, idx_actions_user_period, idx_actions_period,
+                                   idx_actions_action_key, idx_results_total_value''',
+            '''CREATE TABLE survey (
+                   user_id TEXT NOT NULL,
+                   age INTEGER,
+                   experience INTEGER,
+                   study TEXT,
+                   gender TEXT,
+                   mail TEXT,
+                   ip_address TEXT,
+                   user_group TEXT,
+                   start_time TIMESTAMP NOT NULL,
+                   scenario_id INTEGER,
+                   experiment_id TEXT NOT NULL DEFAULT 'default',
+                   CONSTRAINT survey_experiment_pkey PRIMARY KEY (experiment_id, start_time, user_id))
+               PARTITION BY LIST (experiment_id)''',
+            '''CREATE TABLE actions (
+                   id BIGSERIAL,
+                   user_id TEXT,
+                   period INTEGER,
+                   action TEXT,
+                   stock_name TEXT,
+                   amount INTEGER,
+                   price REAL,
+                   action_key TEXT,
+                   experiment_id TEXT NOT NULL DEFAULT 'default',
+                   start_time TIMESTAMP NOT NULL,
+                   CONSTRAINT actions_experiment_key UNIQUE (experiment_id, start_time, action_key))
+               PARTITION BY LIST (experiment_id)''',
+            '''CREATE TABLE results (
+                   user_id TEXT NOT NULL,
+                   total_value REAL,
+                   experiment_id TEXT NOT NULL DEFAULT 'default',
+                   start_time TIMESTAMP NOT NULL,
+                   CONSTRAINT results_experiment_pkey PRIMARY KEY (experiment_id, start_time, user_id))
+               PARTITION BY LIST (experiment_id)''',
+            '''SELECT ensure_partitions('default', month)
+               FROM (SELECT DISTINCT date_trunc('month', start_time)::date AS month FROM survey_unpartitioned
+                     UNION
+                     SELECT date_trunc('month', LOCALTIMESTAMP)::date) AS months''',
+            '''INSERT INTO survey (user_id, age, experience, study, gender, mail, ip_address, user_group, start_time,
+                                 scenario_id, experiment_id)
+               SELECT user_id, age, experience, study, gender, mail, ip_address, user_group, start_time, scenario_id, 'default'
+               FROM survey_unpartitioned''',
+            # Aktionen und Ergebnisse ohne Umfrage: Zeitpunkt der Migration
+            '''INSERT INTO actions (id, user_id, period, action, stock_name, amount, price, action_key, experiment_id, start_time)
+               SELECT a.id, a.user_id, a.period, a.action, a.stock_name, a.amount, a.price, a.action_key, 'default',
+                      COALESCE(s.start_time, LOCALTIMESTAMP(0))
+               FROM actions_unpartitioned a LEFT JOIN survey_unpartitioned s ON s.user_id = a.user_id''',
+            "SELECT setval(pg_get_serial_sequence('actions', 'id'), COALESCE((SELECT MAX(id) FROM actions), 0) + 1, false)",
+            '''INSERT INTO results (user_id, total_value, experiment_id, start_time)
+               SELECT r.user_id, r.total_value, 'default', COALESCE(s.start_time, LOCALTIMESTAMP(0))
+               FROM results_unpartitioned r LEFT JOIN survey_unpartitioned s ON s.user_id = r.user_id''',
+            # Indizes auf der Elterntabelle gelten fuer alle (auch kuenftige) Partitionen
+            "CREATE INDEX IF NOT EXISTS idx_survey_user ON survey (user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_survey_group_start ON survey (user_group, start_time)",
+            "CREATE INDEX IF NOT EXISTS idx_actions_user_period ON actions (user_id, period)",
+            "CREATE INDEX IF NOT EXISTS idx_actions_period ON actions (period)",
+            "CREATE INDEX IF NOT EXISTS idx_results_user ON results (user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_results_total_value ON results (experiment_id, total_value)",
+
+            # Ranglisten je Lauf
+            "DROP TABLE result_stats, result_buckets",
+            '''CREATE TABLE result_stats (
+                   experiment_id TEXT,
+                   user_group TEXT,
+                   players INTEGER NOT NULL,
+                   total DOUBLE PRECISION NOT NULL,
+                   total_sq DOUBLE PRECISION NOT NULL,
+                   PRIMARY KEY (experiment_id, user_group))''',
+            '''CREATE TABLE result_buckets (
+                   experiment_id TEXT,
+                   user_group TEXT,
+                   bucket INTEGER,
+                   players INTEGER NOT NULL,
+                   PRIMARY KEY (experiment_id, user_group, bucket))''',
+            '''INSERT INTO result_stats (experiment_id, user_group, players, total, total_sq)
+               SELECT r.experiment_id, COALESCE(s.user_group, ''), COUNT(*),
+                      SUM(CAST(r.total_value AS DOUBLE PRECISION)),
+                      SUM(CAST(r.total_value AS DOUBLE PRECISION) * CAST(r.total_value AS DOUBLE PRECISION))
+               FROM results r LEFT JOIN survey s ON s.user_id = r.user_id AND s.experiment_id = r.experiment_id
+               GROUP BY r.experiment_id, COALESCE(s.user_group, '')''',
+            '''INSERT INTO result_buckets (experiment_id, user_group, bucket, players)
+               SELECT r.experiment_id, COALESCE(s.user_group, ''), CAST(FLOOR(r.total_value) AS INTEGER), COUNT(*)
+               FROM results r LEFT JOIN survey s ON s.user_id = r.user_id AND s.experiment_id = r.experiment_id
+               GROUP BY r.experiment_id, COALESCE(s.user_group, ''), CAST(FLOOR(r.total_value) AS INTEGER)''',
+        ],
+        "sqlite": [
+            '''CREATE TABLE IF NOT EXISTS experiments (
+                   experiment_id TEXT PRIMARY KEY,
+                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+            "INSERT OR IGNORE INTO experiments (experiment_id) VALUES ('default')",
+            f"UPDATE survey SET start_time = {_SQLITE_NOW} WHERE start_time IS NULL",
+            "ALTER TABLE survey ADD COLUMN experiment_id TEXT NOT NULL DEFAULT 'default'",
+            "ALTER TABLE actions ADD COLUMN experiment_id TEXT NOT NULL DEFAULT 'default'",
+            "ALTER TABLE actions ADD COLUMN start_time TIMESTAMP",
+            "ALTER TABLE results ADD COLUMN experiment_id TEXT NOT NULL DEFAULT 'default'",
+            "ALTER TABLE results ADD COLUMN start_time TIMESTAMP",
+            "ALTER TABLE accounts ADD COLUMN experiment_id TEXT NOT NULL DEFAULT 'default'",
+            "ALTER TABLE accounts ADD COLUMN start_time TIMESTAMP",
+            f'''UPDATE actions SET start_time = COALESCE((SELECT s.start_time FROM survey s WHERE s.user_id = actions.user_id),
+                                                      {_SQLITE_NOW})''',
+            f'''UPDATE results SET start_time = COALESCE((SELECT s.start_time FROM survey s WHERE s.user_id = results.user_id),
+                                                      {_SQLITE_NOW})''',
+            f'''UPDATE accounts SET start_time = COALESCE((SELECT s.start_time FROM survey s WHERE s.user_id = accounts.user_id),
+                                                       {_SQLITE_NOW})''',
+            # Gleiche Konfliktziele wie die Primaerschluessel der Partitionen in Postgres
+            "DROP INDEX IF EXISTS idx_actions_action_key",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_actions_experiment_key ON actions (experiment_id, start_time, action_key)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_survey_experiment_key ON survey (experiment_id, start_time, user_id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_results_experiment_key ON results (experiment_id, start_time, user_id)",
+            "DROP INDEX IF EXISTS idx_results_total_value",
+            "CREATE INDEX IF NOT EXISTS idx_results_total_value ON results (experiment_id, total_value)",
+
+            "DROP TABLE result_stats",
+            "DROP TABLE result_buckets",
+            '''CREATE TABLE result_stats (
+                   experiment_id TEXT,
+                   user_group TEXT,
+                   players INTEGER NOT NULL,
+                   total REAL NOT NULL,
+                   total_sq REAL NOT NULL,
+                   PRIMARY KEY (experiment_id, user_group))''',
+            '''CREATE TABLE result_buckets (
+                   experiment_id TEXT,
+                   user_group TEXT,
+                   bucket INTEGER,
+                   players INTEGER NOT NULL,
+                   PRIMARY KEY (experiment_id, user_group, bucket))''',
+            '''INSERT INTO result_stats (experiment_id, user_group, players, total, total_sq)
+               SELECT r.experiment_id, COALESCE(s.user_group, ''), COUNT(*), SUM(r.total_value), SUM(r.total_value * r.total_value)
+               FROM results r LEFT JOIN survey s ON s.user_id = r.user_id AND s.experiment_id = r.experiment_id
+               GROUP BY r.experiment_id, COALESCE(s.user_group, '')''',
+            '''INSERT INTO result_buckets (experiment_id, user_group, bucket, players)
+               SELECT r.experiment_id, COALESCE(s.user_group, ''), CAST(r.total_value AS INTEGER), COUNT(*)
+               FROM results r LEFT JOIN survey s ON s.user_id = r.user_id AND s.experiment_id = r.experiment_id
+               GROUP BY r.experiment_id, COALESCE(s.user_group, ''), CAST(r.total_value AS INTEGER)''',
+        ],
+    }),
+    # Wasserzeichen fuer inkrementelle Exporte der Umfrage: start_time kommt vom Client und Zeilen
+    # koennen spaet aus dem Journal eintreffen, die id vergibt die Datenbank beim Einfuegen.
+    # Bestehende Zeilen werden nach start_time nummeriert.
+    (11, "survey export watermark", {
+        "postgres": [
+            "CREATE SEQUENCE IF NOT EXISTS survey_id_seq",
+            "ALTER TABLE survey ADD COLUMN IF NOT EXISTS id BIGINT",
+            '''UPDATE survey s SET id = n.id
+               FROM (SELECT experiment_id, start_time, user_id,
+                            ROW_NUMBER() OVER (ORDER BY start_time, user_id) AS id
+                     FROM survey) AS n
+               WHERE s.experiment_id = n.experiment_id AND s.start_time = n.start_time AND s.user_id = n.user_id''',
+            "SELECT setval('survey_id_seq', COALESCE((SELECT MAX(id) FROM survey), 0) + 1, false)",
+            "ALTER TABLE survey ALTER COLUMN id SET DEFAULT nextval('survey_id_seq')",
+            "ALTER SEQUENCE survey_id_seq OWNED BY survey.id",
+            "CREATE INDEX IF NOT EXISTS idx_survey_id ON survey (id)",
+        ],
+        "sqlite": [
+            "ALTER TABLE survey ADD COLUMN id INTEGER",
+            '''UPDATE survey SET id = (SELECT COUNT(*) FROM survey s
+                                       WHERE s.start_time < survey.start_time
+                                          OR (s.start_time = survey.start_time AND s.user_id <= survey.user_id))''',
+            # Zaehler wie assignment_counter: bleibt monoton, auch wenn die Aufbewahrung Zeilen loescht
+            '''CREATE TABLE IF NOT EXISTS survey_id_counter (
+                   id INTEGER PRIMARY KEY CHECK (id = 1),
+                   value INTEGER NOT NULL)''',
+            "INSERT OR IGNORE INTO survey_id_counter (id, value) VALUES (1, (SELECT COALESCE(MAX(id), 0) FROM survey))",
+            '''CREATE TRIGGER IF NOT EXISTS survey_assign_id AFTER INSERT ON survey
+               BEGIN
+                   UPDATE survey_id_counter SET value = value + 1 WHERE id = 1;
+                   UPDATE survey SET id = (SELECT value FROM survey_id_counter WHERE id = 1) WHERE rowid = NEW.rowid;
+               END''',
+            "CREATE INDEX IF NOT EXISTS idx_survey_id ON survey (id)",
+        ],
+    }),
+    # Zeitpunkt des Trades vom Client: Reihenfolge innerhalb einer Periode fuer replay.py, auch wenn
+    # Trades spaeter aus dem Journal nachgeholt werden (dann ist die id juenger als der Trade)
+    # Ledger-Funktionen mit traded_at, siehe _TRADE_FUNCTIONS
+    (12, "trade timestamps", {
+        "postgres": [
+            "ALTER TABLE actions ADD COLUMN IF NOT EXISTS traded_at TIMESTAMP",
+            *_TRADE_FUNCTIONS,
+        ],
+        "sqlite": [
+            "ALTER TABLE actions ADD COLUMN traded_at TIMESTAMP",
+        ],
+    }),
+    # Fortsetzen nur mit zufaelligem Token aus der URL; alte Snapshots ohne Token sind nicht fortsetzbar
+    (13, "resume tokens", {
+        "postgres": [
+            "ALTER TABLE game_snapshots ADD COLUMN IF NOT EXISTS resume_token TEXT",
+        ],
+        "sqlite": [
+            "ALTER TABLE game_snapshots ADD COLUMN resume_token TEXT",
+        ],
+    }),
+    # Postgres: Partitionsnamen sind nur ohne '_' im Lauf eindeutig, ensure_partitions prueft das selbst.
+    # SQLite: survey und results bekommen den Schluessel aus Postgres (experiment_id, start_time, user_id)
+    # statt user_id; Tabellen neu aufbauen, Indizes und der id-Trigger aus Migration 11 neu anlegen.
+    (14, "experiment keys", {
+        "postgres": [
+            _ENSURE_PARTITIONS,
+        ],
+        "sqlite": [
+            '''CREATE TABLE survey_rebuilt (
+                   user_id TEXT NOT NULL,
+                   age INTEGER,
+                   experience INTEGER,
+                   study TEXT,
+                   gender TEXT,
+                   mail TEXT,
+                   ip_address TEXT,
+                   user_group TEXT,
+                   start_time TIMESTAMP,
+                   scenario_id INTEGER,
+                   experiment_id TEXT NOT NULL DEFAULT 'default',
+                   id INTEGER,
+                   PRIMARY KEY (experiment_id, start_time, user_id))''',
+            '''INSERT INTO survey_rebuilt (user_id, age, experience, study, gender, mail, ip_address, user_group, start_time,
+                                         scenario_id, experiment_id, id)
+               SELECT user_id, age, experience, study, gender, mail, ip_address, user_group, start_time,
+                      scenario_id, experiment_id, id
+               FROM survey''',
+            "DROP TABLE survey",
+            "ALTER TABLE survey_rebuilt RENAME TO survey",
+            "CREATE INDEX IF NOT EXISTS idx_survey_user ON survey (user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_survey_group_start ON survey (user_group, start_time)",
+            "CREATE INDEX IF NOT EXISTS idx_survey_start ON survey (start_time)",
+            "CREATE INDEX IF NOT EXISTS idx_survey_id ON survey (id)",
+            '''CREATE TRIGGER IF NOT EXISTS survey_assign_id AFTER INSERT ON survey
+               BEGIN
+                   UPDATE survey_id_counter SET value = value + 1 WHERE id = 1;
+                   UPDATE survey SET id = (SELECT value FROM survey_id_counter WHERE id = 1) WHERE rowid = NEW.rowid;
+               END''',
+            '''CREATE TABLE results_rebuilt (
+                   user_id TEXT NOT NULL,
+                   total_value REAL,
+                   experiment_id TEXT NOT NULL DEFAULT 'default',
+                   start_time TIMESTAMP,
+                   PRIMARY KEY (experiment_id, start_time, user_id))''',
+            '''INSERT INTO results_rebuilt (user_id, total_value, experiment_id, start_time)
+               SELECT user_id, total_value, experiment_id, start_time FROM results''',
+            "DROP TABLE results",
+            "ALTER TABLE results_rebuilt RENAME TO results",
+            "CREATE INDEX IF NOT EXISTS idx_results_user ON results (user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_results_total_value ON results (experiment_id, total_value)",
+        ],
+    }),
+    # Postgres: Sicherung aus Migration 10 erst entfernen, wenn jede alte Zeile in den partitionierten
+    # Tabellen steht; sonst bricht die Migration ab und alles bleibt beim alten Stand.
+    # SQLite: von Migration 10 mit Leerzeichen geschriebene start_time auf ISO mit 'T' bringen.
+    (15, "drop unpartitioned tables", {
+        "postgres": [
+            '''DO $$
+               BEGIN
+                   IF to_regclass('survey_unpartitioned') IS NULL THEN
+                       RETURN;
+                   END IF;
+                   IF EXISTS (SELECT 1 FROM survey_unpartitioned o
+                              WHERE NOT EXISTS (SELECT 1 FROM survey s WHERE s.user_id = o.user_id))
+                      OR EXISTS (SELECT 1 FROM actions_unpartitioned o
+                                 WHERE NOT EXISTS (SELECT 1 FROM actions a WHERE a.id = o.id))
+                      OR EXISTS (SELECT 1 FROM results_unpartitioned o
+                                 WHERE NOT EXISTS (SELECT 1 FROM results r WHERE r.user_id = o.user_id)) THEN
+                       RAISE EXCEPTION 'partitioned tables are missing rows of *_unpartitioned, keeping them';
+                   END IF;
+                   DROP TABLE survey_unpartitioned, actions_unpartitioned, results_unpartitioned;
+               END;
+               $$''',
+        ],
+        "sqlite": [
+            f"UPDATE {table} SET start_time = replace(start_time, ' ', 'T') WHERE start_time LIKE '____-__-__ %'"
+            for table in ("survey", "actions", "results", "accounts")
+        ],
+    }),
+]
+
+# Backend, fuer das die Migrationen in diesem Prozess schon gelaufen sind
+_applied_for = None
+_lock = threading.Lock()
+
+
+def statements_for(statements, backend):
+    return statements[backend] if isinstance(statements, dict) else statements
+
+
+def current_version(cursor):
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return cursor.fetchone()[0]
+
+
+def migrate():
+    global _applied_for
+    storage = get_storage()
+    if _applied_for is storage:
+        return
+    with _lock:
+        if _applied_for is storage:
+            return
+        # Exklusiv ueber alle Prozesse (Postgres: Advisory Lock, SQLite: BEGIN IMMEDIATE)
+        with storage.migration_connection() as conn, conn.cursor() as cursor:
+            cursor.execute('''CREATE TABLE IF NOT EXISTS schema_migrations (
+                                  version INTEGER PRIMARY KEY,
+                                  name TEXT,
+                                  applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+            version = current_version(cursor)
+            for number, name, statements in MIGRATIONS:
+                if number <= version:
+                    continue
+                for statement in statements_for(statements, storage.name):
+                    if isinstance(statement, tuple):
+                        cursor.execute(*statement)
+                    else:
+                        cursor.execute(statement)
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (number, name))
+        _applied_for = storage
+
+
+if __name__ == "__main__":
+    migrate()
+    print(f"Schema is at version {MIGRATIONS[-1][0]}")
@@ -0,0 +1,143 @@
+import argparse
+import json
+
+import numpy as np
+
+from engine import END_PERIOD, GROUPS
+
+# Kursverlaeufe nach den Regeln der Landing Page, viele Szenarien auf einmal:
+# jede Aktie bekommt eine der Steigwahrscheinlichkeiten (je Szenario zufaellig verteilt),
+# pro Periode steigt sie um 1-3€ oder faellt um 1-2€ (gleich wahrscheinlich), nie unveraendert.
+
+UP_PROBABILITIES = (0.40, 0.45, 0.50, 0.55, 0.60)
+UP_STEPS = (1, 2, 3)
+DOWN_STEPS = (1, 2)
+START_PRICE = 50
+
+DEFAULT_STOCK_NAMES = ("Lunaris Ventures", "Aurora Tech", "Borealis Energy", "Cobalt Health", "Driftwood Retail")
+
+# Statistische Pruefung erst ab so vielen Ziehungen je Wahrscheinlichkeit, Toleranz in Standardabweichungen
+MIN_DRAWS_FOR_STATS = 1_000
+MAX_SIGMA = 5.0
+
+
+class PricePaths:
+    __slots__ = ("names", "probabilities", "prices", "seed")
+
+    def __init__(self, names, probabilities, prices, seed=None):
+        self.names = tuple(names)
+        self.probabilities = probabilities  # (Szenarien, Aktien)
+        self.prices = prices                # (Szenarien, Aktien, Perioden)
+        self.seed = seed
+
+    def __len__(self):
+        return self.prices.shape[0]
+
+
+def _gifted(names):
+    return {name for conditions in GROUPS.values() for name, _ in conditions["gifts"] if name in names}
+
+
+def generate(n_scenarios, names=DEFAULT_STOCK_NAMES, periods=END_PERIOD, seed=None, start_spread=0):
+    names = tuple(names)
+    if len(names) != len(UP_PROBABILITIES):
+        raise ValueError(f"expected {len(UP_PROBABILITIES)} stocks, got {len(names)}")
+    rng = np.random.default_rng(seed)
+    shape = (n_scenarios, len(names), periods - 1)
+
+    probabilities = rng.permuted(np.tile(UP_PROBABILITIES, (n_scenarios, 1)), axis=1)
+    up = rng.random(shape) < probabilities[..., None]
+    steps = np.where(up, rng.choice(UP_STEPS, size=shape), -rng.choice(DOWN_STEPS, size=shape))
+
+    start = np.full((n_scenarios, len(names)), START_PRICE, dtype=np.int64)
+    if start_spread:
+        start += rng.integers(-start_spread, start_spread + 1, size=start.shape)
+        # Geschenkte Aktien behalten den Startkurs, sonst stimmt der Gesamtwert der Gruppen nicht
+        gifted = _gifted(names)
+        for i, name in enumerate(names):
+            if name in gifted:
+                start[:, i] = START_PRICE
+
+    prices = np.concatenate([start[..., None], start[..., None] + np.cumsum(steps, axis=2)], axis=2)
+    return PricePaths(names, probabilities, prices.astype(np.float64), seed)
+
+
+def validate(paths):
+    problems = []
+    prices = paths.prices
+    n_scenarios, n_stocks, periods = prices.shape
+
+    if periods < END_PERIOD:
+        problems.append(f"{periods} periods, the game needs {END_PERIOD}")
+    if not np.all(prices > 0):
+        problems.append("non-positive prices")
+
+    steps = np.diff(prices, axis=2)
+    allowed = np.array(UP_STEPS + tuple(-d for d in DOWN_STEPS), dtype=np.float64)
+    if not np.all(np.isin(steps, allowed)):
+        bad = np.unique(steps[~np.isin(steps, allowed)])
+        problems.append(f"price changes outside the rules: {bad[:10].tolist()}")
+
+    if not np.array_equal(np.sort(paths.probabilities, axis=1), np.tile(sorted(UP_PROBABILITIES), (n_scenarios, 1))):
+        problems.append("up-probabilities are not a permutation of the stated values per scenario")
+
+    # Gesamtwert am Start wie auf der Landing Page (Cash + Geschenke = Startkapital der Kontrollgruppe)
+    index = {name: i for i, name in enumerate(paths.names)}
+    for group, conditions in GROUPS.items():
+        for name, amount in conditions["gifts"]:
+            if name not in index:
+                problems.append(f"gifted stock {name!r} missing")
+                continue
+            totals = conditions["capital"] + amount * prices[:, index[name], 0]
+            if not np.allclose(totals, GROUPS["control"]["capital"]):
+                problems.append(f"{group} start value differs from {GROUPS['control']['capital']}€")
+
+    # Haeufigkeiten gegen die erwarteten Wahrscheinlichkeiten (nur bei genug Ziehungen)
+    up = steps > 0
+    for p in UP_PROBABILITIES:
+        draws = up[paths.probabilities == p]
+        if draws.size >= MIN_DRAWS_FOR_STATS:
+            sigma = np.sqrt(p * (1 - p) / draws.size)
+            if abs(draws.mean() - p) > MAX_SIGMA * sigma:
+                problems.append(f"up frequency {draws.mean():.4f} for p={p}")
+    for values, sizes in ((steps[steps > 0], UP_STEPS), (-steps[steps < 0], DOWN_STEPS)):
+        if values.size >= MIN_DRAWS_FOR_STATS:
+            expected = 1 / len(sizes)
+            sigma = np.sqrt(expected * (1 - expected) / values.size)
+            for size in sizes:
+                share = np.mean(values == size)
+                if abs(share - expected) > MAX_SIGMA * sigma:
+                    problems.append(f"step {size}€ occurs with share {share:.4f}, expected {expected:.4f}")
+
+    if problems:
+        raise ValueError("price paths violate the game rules: " + "; ".join(problems))
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate seeded price scenarios and bulk-load them into stock_prices.")
+    parser.add_argument("--scenarios", type=int, default=1000)
+    parser.add_argument("--seed", type=int, required=True)
+    parser.add_argument("--periods", type=int, default=END_PERIOD)
+    parser.add_argument("--start-spread", type=int, default=0, help="random start price offset (+/-) for non-gifted stocks")
+    parser.add_argument("--names", nargs="+", help="stock names (default: those of scenario 0, else built-in names)")
+    parser.add_argument("--dry-run", action="store_true", help="generate and validate only")
+    args = parser.parse_args()
+
+    from db_utils import get_stock_prices, save_price_scenarios
+
+    names = args.names
+    if not names and not args.dry_run:
+        names = list(get_stock_prices(0)["stock_name"].unique())
+    paths = generate(args.scenarios, names or DEFAULT_STOCK_NAMES, args.periods, args.seed, args.start_spread)
+    validate(paths)
+    print(f"{len(paths)} scenarios x {len(paths.names)} stocks x {paths.prices.shape[2]} periods valid")
+    if args.dry_run:
+        print(json.dumps({"names": paths.names, "first": paths.prices[0].tolist()}, indent=2))
+        return
+    ids = save_price_scenarios(paths)
+    print(f"loaded scenarios {ids[0]}-{ids[-1]}")
+
+
+if __name__ == "__main__":
+    main()
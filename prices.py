@@ -0,0 +1,112 @@
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+# Kurstabelle wird einmal pro Prozess geladen und von allen Sessions geteilt
+PRICE_CACHE_TTL = float(os.getenv("PRICE_CACHE_TTL", 3600))
+
+
+class PriceMatrix:
+    def __init__(self, names, prices, lengths=None):
+        self.names = tuple(names)
+        self.index = {name: row for row, name in enumerate(self.names)}
+        self.prices = np.array(prices, dtype=np.float64)
+        self.prices.setflags(write=False)
+        if lengths is None:
+            lengths = np.full(len(self.names), self.prices.shape[1], dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def from_frame(cls, df):
+        table = df.pivot(index="stock_name", columns="period", values="price").sort_index(axis=1)
+        # Reihenfolge wie bisher: in der Reihenfolge des ersten Auftretens
+        names = list(df["stock_name"].unique())
+        table = table.reindex(names)
+        lengths = table.notna().sum(axis=1).to_numpy()
+        return cls(names, table.to_numpy(dtype=np.float64), lengths)
+
+    @property
+    def periods(self):
+        return self.prices.shape[1]
+
+    def history(self, name):
+        row = self.index[name]
+        return self.prices[row, :self.lengths[row]]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+
+# Welche Kurs-Szenarien neue Sessions bekommen: "0" (bisherige Kurse), eine Liste wie "1,2,5",
+# ein Bereich "1-1000" oder "all" (alle erzeugten Szenarien aus price_scenarios, sonst 0)
+PRICE_SCENARIOS = os.getenv("PRICE_SCENARIOS", "0")
+
+_matrices = {}
+_matrix_lock = threading.Lock()
+_scenarios = None
+# Eigener Generator: die App setzt random.seed() beim Periodenwechsel
+_scenario_rng = random.Random()
+
+
+def get_price_matrix(scenario_id=0, ttl=None):
+    ttl = PRICE_CACHE_TTL if ttl is None else ttl
+    matrix = _matrices.get(scenario_id)
+    if matrix is not None and time.monotonic() - matrix.loaded_at < ttl:
+        return matrix
+    with _matrix_lock:
+        matrix = _matrices.get(scenario_id)
+        if matrix is None or time.monotonic() - matrix.loaded_at >= ttl:
+            from db_utils import get_stock_prices
+            df = get_stock_prices(scenario_id)
+            if df.empty:
+                raise KeyError(f"no stock prices for scenario {scenario_id}")
+            matrix = _matrices[scenario_id] = PriceMatrix.from_frame(df)
+        return matrix
+
+
+def parse_scenarios(spec):
+    spec = spec.strip()
+    if spec == "all":
+        return None
+    ids = []
+    for part in spec.split(","):
+        part = part.strip()
+        if "-" in part:
+            first, last = part.split("-", 1)
+            ids.extend(range(int(first), int(last) + 1))
+        elif part:
+            ids.append(int(part))
+    return ids or [0]
+
+
+def available_scenarios(spec=None, ttl=None):
+    global _scenarios
+    ids = parse_scenarios(PRICE_SCENARIOS if spec is None else spec)
+    if ids is not None:
+        return ids
+    ttl = PRICE_CACHE_TTL if ttl is None else ttl
+    cached = _scenarios
+    if cached is not None and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+    from db_utils import get_price_scenarios
+    ids = get_price_scenarios() or [0]
+    _scenarios = (time.monotonic(), ids)
+    return ids
+
+
+def pick_scenario(spec=None):
+    return _scenario_rng.choice(available_scenarios(spec))
+
+
+def invalidate_price_matrix():
+    global _scenarios
+    with _matrix_lock:
+        _matrices.clear()
+        _scenarios = None
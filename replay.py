@@ -0,0 +1,242 @@
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from engine import END_PERIOD, GROUPS
+
+# Rekonstruiert Cash, Bestaende, Einstandspreise und Depotwert aller Spieler pro Periode
+# aus actions + stock_prices, ohne Player.buy/sell Zeile fuer Zeile nachzuspielen.
+#
+# Werte gelten am Ende der Periode p (nach allen Trades in p) zum Kurs von Periode p,
+# wie Player.track_performance beim Klick auf "Next Period".
+
+REPLAY_CACHE_DIR = os.getenv("REPLAY_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".replay_cache"))
+
+
+class Replay:
+    __slots__ = ("user_ids", "stock_names", "groups", "cash", "holdings", "buy_prices", "values")
+
+    def __init__(self, user_ids, stock_names, groups, cash, holdings, buy_prices, values):
+        self.user_ids = np.asarray(user_ids)
+        self.stock_names = np.asarray(stock_names)
+        self.groups = np.asarray(groups)
+        self.cash = cash                # (Spieler, Perioden)
+        self.holdings = holdings        # (Spieler, Perioden, Aktien)
+        self.buy_prices = buy_prices    # (Spieler, Perioden, Aktien), NaN ohne Bestand
+        self.values = values            # (Spieler, Perioden)
+
+    def save(self, path):
+        np.savez_compressed(path, **{name: getattr(self, name) for name in self.__slots__})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(*(data[name] for name in cls.__slots__))
+
+    def to_frame(self):
+        n_users, n_periods = self.values.shape
+        return pd.DataFrame({
+            "user_id": np.repeat(self.user_ids, n_periods),
+            "user_group": np.repeat(self.groups, n_periods),
+            "period": np.tile(np.arange(1, n_periods + 1), n_users),
+            "cash": self.cash.ravel(),
+            "value": self.values.ravel(),
+        })
+
+    def holdings_frame(self):
+        users, periods, stocks = np.nonzero(self.holdings)
+        return pd.DataFrame({
+            "user_id": self.user_ids[users],
+            "period": periods + 1,
+            "stock_name": self.stock_names[stocks],
+            "amount": self.holdings[users, periods, stocks],
+            "buy_price": self.buy_prices[users, periods, stocks],
+        })
+
+
+def _forward_fill(values, axis):
+    # Letzten gueltigen Wert entlang axis fortschreiben (NaN = kein neuer Wert)
+    valid = ~np.isnan(values)
+    shape = [1] * values.ndim
+    shape[axis] = values.shape[axis]
+    positions = np.where(valid, np.arange(values.shape[axis]).reshape(shape), 0)
+    np.maximum.accumulate(positions, axis=axis, out=positions)
+    filled = np.take_along_axis(values, positions, axis=axis)
+    filled[~np.maximum.accumulate(valid, axis=axis)] = np.nan
+    return filled
+
+
+def _episode_buy_prices(trades):
+    # Player.buy: neuer Einstand = Kaufpreis, bei bestehender Position (alt + neu) / 2.
+    # Innerhalb einer Position mit Kaeufen p_0..p_k ergibt das 2^-k * (p_0 + sum_j p_j * 2^(j-1)).
+    buy = trades["signed"].to_numpy() > 0
+    position = trades.groupby(["user", "stock"], sort=False)["signed"].cumsum().to_numpy()
+    closed = np.r_[True, position[:-1] == 0]
+    new_group = np.r_[True, (trades["user"].to_numpy()[1:] != trades["user"].to_numpy()[:-1])
+                      | (trades["stock"].to_numpy()[1:] != trades["stock"].to_numpy()[:-1])]
+    # Reihenfolge ist nach (user, stock, seq) sortiert; neue Episode nach Glattstellung
+    episode = np.cumsum(new_group | (closed & buy))
+
+    buys = pd.DataFrame({"episode": episode[buy], "price": trades["price"].to_numpy()[buy]})
+    k = buys.groupby("episode").cumcount().to_numpy()
+    weights = np.exp2(np.maximum(k - 1, 0))
+    terms = buys["price"].to_numpy() * weights
+    sums = pd.Series(terms).groupby(buys["episode"].to_numpy()).cumsum().to_numpy()
+
+    buy_price = np.full(len(trades), np.nan)
+    buy_price[buy] = sums * np.exp2(-k)
+    # Verkaeufe behalten den Einstand, bei Bestand 0 gibt es keinen mehr
+    buy_price = pd.Series(buy_price).groupby(episode).ffill().to_numpy(copy=True)
+    buy_price[position == 0] = np.nan
+    return buy_price, position
+
+
+def replay(actions, stock_prices, survey=None, periods=END_PERIOD):
+    # Kurse je Szenario (stock_prices.scenario_id, ohne Spalte: alles Szenario 0) als
+    # Array (Szenarien, Aktien, Perioden) mit gemeinsamer Aktienreihenfolge
+    if "scenario_id" not in stock_prices:
+        stock_prices = stock_prices.assign(scenario_id=0)
+    stock_names = list(stock_prices["stock_name"].unique())
+    stock_index = {name: i for i, name in enumerate(stock_names)}
+    table = stock_prices.pivot_table(index=["scenario_id", "stock_name"], columns="period", values="price", aggfunc="last")
+    scenario_ids = sorted(table.index.get_level_values(0).unique())
+    scenario_index = {scenario: i for i, scenario in enumerate(scenario_ids)}
+    table = table.reindex(pd.MultiIndex.from_product([scenario_ids, stock_names])).sort_index(axis=1)
+    scenario_prices = table.to_numpy(dtype=np.float64).reshape(len(scenario_ids), len(stock_names), -1)
+
+    groups = {} if survey is None else dict(zip(survey["user_id"], survey["user_group"]))
+    scenarios = {} if survey is None or "scenario_id" not in survey else dict(zip(survey["user_id"], survey["scenario_id"]))
+    user_ids = sorted(set(actions["user_id"]) | set(groups))
+    user_index = {u: i for i, u in enumerate(user_ids)}
+    user_groups = [groups.get(u) or "control" for u in user_ids]
+    # Spieler ohne (bekanntes) Szenario spielten mit Szenario 0
+    default_scenario = scenario_index.get(0, 0)
+    user_scenarios = np.array([
+        scenario_index.get(int(scenarios[u]), default_scenario) if pd.notna(scenarios.get(u)) else default_scenario
+        for u in user_ids
+    ], dtype=np.int64)
+    # (Spieler, Aktien, Perioden)
+    prices = scenario_prices[user_scenarios, :, :periods]
+
+    n_users, n_stocks = len(user_ids), len(stock_names)
+
+    # Startbedingungen; Geschenke werden wie ein Kauf in "Periode 0" behandelt
+    capital = np.array([GROUPS[g]["capital"] for g in user_groups], dtype=np.float64)
+    gift_rows = []
+    for u, g in enumerate(user_groups):
+        for name, amount in GROUPS[g]["gifts"]:
+            gift_rows.append((u, stock_index[name], 0, -1, amount, round(float(prices[u, stock_index[name], 0]), 2)))
+    gifts = pd.DataFrame(gift_rows, columns=["user", "stock", "period", "seq", "signed", "price"])
+
+    # Reihenfolge der Trades: Periode, Zeitpunkt des Klicks, dann id. Die id allein reicht nicht,
+    # aus dem Journal nachgeholte Trades bekommen eine spaetere id als ihr Zeitpunkt
+    order = [column for column in ("period", "traded_at", "id") if column in actions]
+    if "traded_at" in actions:
+        actions = actions.assign(traded_at=pd.to_datetime(actions["traded_at"]))
+    actions = actions.sort_values(order, kind="stable", na_position="first").reset_index(drop=True)
+    seq = np.arange(len(actions))
+    trades = pd.DataFrame({
+        "user": actions["user_id"].map(user_index).to_numpy(),
+        "stock": actions["stock_name"].map(stock_index).to_numpy(),
+        "period": actions["period"].to_numpy(),
+        "seq": seq,
+        "signed": np.where(actions["action"].to_numpy() == "Buy", 1, -1) * actions["amount"].to_numpy(),
+        "price": actions["price"].to_numpy(dtype=np.float64),
+    })
+    # Ohne Trades (leere actions) haetten die Spalten sonst dtype object
+    trades = pd.concat([gifts, trades], ignore_index=True).astype(
+        {"user": np.int64, "stock": np.int64, "period": np.int64, "seq": np.int64, "signed": np.int64, "price": np.float64})
+    trades = trades.sort_values(["user", "stock", "seq"], kind="stable")
+    trades = trades.reset_index(drop=True)
+
+    buy_price, position = _episode_buy_prices(trades)
+
+    # Bestand und Einstand am Ende jeder Periode (letzter Trade der Periode zaehlt)
+    t = np.clip(trades["period"].to_numpy() - 1, 0, periods - 1)
+    u = trades["user"].to_numpy()
+    s = trades["stock"].to_numpy()
+    last = np.r_[(u[1:] != u[:-1]) | (s[1:] != s[:-1]) | (t[1:] != t[:-1]), True][:len(u)]
+    holdings = np.full((n_users, periods, n_stocks), np.nan)
+    buy_prices = np.full((n_users, periods, n_stocks), np.nan)
+    holdings[u[last], t[last], s[last]] = position[last]
+    buy_prices[u[last], t[last], s[last]] = np.where(position > 0, buy_price, -1.0)[last]
+
+    holdings = np.nan_to_num(_forward_fill(holdings, axis=1), nan=0.0).astype(np.int64)
+    buy_prices = _forward_fill(buy_prices, axis=1)
+    buy_prices[(buy_prices < 0) | (holdings == 0)] = np.nan
+
+    flows = np.zeros((n_users, periods))
+    real = trades["seq"].to_numpy() >= 0
+    np.add.at(flows, (u[real], t[real]), trades["signed"].to_numpy()[real] * trades["price"].to_numpy()[real])
+    cash = capital[:, None] - np.cumsum(flows, axis=1)
+
+    values = cash + np.einsum("uts,ust->ut", holdings, np.nan_to_num(prices))
+    return Replay(user_ids, stock_names, user_groups, cash, holdings, buy_prices, values)
+
+
+# Optional nur ein Experiment (auf Postgres liest das nur dessen Partitionen)
+def _experiment_filter(experiment_id):
+    return (" WHERE experiment_id = %s", [experiment_id]) if experiment_id is not None else ("", [])
+
+
+def data_watermark(experiment_id=None):
+    from db_utils import get_db
+
+    where, params = _experiment_filter(experiment_id)
+    with get_db() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(id), 0), COUNT(*) FROM actions" + where, params)
+        actions = cursor.fetchone()
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(price), 0) FROM stock_prices")
+        prices = cursor.fetchone()
+        cursor.execute("SELECT COUNT(*), COUNT(user_group), COALESCE(SUM(scenario_id), 0) FROM survey" + where, params)
+        survey = cursor.fetchone()
+    return f"{actions}|{prices}|{survey}"
+
+
+def load_replay(cache_dir=REPLAY_CACHE_DIR, periods=END_PERIOD, experiment_id=None):
+    from db_utils import get_db
+
+    key = hashlib.sha1(f"{data_watermark(experiment_id)}|{periods}|{experiment_id}".encode()).hexdigest()[:16]
+    path = os.path.join(cache_dir, f"replay_{key}.npz")
+    if os.path.exists(path):
+        return Replay.load(path)
+
+    where, params = _experiment_filter(experiment_id)
+    with get_db() as conn:
+        actions = pd.read_sql_query("SELECT id, user_id, period, action, stock_name, amount, price, traded_at FROM actions"
+                                    + where, conn, params=params)
+        stock_prices = pd.read_sql_query("SELECT scenario_id, stock_name, period, price FROM stock_prices "
+                                         "ORDER BY scenario_id, stock_name, period", conn)
+        survey = pd.read_sql_query("SELECT user_id, user_group, scenario_id FROM survey" + where, conn, params=params)
+    result = replay(actions, stock_prices, survey, periods)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{path}.tmp.npz"
+    result.save(tmp)
+    os.replace(tmp, path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild every player's per-period portfolio from the actions table.")
+    parser.add_argument("--out", required=True, help="CSV or Parquet file for the per-period values")
+    parser.add_argument("--holdings", help="optional CSV or Parquet file for per-period holdings")
+    parser.add_argument("--cache-dir", default=REPLAY_CACHE_DIR)
+    parser.add_argument("--experiment", help="only this experiment (default: all)")
+    args = parser.parse_args()
+
+    result = load_replay(args.cache_dir, experiment_id=args.experiment)
+    for frame, path in ((result.to_frame(), args.out), (result.holdings_frame() if args.holdings else None, args.holdings)):
+        if frame is None:
+            continue
+        if path.endswith(".parquet"):
+            frame.to_parquet(path, index=False)
+        else:
+            frame.to_csv(path, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import argparse
+
+from db_utils import RETENTION_DAYS, purge_expired, purge_experiment
+
+# Aufbewahrung der Spieldaten: auf Postgres werden ganze Monatspartitionen entfernt
+# (DROP TABLE statt DELETE), auf SQLite die Zeilen. Gedacht fuer einen taeglichen Cronjob:
+#
+#   python retention.py                     # alles vor dem Monat von heute - RETENTION_DAYS
+#   python retention.py --drop-experiment pilot
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drop game data older than the retention period or of a whole experiment.")
+    parser.add_argument("--days", type=int, default=RETENTION_DAYS,
+                        help="keep at least this many days (whole months are dropped)")
+    parser.add_argument("--experiment", help="only purge this experiment (default: all)")
+    parser.add_argument("--drop-experiment", metavar="EXPERIMENT", help="remove all data of this experiment")
+    args = parser.parse_args()
+
+    if args.drop_experiment:
+        dropped = purge_experiment(args.drop_experiment)
+    else:
+        dropped = purge_expired(args.days, args.experiment)
+    # Postgres: Namen der Partitionen, SQLite: geloeschte Zeilen je Tabelle
+    for name in dropped:
+        print(f"dropped {name}")
+    if not dropped:
+        print("nothing to drop")
+
+
+if __name__ == "__main__":
+    main()
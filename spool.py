@@ -0,0 +1,276 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+# Lokales Journal + Circuit Breaker fuer Schreibzugriffe auf die Datenbank.
+# Ist die Datenbank langsam oder weg, landen Schreibvorgaenge als eine Zeile pro
+# Datensatz im Journal (fsync) und werden spaeter idempotent und gebuendelt nachgeholt.
+
+logger = logging.getLogger(__name__)
+
+DB_SPOOL_DIR = os.getenv("DB_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".db_spool"))
+DB_SPOOL_REPLAY_INTERVAL = float(os.getenv("DB_SPOOL_REPLAY_INTERVAL", 5))
+DB_BREAKER_FAILURES = int(os.getenv("DB_BREAKER_FAILURES", 3))
+DB_BREAKER_RESET = float(os.getenv("DB_BREAKER_RESET", 15))
+# Aufrufe, die laenger dauern, zaehlen fuer den Breaker als Fehler
+DB_SLOW_CALL = float(os.getenv("DB_SLOW_CALL", 2))
+# Wie oft ein Datensatz ohne geschriebenen Vorgaenger (Konto, Umfrage) erneut eingereiht wird
+DB_SPOOL_MAX_RETRIES = int(os.getenv("DB_SPOOL_MAX_RETRIES", 20))
+
+
+# Vom Handler geworfen fuer Datensaetze, deren Vorgaenger noch nicht in der Datenbank ist
+# (z. B. noch im Journal): payloads kommen hinten ins Journal statt nach rejected.log
+class RetryLater(Exception):
+    def __init__(self, message, payloads):
+        super().__init__(message)
+        self.payloads = payloads
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=DB_BREAKER_FAILURES, reset_timeout=DB_BREAKER_RESET, slow_call=DB_SLOW_CALL):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call = slow_call
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probing = False
+            # Im Zustand half_open darf genau ein Aufruf testen
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, ok, elapsed=0.0):
+        with self._lock:
+            self._probing = False
+            if ok and elapsed <= self.slow_call:
+                self.state = "closed"
+                self._failures = 0
+                return
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning("Database circuit breaker opened after %d failed/slow calls", self._failures)
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class Spool:
+    # handlers: kind -> Funktion, die eine Liste von Payloads idempotent in die DB schreibt
+    # is_transient: True fuer Verbindungsfehler; andere Fehler liegen an den Daten selbst
+    # upgrade: (kind, payload) -> payload im aktuellen Format, fuer Zeilen aelterer Versionen im Journal;
+    # ValueError, wenn der Datensatz zu keiner Version passt
+    def __init__(self, directory=DB_SPOOL_DIR, handlers=None, breaker=None, replay_interval=DB_SPOOL_REPLAY_INTERVAL,
+                 is_transient=None, max_retries=DB_SPOOL_MAX_RETRIES, upgrade=None):
+        self.directory = directory
+        self.handlers = handlers if handlers is not None else {}
+        self.breaker = breaker or CircuitBreaker()
+        self.is_transient = is_transient or (lambda exc: True)
+        self.upgrade = upgrade or (lambda kind, payload: payload)
+        self.replay_interval = replay_interval
+        self.max_retries = max_retries
+        # Datensaetze im Journal, auch die eines frueheren Prozesses
+        self.pending = self._count_pending()
+        self._file = None
+        self._lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def journal_path(self):
+        return os.path.join(self.directory, "journal.log")
+
+    @property
+    def rejected_path(self):
+        return os.path.join(self.directory, "rejected.log")
+
+    def _count_pending(self):
+        paths = glob.glob(os.path.join(self.directory, "journal-*.replay")) + [self.journal_path]
+        return sum(len(self._read(path)) for path in paths if os.path.exists(path))
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="db-spool", daemon=True)
+                    self._thread.start()
+
+    # Zeile: [kind, payload] bzw. [kind, payload, versuche] fuer erneut eingereihte Datensaetze
+    @staticmethod
+    def _lines(kind, payloads, attempts=None):
+        return "".join(json.dumps([kind, p] if not a else [kind, p, a], separators=(",", ":"), default=str) + "\n"
+                       for p, a in zip(payloads, attempts or [0] * len(payloads)))
+
+    def append(self, kind, payloads, attempts=None):
+        lines = self._lines(kind, payloads, attempts)
+        with self._lock:
+            if self._file is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._file = open(self.journal_path, "a", encoding="utf-8")
+            self._file.write(lines)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.pending += len(payloads)
+        self._ensure_worker()
+
+    # Datensaetze, die die Datenbank inhaltlich ablehnt, duerfen das Journal nicht blockieren
+    def reject(self, kind, payloads):
+        lines = self._lines(kind, payloads)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.rejected_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    # Erneut einreihen; wer zu oft auf seinen Vorgaenger gewartet hat, geht nach rejected.log.
+    # tries: id(payload) -> bisherige Versuche (beim Replay)
+    def _retry_later(self, kind, exc, tries=None):
+        retry, attempts = [], []
+        for payload in exc.payloads:
+            attempt = (tries or {}).get(id(payload), 0) + 1
+            if attempt > self.max_retries:
+                logger.error("Giving up on %s record %r after %d attempts: %s", kind, payload, attempt - 1, exc)
+                self.reject(kind, [payload])
+            else:
+                retry.append(payload)
+                attempts.append(attempt)
+        if retry:
+            logger.info("Retrying %d %s records later: %s", len(retry), kind, exc)
+            self.append(kind, retry, attempts)
+
+    # Ruft write() auf; RetryLater reiht die betroffenen Datensaetze neu ein, der Rest gilt als geschrieben
+    def _call(self, kind, payloads, write, tries=None):
+        try:
+            write(payloads)
+        except RetryLater as exc:
+            self._retry_later(kind, exc, tries)
+
+    # Einzeln schreiben, abgelehnte Datensaetze aussortieren; Verbindungsfehler werden weitergereicht
+    def _write_each(self, kind, payloads, write, tries=None):
+        for payload in payloads:
+            try:
+                self._call(kind, [payload], write, tries)
+            except Exception as exc:
+                if self.is_transient(exc):
+                    raise
+                logger.error("Database rejected %s record %r: %s", kind, payload, exc)
+                self.reject(kind, [payload])
+
+    # Schreibt ueber write(), solange der Breaker es erlaubt; sonst bzw. bei Fehlern ins Journal.
+    # Stehen noch aeltere Datensaetze im Journal, kommen neue dahinter: sonst waere z. B. ein
+    # Ergebnis vor seiner Umfrage in der Datenbank.
+    def write(self, kind, payloads, write):
+        self._ensure_worker()
+        if self.pending == 0 and self.breaker.allow():
+            start = time.monotonic()
+            try:
+                try:
+                    self._call(kind, payloads, write)
+                except Exception as exc:
+                    if self.is_transient(exc):
+                        raise
+                    self._write_each(kind, payloads, write)
+            except Exception:
+                self.breaker.record(False)
+                logger.exception("Database write (%s) failed, spooling %d records", kind, len(payloads))
+            else:
+                self.breaker.record(True, time.monotonic() - start)
+                return True
+        self.append(kind, payloads)
+        return False
+
+    def _rotate(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > 0:
+                os.replace(self.journal_path, os.path.join(self.directory, f"journal-{time.time_ns()}.replay"))
+        return sorted(glob.glob(os.path.join(self.directory, "journal-*.replay")))
+
+    @staticmethod
+    def _read(path):
+        records = []
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    kind, payload, *attempts = json.loads(line)
+                except ValueError:
+                    # Abgeschnittene letzte Zeile nach einem Absturz
+                    logger.warning("Skipping unreadable line %d in %s", number, path)
+                    continue
+                records.append((kind, payload, attempts[0] if attempts else 0))
+        return records
+
+    def replay(self):
+        with self._replay_lock:
+            if not os.path.isdir(self.directory):
+                return 0
+            replayed = 0
+            for path in self._rotate():
+                records = self._read(path)
+                # Reihenfolge bleibt erhalten: aufeinanderfolgende Datensaetze gleicher Art als ein Batch
+                batches = []
+                tries = {}
+                for kind, payload, attempts in records:
+                    try:
+                        payload = self.upgrade(kind, payload)
+                    except ValueError as exc:
+                        logger.error("Unreadable %s record %r: %s", kind, payload, exc)
+                        self.reject(kind, [payload])
+                        continue
+                    if batches and batches[-1][0] == kind:
+                        batches[-1][1].append(payload)
+                    else:
+                        batches.append((kind, [payload]))
+                    tries[id(payload)] = attempts
+                if not self.breaker.allow():
+                    return replayed
+                try:
+                    for kind, payloads in batches:
+                        handler = self.handlers[kind]
+                        try:
+                            self._call(kind, payloads, handler, tries)
+                        except Exception as exc:
+                            if self.is_transient(exc):
+                                raise
+                            self._write_each(kind, payloads, handler, tries)
+                except Exception:
+                    self.breaker.record(False)
+                    logger.exception("Replaying %s failed, will retry", path)
+                    return replayed
+                self.breaker.record(True)
+                os.remove(path)
+                replayed += len(records)
+                with self._lock:
+                    self.pending = max(0, self.pending - len(records))
+            # Journal leer (auch keine neuen Zeilen seit dem Rotieren): Zaehler kann nicht mehr abweichen
+            with self._lock:
+                if self._file is None and not os.path.exists(self.journal_path):
+                    self.pending = 0
+            return replayed
+
+    def _run(self):
+        while True:
+            try:
+                self.replay()
+            except Exception:
+                logger.exception("Spool replay loop failed")
+            time.sleep(self.replay_interval)
+
+    def stats(self):
+        return {"state": self.breaker.state, "pending": self.pending}
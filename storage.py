@@ -0,0 +1,606 @@
+import csv
+import io
+import os
+import re
+import sqlite3
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Speicher-Backends fuer db_utils. Auswahl ueber DB_BACKEND=postgres|sqlite.
+# Die Abfragen in db_utils sind im Postgres-Stil (%s-Platzhalter) geschrieben;
+# Unterschiede zwischen den Dialekten stecken nur in den Methoden hier.
+
+DB_BACKEND = os.getenv("DB_BACKEND", "postgres")
+
+# Verbindung zur Datenbank
+DB_HOST = os.getenv("DB_HOST")
+DB_PORT = os.getenv("DB_PORT", 5432)
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", 5))
+
+# Connection-Pool (pro Prozess, von allen Sessions geteilt)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# Verbindungen, die laenger ungenutzt waren, werden vor der Ausgabe geprueft
+DB_POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", 30))
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "boersenspiel.sqlite3"))
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", 10))
+# Offene Verbindungen pro Prozess; Streamlit rerunnt in wechselnden Threads, daher kein Thread-Bezug
+SQLITE_POOL_MAX = int(os.getenv("SQLITE_POOL_MAX", DB_POOL_MAX))
+
+
+# Nach Lauf (experiment_id) und Monat des Spielstarts (start_time) partitioniert, siehe Migration 10
+PARTITIONED_TABLES = ("survey", "actions", "results")
+
+
+class Storage:
+    name = None
+
+    def connection(self):
+        raise NotImplementedError
+
+    # Verbindung fuer Schema-Migrationen, exklusiv ueber alle Prozesse
+    def migration_connection(self):
+        raise NotImplementedError
+
+    def insert_many(self, cursor, query, rows):
+        raise NotImplementedError
+
+    def execute_many(self, cursor, query, rows):
+        raise NotImplementedError
+
+    # Massenimport ohne Konfliktbehandlung (Postgres: COPY FROM STDIN)
+    def copy_rows(self, cursor, table, columns, rows):
+        raise NotImplementedError
+
+    # Trades pruefen und buchen (accounts/positions/actions), eine Zeile je Trade:
+    # (action_key, user_id, period, action, stock_name, amount, price, traded_at) -> Status je Trade
+    def apply_trades(self, cursor, rows):
+        raise NotImplementedError
+
+    # Partitionen fuer survey/actions/results eines Laufs und Monats (month: erster Tag) anlegen
+    def ensure_partitions(self, experiment_id, month):
+        raise NotImplementedError
+
+    # Aufbewahrung: alle Daten der Monate vor `before` (erster Tag eines Monats) entfernen,
+    # optional nur fuer einen Lauf; Rueckgabe: Beschreibung je entfernter Partition
+    def drop_partitions(self, before, experiment_id=None):
+        raise NotImplementedError
+
+    def drop_experiment(self, experiment_id):
+        raise NotImplementedError
+
+    def median(self, column):
+        raise NotImplementedError
+
+    def next_assignment_slot(self):
+        raise NotImplementedError
+
+    def copy_to_csv(self, query, params, out):
+        raise NotImplementedError
+
+    def iter_chunks(self, query, params, chunk_rows):
+        raise NotImplementedError
+
+    # Verbindungs- und Verfuegbarkeitsfehler (erneut versuchen) vs. Fehler in den Daten
+    def is_transient(self, exc):
+        return True
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+class PostgresStorage(Storage):
+    name = "postgres"
+
+    # dsn: libpq-Verbindungsstring statt DB_HOST/DB_NAME/..., z. B. fuer Tests
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT,
+                 check_after=DB_POOL_CHECK_AFTER, dsn=None):
+        import psycopg2
+        import psycopg2.extras
+        import psycopg2.pool
+        import psycopg2.sql
+
+        self.psycopg2 = psycopg2
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after = check_after
+        self.dsn = dsn
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._stats_lock = threading.Lock()
+        self.pool_stats = {
+            "acquired": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+            "timeouts": 0,
+            "replaced": 0,
+        }
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None and self.dsn:
+                    self._pool = self.psycopg2.pool.ThreadedConnectionPool(
+                        self.minconn, self.maxconn, dsn=self.dsn, connect_timeout=DB_CONNECT_TIMEOUT)
+                elif self._pool is None:
+                    self._pool = self.psycopg2.pool.ThreadedConnectionPool(
+                        self.minconn,
+                        self.maxconn,
+                        host=DB_HOST,
+                        port=DB_PORT,
+                        dbname=DB_NAME,
+                        user=DB_USER,
+                        password=DB_PASSWORD,
+                        sslmode="require",
+                        connect_timeout=DB_CONNECT_TIMEOUT
+                    )
+        return self._pool
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except self.psycopg2.Error:
+            return False
+
+    def _checkout(self, pool):
+        conn = pool.getconn()
+        while not self._is_healthy(conn):
+            self._last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+            with self._stats_lock:
+                self.pool_stats["replaced"] += 1
+            conn = pool.getconn()
+        return conn
+
+    # Leiht eine Verbindung aus dem Pool: commit bei Erfolg, rollback bei Fehler
+    @contextmanager
+    def connection(self):
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._stats_lock:
+                self.pool_stats["timeouts"] += 1
+            raise self.psycopg2.pool.PoolError(f"No database connection available after {self.timeout}s")
+        pool = None
+        conn = None
+        try:
+            pool = self._get_pool()
+            conn = self._checkout(pool)
+            waited = time.monotonic() - start
+            with self._stats_lock:
+                self.pool_stats["acquired"] += 1
+                self.pool_stats["wait_total"] += waited
+                self.pool_stats["wait_max"] = max(self.pool_stats["wait_max"], waited)
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+        finally:
+            if conn is not None:
+                broken = conn.closed != 0
+                if broken:
+                    self._last_used.pop(id(conn), None)
+                else:
+                    self._last_used[id(conn)] = time.monotonic()
+                pool.putconn(conn, close=broken)
+            self._slots.release()
+
+    # Beliebige, aber feste Kennung fuer pg_advisory_xact_lock
+    MIGRATION_LOCK_ID = 724_310_001
+
+    @contextmanager
+    def migration_connection(self):
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                # Sperre gilt bis zum Commit; parallele Prozesse warten hier
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (self.MIGRATION_LOCK_ID,))
+            yield conn
+
+    def insert_many(self, cursor, query, rows):
+        self.psycopg2.extras.execute_values(cursor, query, rows, page_size=max(len(rows), 1))
+
+    def execute_many(self, cursor, query, rows):
+        self.psycopg2.extras.execute_batch(cursor, query, rows)
+
+    def copy_rows(self, cursor, table, columns, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH CSV", buffer)
+
+    # Ein Roundtrip: die Pruefung laeuft in apply_trade()/apply_trades() (Migration 9, zuletzt 12)
+    def apply_trades(self, cursor, rows):
+        if not rows:
+            return []
+        if len(rows) == 1:
+            cursor.execute("SELECT apply_trade(%s, %s, %s, %s, %s, %s, %s, %s)", rows[0])
+            return [cursor.fetchone()[0]]
+        columns = [list(column) for column in zip(*rows)]
+        cursor.execute('''SELECT apply_trades(%s::text[], %s::text[], %s::integer[], %s::text[], %s::text[],
+                                                %s::integer[], %s::double precision[], %s::timestamp[])''', columns)
+        return cursor.fetchone()[0]
+
+    # Eigene kurze Transaktion: das Anlegen sperrt die Elterntabelle, das soll nicht bis zum Ende
+    # des eigentlichen Schreibvorgangs dauern
+    def ensure_partitions(self, experiment_id, month):
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT ensure_partitions(%s, %s)", (experiment_id, month))
+
+    def drop_partitions(self, before, experiment_id=None):
+        sql = self.psycopg2.sql
+        query = "SELECT partition_name FROM partitions WHERE month < %s"
+        params = [before]
+        if experiment_id is not None:
+            query += " AND experiment_id = %s"
+            params.append(experiment_id)
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(query + " ORDER BY partition_name", params)
+            names = [row[0] for row in cursor.fetchall()]
+            for name in names:
+                cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(name)))
+            cursor.execute("DELETE FROM partitions WHERE partition_name = ANY(%s)", (names,))
+        return names
+
+    # Partitionen des Laufs ueber ihre Grenze im Katalog, nicht ueber den Namen
+    def drop_experiment(self, experiment_id):
+        sql = self.psycopg2.sql
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute('''SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                              WHERE i.inhparent = ANY(%s::regclass[])
+                                AND pg_get_expr(c.relpartbound, c.oid) = %s
+                              ORDER BY c.relname''',
+                           (list(PARTITIONED_TABLES), f"FOR VALUES IN ('{experiment_id}')"))
+            names = [row[0] for row in cursor.fetchall()]
+            for name in names:
+                cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(name)))
+            cursor.execute("DELETE FROM partitions WHERE experiment_id = %s", (experiment_id,))
+        return names
+
+    def median(self, column):
+        return f"percentile_cont(0.5) WITHIN GROUP (ORDER BY {column})"
+
+    def is_transient(self, exc):
+        return isinstance(exc, (self.psycopg2.OperationalError, self.psycopg2.InterfaceError,
+                                self.psycopg2.pool.PoolError))
+
+    def next_assignment_slot(self):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT nextval('assignment_seq')")
+            return cur.fetchone()[0]
+
+    def copy_to_csv(self, query, params, out):
+        with self.connection() as conn, conn.cursor() as cursor:
+            query = cursor.mogrify(query, params).decode()
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH CSV HEADER", out)
+
+    def iter_chunks(self, query, params, chunk_rows):
+        with self.connection() as conn:
+            # Server-seitiger Cursor: es liegen nie mehr als chunk_rows Zeilen im Speicher
+            with conn.cursor(name=f"chunks_{threading.get_ident()}") as cursor:
+                cursor.itersize = chunk_rows
+                cursor.execute(query, params)
+                rows = cursor.fetchmany(chunk_rows)
+                yield cursor.description, rows
+                while rows:
+                    rows = cursor.fetchmany(chunk_rows)
+                    if rows:
+                        yield cursor.description, rows
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self.pool_stats)
+        stats["wait_avg"] = stats["wait_total"] / stats["acquired"] if stats["acquired"] else 0.0
+        stats["in_use"] = self.maxconn - self._slots._value
+        return stats
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                self._last_used.clear()
+
+
+_PLACEHOLDER = re.compile(r"%s")
+# SQLITE_BUSY, SQLITE_LOCKED
+_SQLITE_TRANSIENT_CODES = (5, 6)
+
+
+class _SQLiteCursor(sqlite3.Cursor):
+    # Postgres-Platzhalter (%s) -> SQLite (?); als Context-Manager nutzbar wie psycopg2-Cursor
+    def execute(self, query, params=()):
+        return super().execute(_PLACEHOLDER.sub("?", query), params)
+
+    def executemany(self, query, rows):
+        return super().executemany(_PLACEHOLDER.sub("?", query), rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _SQLiteConnection(sqlite3.Connection):
+    def cursor(self, factory=_SQLiteCursor):
+        return super().cursor(factory)
+
+
+class _Median:
+    def __init__(self):
+        self.values = []
+
+    def step(self, value):
+        if value is not None:
+            self.values.append(value)
+
+    def finalize(self):
+        return statistics.median(self.values) if self.values else None
+
+
+class SQLiteStorage(Storage):
+    name = "sqlite"
+
+    def __init__(self, path=SQLITE_PATH, busy_timeout=SQLITE_BUSY_TIMEOUT, maxconn=SQLITE_POOL_MAX,
+                 timeout=DB_POOL_TIMEOUT):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self._idle = []
+        self._open = 0
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        sqlite3.register_adapter(datetime, datetime.isoformat)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            isolation_level=None,
+            factory=_SQLiteConnection,
+            cached_statements=512,
+            # Wird ueber den Pool an andere Threads weitergegeben, aber nie gleichzeitig benutzt
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.create_aggregate("median", 1, _Median)
+        return conn
+
+    # Leiht eine Verbindung aus einem kleinen Pool (hoechstens maxconn offen, wie bei Postgres);
+    # Statements bleiben je Verbindung von sqlite3 gecacht
+    @contextmanager
+    def _transaction(self, begin):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError(f"database is busy: no connection available after {self.timeout}s")
+        conn = None
+        try:
+            with self._lock:
+                if self._idle:
+                    conn = self._idle.pop()
+            if conn is None:
+                conn = self._connect()
+                with self._lock:
+                    self._open += 1
+            conn.execute(begin)
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+        finally:
+            if conn is not None:
+                # z. B. abgebrochener Generator in iter_chunks: nichts Offenes in den Pool zurueckgeben
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                with self._lock:
+                    self._idle.append(conn)
+            self._slots.release()
+
+    def connection(self):
+        return self._transaction("BEGIN")
+
+    def migration_connection(self):
+        return self._transaction("BEGIN IMMEDIATE")
+
+    def insert_many(self, cursor, query, rows):
+        if not rows:
+            return
+        values = "(" + ", ".join("?" * len(rows[0])) + ")"
+        cursor.executemany(query.replace("VALUES %s", f"VALUES {values}", 1), rows)
+
+    def execute_many(self, cursor, query, rows):
+        cursor.executemany(query, rows)
+
+    def copy_rows(self, cursor, table, columns, rows):
+        placeholders = ", ".join("?" * len(columns))
+        cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+
+    # Ohne Stored Functions: gleiche Pruefung wie apply_trade() in Postgres, ein Savepoint je Trade.
+    # Der erste Schreibzugriff sperrt die Datenbank bis zum Commit, damit ist die Pruefung atomar.
+    def apply_trades(self, cursor, rows):
+        statuses = []
+        for key, user_id, period, action, stock_name, amount, price, traded_at in rows:
+            if amount is None or amount <= 0 or price is None or price < 0 or action not in ("Buy", "Sell"):
+                statuses.append("invalid")
+                continue
+            cursor.execute("SAVEPOINT trade")
+            # Lauf und Spielstart kommen aus dem Konto, wie in apply_trade()
+            cursor.execute('''INSERT INTO actions (action_key, user_id, period, action, stock_name, amount, price,
+                                                 traded_at, experiment_id, start_time)
+                              SELECT %s, %s, %s, %s, %s, %s, %s, %s, experiment_id, start_time
+                              FROM accounts WHERE user_id = %s
+                              ON CONFLICT (experiment_id, start_time, action_key) DO NOTHING''',
+                           (key, user_id, period, action, stock_name, amount, price, traded_at, user_id))
+            if cursor.rowcount == 0:
+                cursor.execute("SELECT 1 FROM accounts WHERE user_id = %s", (user_id,))
+                status = "duplicate" if cursor.fetchone() else "no_account"
+            elif action == "Buy":
+                cursor.execute("UPDATE accounts SET cash = cash - %s WHERE user_id = %s AND cash >= %s",
+                               (amount * price, user_id, amount * price - 1e-6))
+                if cursor.rowcount:
+                    cursor.execute('''INSERT INTO positions (user_id, stock_name, amount) VALUES (%s, %s, %s)
+                                      ON CONFLICT (user_id, stock_name) DO UPDATE
+                                      SET amount = positions.amount + excluded.amount''',
+                                   (user_id, stock_name, amount))
+                    status = "ok"
+                else:
+                    status = "cash"
+            else:
+                cursor.execute("UPDATE positions SET amount = amount - %s WHERE user_id = %s AND stock_name = %s AND amount >= %s",
+                               (amount, user_id, stock_name, amount))
+                status = "ok" if cursor.rowcount else "holdings"
+                if status == "ok":
+                    cursor.execute("UPDATE accounts SET cash = cash + %s WHERE user_id = %s", (amount * price, user_id))
+            if status in ("cash", "holdings"):
+                cursor.execute("SELECT 1 FROM accounts WHERE user_id = %s", (user_id,))
+                if cursor.fetchone() is None:
+                    status = "no_account"
+            if status in ("ok", "duplicate"):
+                cursor.execute("RELEASE trade")
+            else:
+                cursor.execute("ROLLBACK TO trade")
+                cursor.execute("RELEASE trade")
+            statuses.append(status)
+        return statuses
+
+    # Keine Partitionen: dieselben Grenzen, aber zeilenweise geloescht
+    def ensure_partitions(self, experiment_id, month):
+        pass
+
+    def drop_partitions(self, before, experiment_id=None):
+        query = " WHERE start_time < %s"
+        params = [before.isoformat()]
+        if experiment_id is not None:
+            query += " AND experiment_id = %s"
+            params.append(experiment_id)
+        dropped = []
+        with self.connection() as conn, conn.cursor() as cursor:
+            for table in PARTITIONED_TABLES:
+                cursor.execute(f"DELETE FROM {table}{query}", params)
+                dropped.append(f"{table}: {cursor.rowcount} rows")
+        return dropped
+
+    def drop_experiment(self, experiment_id):
+        dropped = []
+        with self.connection() as conn, conn.cursor() as cursor:
+            for table in PARTITIONED_TABLES:
+                cursor.execute(f"DELETE FROM {table} WHERE experiment_id = %s", (experiment_id,))
+                dropped.append(f"{table}: {cursor.rowcount} rows")
+        return dropped
+
+    def median(self, column):
+        return f"median({column})"
+
+    # Nur gesperrte Datenbank ist voruebergehend; "no such table", Syntaxfehler usw. liegen am
+    # Schema bzw. an den Daten und duerfen weder den Breaker oeffnen noch das Journal blockieren
+    def is_transient(self, exc):
+        if not isinstance(exc, sqlite3.OperationalError):
+            return False
+        code = getattr(exc, "sqlite_errorcode", None)
+        if code is not None:
+            # erweiterte Codes (z. B. SQLITE_BUSY_SNAPSHOT) tragen den Basiscode im unteren Byte
+            return code & 0xFF in _SQLITE_TRANSIENT_CODES
+        message = str(exc)
+        return "locked" in message or "busy" in message
+
+    def next_assignment_slot(self):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("UPDATE assignment_counter SET value = value + 1 WHERE id = 1 RETURNING value")
+            return cur.fetchone()[0]
+
+    def copy_to_csv(self, query, params, out):
+        text = out if isinstance(out, io.TextIOBase) else io.TextIOWrapper(out, encoding="utf-8", newline="")
+        writer = csv.writer(text, lineterminator="\n")
+        header = False
+        for description, rows in self.iter_chunks(query, params, 10_000):
+            if not header:
+                writer.writerow([column[0] for column in description])
+                header = True
+            writer.writerows(rows)
+        if text is not out:
+            text.flush()
+            text.detach()
+
+    def iter_chunks(self, query, params, chunk_rows):
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchmany(chunk_rows)
+            yield cursor.description, rows
+            while rows:
+                rows = cursor.fetchmany(chunk_rows)
+                if rows:
+                    yield cursor.description, rows
+
+    def stats(self):
+        with self._lock:
+            return {"connections": self._open, "in_use": self.maxconn - self._slots._value}
+
+    # Schliesst die freien Verbindungen; ausgeliehene kommen danach wieder in den Pool
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn in idle:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass
+
+
+BACKENDS = {
+    "postgres": PostgresStorage,
+    "sqlite": SQLiteStorage,
+}
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if DB_BACKEND not in BACKENDS:
+                    raise ValueError(f"Unknown DB_BACKEND {DB_BACKEND!r}, expected one of {sorted(BACKENDS)}")
+                _storage = BACKENDS[DB_BACKEND]()
+    return _storage
+
+
+# Fuer Tests/Benchmarks: explizit ein Backend setzen
+def set_storage(storage):
+    global _storage
+    with _storage_lock:
+        if _storage is not None and _storage is not storage:
+            _storage.close()
+        _storage = storage
+    return storage
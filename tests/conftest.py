@@ -0,0 +1,66 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Journal und Metriken nicht im Repo bzw. auf der Konsole
+os.environ.setdefault("DB_SPOOL_DIR", tempfile.mkdtemp(prefix="boersenspiel-test-spool-"))
+os.environ.setdefault("METRICS_LOG_INTERVAL", "0")
+
+# Dieselben Tests gegen beide Backends. Postgres nur mit TEST_POSTGRES_DSN (libpq-String, z. B.
+# "dbname=boersenspiel_test user=postgres"); jeder Test bekommt dort ein eigenes Schema.
+TEST_POSTGRES_DSN = os.getenv("TEST_POSTGRES_DSN")
+
+
+def _sqlite(tmp_path):
+    from storage import SQLiteStorage
+
+    yield SQLiteStorage(str(tmp_path / "test.sqlite3"))
+
+
+def _postgres(tmp_path):
+    if not TEST_POSTGRES_DSN:
+        pytest.skip("TEST_POSTGRES_DSN not set")
+    psycopg2 = pytest.importorskip("psycopg2")
+    from psycopg2.extensions import make_dsn
+    from storage import PostgresStorage
+
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(TEST_POSTGRES_DSN)
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA {schema}")
+    try:
+        yield PostgresStorage(dsn=make_dsn(TEST_POSTGRES_DSN, options=f"-c search_path={schema}"))
+    finally:
+        with admin.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA {schema} CASCADE")
+        admin.close()
+
+
+# Leere Datenbank ohne Schema
+@pytest.fixture(params=["sqlite", "postgres"])
+def empty_storage(request, tmp_path):
+    import db_utils
+    from storage import set_storage
+
+    backend = {"sqlite": _sqlite, "postgres": _postgres}[request.param](tmp_path)
+    storage = next(backend)
+    set_storage(storage)
+    db_utils._partitions_ready.clear()
+    yield storage
+    set_storage(None)
+    backend.close()
+
+
+@pytest.fixture
+def storage(empty_storage):
+    from migrations import migrate
+
+    migrate()
+    return empty_storage
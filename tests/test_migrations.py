@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+import db_utils
+from migrations import MIGRATIONS, current_version
+
+# Eigener Prozess je Migration: die Sperre (Advisory Lock bzw. BEGIN IMMEDIATE) gilt prozessuebergreifend
+MIGRATE = """
+import sys
+sys.path.insert(0, sys.argv[1])
+from migrations import migrate
+from storage import PostgresStorage, SQLiteStorage, set_storage
+kind, target = sys.argv[2:]
+set_storage(SQLiteStorage(target) if kind == "sqlite" else PostgresStorage(dsn=target))
+migrate()
+"""
+
+
+def test_concurrent_migrations(empty_storage):
+    target = empty_storage.path if empty_storage.name == "sqlite" else empty_storage.dsn
+    env = dict(os.environ, METRICS_LOG_INTERVAL="0")
+    processes = [subprocess.Popen([sys.executable, "-c", MIGRATE, ROOT, empty_storage.name, target],
+                                  stderr=subprocess.PIPE, text=True, env=env)
+                 for _ in range(4)]
+    for process in processes:
+        _, stderr = process.communicate(timeout=120)
+        assert process.returncode == 0, stderr
+
+    with db_utils.get_db() as conn, conn.cursor() as cursor:
+        assert current_version(cursor) == MIGRATIONS[-1][0]
+        cursor.execute("SELECT version, COUNT(*) FROM schema_migrations GROUP BY version HAVING COUNT(*) > 1")
+        assert cursor.fetchall() == []
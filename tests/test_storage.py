@@ -0,0 +1,143 @@
+import uuid
+from datetime import datetime
+
+import pytest
+
+import db_utils
+from migrations import MIGRATIONS, current_version, migrate
+from spool import RetryLater
+
+NOW = datetime(2026, 1, 15, 10, 30).isoformat()
+
+
+def new_user():
+    return uuid.uuid4().hex.upper()
+
+
+def survey_row(user_id, experiment_id="default", start_time=NOW, group="control"):
+    return [user_id, 30, 5, "Other", "Other", "", None, group, start_time, 0, experiment_id]
+
+
+def action_row(user_id, period=6, amount=2, experiment_id="default"):
+    return [uuid.uuid4().hex, user_id, period, "Buy", "Stock A", amount, 50.0, experiment_id, NOW, NOW]
+
+
+def trade_row(user_id, action="Buy", stock="Stock A", amount=1, price=100.0, key=None):
+    return (key or uuid.uuid4().hex, user_id, 6, action, stock, amount, price, NOW)
+
+
+def test_migrate_is_idempotent(storage):
+    migrate()
+    with db_utils.get_db() as conn, conn.cursor() as cursor:
+        assert current_version(cursor) == MIGRATIONS[-1][0]
+
+
+def test_actions_roundtrip(storage):
+    user_id = new_user()
+    db_utils.save_surveys_bulk([survey_row(user_id)])
+    rows = [action_row(user_id, period) for period in range(6, 10)]
+    db_utils.save_actions_bulk(rows)
+    # Replay aus dem Journal: dieselben action_keys werden nicht doppelt gebucht
+    db_utils.save_actions_bulk(rows)
+
+    actions = db_utils.get_all_actions()
+    assert sorted(actions["action_key"]) == sorted(row[0] for row in rows)
+    assert sorted(actions["period"]) == [6, 7, 8, 9]
+    assert set(actions["experiment_id"]) == {"default"}
+
+
+def test_results_and_rank(storage):
+    first, second = new_user(), new_user()
+    db_utils.save_surveys_bulk([survey_row(first), survey_row(second, group="treatment")])
+    db_utils.save_results_bulk([[first, 1010.5], [second, 990.0]])
+
+    assert db_utils.load_result(first) == pytest.approx(1010.5)
+    rank = db_utils.get_result_rank(second)
+    assert (rank["rank"], rank["players"]) == (2, 2)
+    assert (rank["group_rank"], rank["group_players"]) == (1, 1)
+
+    # Geaendertes Ergebnis ersetzt das alte, auch in den Aggregaten
+    db_utils.save_results_bulk([[second, 1100.0]])
+    rank = db_utils.get_result_rank(second)
+    assert (rank["rank"], rank["players"]) == (1, 2)
+
+
+def test_result_without_survey_is_retried(storage):
+    user_id = new_user()
+    with pytest.raises(RetryLater) as exc:
+        db_utils.save_results_bulk([[user_id, 1000.0]])
+    assert exc.value.payloads == [[user_id, 1000.0]]
+    assert db_utils.load_result(user_id) is None
+
+
+def test_accounts(storage):
+    user_id = new_user()
+    db_utils.save_accounts_bulk([[user_id, 500.0, {"Stock A": 3}, "default", NOW]])
+    # Bestehende Konten bleiben unveraendert (Replay)
+    db_utils.save_accounts_bulk([[user_id, 900.0, {"Stock A": 7}, "default", NOW]])
+    assert db_utils.get_account(user_id) == (pytest.approx(500.0), {"Stock A": 3})
+    assert db_utils.get_account(new_user()) is None
+
+
+def test_apply_trades(storage):
+    user_id = new_user()
+    db_utils.save_surveys_bulk([survey_row(user_id)])
+    db_utils.save_accounts_bulk([[user_id, 500.0, {"Stock A": 3}, "default", NOW]])
+    repeated = trade_row(user_id, amount=2, key="repeated")
+    rows = [
+        repeated,
+        trade_row(user_id, amount=10),
+        trade_row(user_id, action="Sell", amount=20),
+        trade_row(user_id, action="Sell", amount=1, price=80.0),
+        repeated,
+        trade_row(new_user()),
+        trade_row(user_id, amount=0),
+    ]
+    with db_utils.get_db() as conn, conn.cursor() as cursor:
+        statuses = storage.apply_trades(cursor, rows)
+    assert statuses == ["ok", "cash", "holdings", "ok", "duplicate", "no_account", "invalid"]
+
+    assert db_utils.get_account(user_id) == (pytest.approx(500.0 - 200.0 + 80.0), {"Stock A": 4})
+    actions = db_utils.get_all_actions()
+    assert len(actions) == 2
+    assert set(actions["experiment_id"]) == {"default"}
+
+
+def test_trade_without_account_is_retried(storage):
+    user_id = new_user()
+    row = list(trade_row(user_id))
+    with pytest.raises(RetryLater) as exc:
+        db_utils.save_trades_bulk([row])
+    assert exc.value.payloads == [row]
+
+
+def test_drop_experiment(storage):
+    kept, dropped = new_user(), new_user()
+    db_utils.save_surveys_bulk([survey_row(kept), survey_row(dropped, experiment_id="pilot")])
+    db_utils.save_results_bulk([[kept, 1000.0], [dropped, 1200.0]])
+
+    db_utils.purge_experiment("pilot")
+    assert db_utils.load_result(dropped) is None
+    assert db_utils.load_result(kept) == pytest.approx(1000.0)
+    assert "pilot" not in db_utils.get_experiments()
+
+
+def test_replay_upgrades_old_journal_records(storage, tmp_path):
+    from spool import Spool
+
+    user_id = new_user()
+    journal = Spool(directory=str(tmp_path / "spool"), handlers=db_utils.spool.handlers,
+                    upgrade=db_utils.upgrade_journal_record)
+    # Zeilen aus Versionen ohne scenario_id/experiment_id, Lauf und traded_at
+    journal.append("survey", [survey_row(user_id)[:9]])
+    journal.append("account", [[user_id, 500.0, {"Stock A": 3}]])
+    journal.append("action", [list(trade_row(user_id))[:7]])
+    journal.append("snapshot", [[user_id, 3]])
+    journal.replay()
+    assert journal.pending == 0
+
+    assert db_utils.get_account(user_id) == (pytest.approx(400.0), {"Stock A": 4})
+    actions = db_utils.get_all_actions()
+    assert list(actions["experiment_id"]) == ["default"]
+    with open(journal.rejected_path, encoding="utf-8") as f:
+        assert '"snapshot"' in f.read()
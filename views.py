@@ -0,0 +1,59 @@
+import pandas as pd
+
+# Startwert beider Gruppen, Basis fuer die Total-Zeile
+START_VALUE = 1000
+
+PORTFOLIO_COLUMNS = ["Stock", "Amount", "Buy Price", "Current Price", "Value (€)", "Change", "Gain/Loss (€)"]
+
+
+def portfolio_table(player, stocks):
+    valuation = player.valuation(stocks)
+    if not valuation["names"]:
+        return pd.DataFrame(columns=PORTFOLIO_COLUMNS)
+
+    portfolio_data = []
+    for name, amount, buy_price, price, value, change, gain_loss in zip(
+        valuation["names"],
+        valuation["amounts"].tolist(),
+        valuation["buy_prices"].tolist(),
+        valuation["prices"].tolist(),
+        valuation["values"].tolist(),
+        valuation["change"].tolist(),
+        valuation["gain_loss"].tolist(),
+    ):
+        portfolio_data.append([
+            name,
+            amount,
+            f"{round(buy_price, 2):.2f}€",
+            f"{round(price, 2):.2f}€",
+            f"{round(value, 2):.2f}€",
+            f"{round(change, 2) if buy_price != 0 else 0}%",
+            f"{gain_loss:.2f}€"
+        ])
+
+    # Gesamtberechnung für Total-Zeile
+    total_invested = valuation["invested"]
+    total_with_capital = valuation["market_value"] + player.capital
+    total_change = round(((total_with_capital / START_VALUE - 1) * 100), 2) if total_invested else 0.0
+
+    # Capital
+    portfolio_data.append(["Cash", "", "", "", f"{round(player.capital, 2):.2f}€", "", ""])
+
+    # Total
+    portfolio_data.append([
+        "Total", "", "", "", f"{round(total_with_capital, 2):.2f}€", f"{total_change}%",
+        f"{round(total_with_capital - START_VALUE, 2):.2f}€"
+    ])
+    return pd.DataFrame(portfolio_data, columns=PORTFOLIO_COLUMNS)
+
+
+def highlight_changes(val):
+    try:
+        if isinstance(val, str) and "%" in val:
+            val = float(val.strip('%'))
+        elif isinstance(val, (int, float)):
+            val = float(val)
+        color = 'green' if val > 0 else 'red' if val < 0 else 'black'
+        return f'color: {color}'
+    except:
+        return ""